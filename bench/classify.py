@@ -0,0 +1,125 @@
+"""Per-message cost of MessageCreate handling, one listener per plugin vs classified once
+
+Run with `python -m bench.classify`. Both ways go through holster's emitter like disco's gateway events do, with raid and
+watch style plugins that do nothing once a message is theirs, so what's left is the dispatch and filtering overhead.
+Before, every plugin got its own greenlet and did its own bot, permission and watch list checks. Now one listener
+classifies the message and calls the plugins subscribed to it.
+"""
+from argparse import ArgumentParser
+from random import Random
+from tempfile import TemporaryDirectory
+import os
+
+from disco.types.permissions import Permissions
+from gevent import sleep
+from holster.emitter import Emitter
+
+from bench.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage, FakeUser, snowflake
+from utils.classify import BOT, GUILD, PRIVILEGED, WATCHED, Classifier
+from utils.metrics import metrics, perf_counter_ns
+from utils.perms import perm_cache
+from utils.store import storage
+
+WORDS = "hey what is up python code help me error with my loop function class import print why does this".split()
+BATCH = 100  # Messages emitted between letting the handlers run, like a busy gateway connection
+
+
+def traffic(rng: Random, count: int) -> list:
+    """Messages from regulars, with a few from bots, admins and watched users"""
+    guild = FakeGuild(snowflake())
+    channels = [FakeChannel(snowflake(), guild) for _ in range(20)]
+    members = []
+    for i in range(200):
+        member = FakeMember(FakeUser(snowflake(), "user{0}".format(i), bot=i < 10), guild, admin=10 <= i < 20)
+        guild.members[member.id] = member
+        members.append(member)
+    for member in members[20:24]:
+        storage.watching[member.id] = {"channel_id": snowflake()}
+    return [FakeMessage(rng.choice(members), rng.choice(channels),
+                        " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 15)))) for _ in range(count)]
+
+
+def timed(handler):
+    """What JusticePlugin.dispatch adds around every listener"""
+    histogram = metrics.histogram("listener", handler.__qualname__)
+
+    def dispatch(event):
+        start = perf_counter_ns()
+        try:
+            return handler(event)
+        finally:
+            histogram.record(perf_counter_ns() - start)
+    return dispatch
+
+
+def listeners(plugins: int, handled: list) -> Emitter:
+    def raid_listener(msg):
+        if msg.author.bot or not msg.channel.guild_id:
+            return
+        if perm_cache.for_guild(msg.channel.guild, msg.author.id).can(Permissions.ADMINISTRATOR):
+            return
+        handled.append(msg)
+
+    def watch_listener(msg):
+        watching = storage.watching.get(msg.author.id)
+        if watching is not None:
+            handled.append(msg)
+
+    emitter = Emitter()
+    for i in range(plugins):
+        emitter.on("MessageCreate", timed(watch_listener if i % 2 else raid_listener))
+    return emitter
+
+
+def classified(plugins: int, handled: list) -> Emitter:
+    def raid_subscriber(record):
+        handled.append(record.msg)
+
+    def watch_subscriber(record):
+        handled.append(record.msg)
+
+    classifier = Classifier()
+    for i in range(plugins):
+        if i % 2:
+            classifier.subscribe("MessageCreate", watch_subscriber, require=WATCHED)
+        else:
+            classifier.subscribe("MessageCreate", raid_subscriber, require=GUILD, exclude=BOT | PRIVILEGED)
+    emitter = Emitter()
+    emitter.on("MessageCreate", timed(lambda msg: classifier.dispatch("MessageCreate", msg)))
+    return emitter
+
+
+def run(build, plugins: int, messages: list) -> (float, int):
+    handled = []
+    emitter = build(plugins, handled)
+    start = perf_counter_ns()
+    for i in range(0, len(messages), BATCH):
+        for msg in messages[i:i + BATCH]:
+            emitter.emit("MessageCreate", msg)
+        sleep(0)
+    return (perf_counter_ns() - start) / len(messages), len(handled)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--messages", type=int, default=20000)
+    parser.add_argument("-p", "--plugins", type=int, action="append", help="default 2, 4 and 8")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix="justice-bench-") as path:
+        storage.open(os.path.join(path, "storage.db"), None, 0.05)
+        messages = traffic(Random(args.seed), args.messages)
+        print("{0:<8} {1:>17} {2:>18} {3:>7}".format("plugins", "listeners ns/msg", "classified ns/msg", "saved"))
+        for plugins in args.plugins or (2, 4, 8):
+            run(listeners, plugins, messages[:BATCH])  # Warm the permission cache and the code paths
+            run(classified, plugins, messages[:BATCH])
+            before, handled = run(listeners, plugins, messages)
+            after, same = run(classified, plugins, messages)
+            assert handled == same, "both ways should hand plugins the same messages"
+            print("{0:<8} {1:>17,.0f} {2:>18,.0f} {3:>6.0%}".format(plugins, before, after, 1 - after / before))
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""End to end load test against a fake Discord
+
+Run with `python -m bench.e2e`. The bot is started as it would be in production, from a scratch directory, but pointed
+at `bench.fakediscord` instead of Discord. Raids, mass joins and a busy watched user are then played to it at `--rate`
+events per second, timing how long it takes from an event reaching the gateway to the bot's REST call acting on it.
+The REST calls it made are broken down by route, with the 429s the fake's rate limits sent back, and by plugin.
+"""
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from urllib.request import urlopen
+import os
+import re
+import shutil
+import sys
+
+from gevent import sleep
+from gevent.subprocess import Popen, STDOUT
+
+from bench.fakediscord import FakeDiscord
+from bench.raid import DAY, SPAM, WORDS
+import utils.config as config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRIC = re.compile(r'^justice_rest_requests_total\{plugin="([^"]*)",route="([^"]*)"\} (\d+)$')
+
+
+class Driver:
+
+    def __init__(self, fake: FakeDiscord, rate: float, seed: int = 0):
+        self.fake = fake
+        self.interval = 1 / rate
+        self.rng = Random(seed)
+        self.results = defaultdict(list)  # Measure -> latencies in seconds
+        self.misses = Counter()  # Measure -> actions that never came
+
+    def paced(self, count: int):
+        """Yield `count` times at the configured rate, catching up rather than drifting if sending falls behind"""
+        start = perf_counter()
+        for i in range(count):
+            delay = start + i * self.interval - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            yield i
+
+    def measure(self, name: str, sent: float, call):
+        if call is None:
+            self.misses[name] += 1
+        else:
+            self.results[name].append(call.at - sent)
+
+    def command(self, name: str, content: str, predicate, channel: dict = None, timeout: float = 30.0):
+        mark = len(self.fake.calls)
+        _, sent = self.fake.message(self.fake.owner, channel or self.fake.general, content)
+        call = self.fake.wait_for(predicate, mark, timeout)
+        self.measure(name, sent, call)
+        return call
+
+    def warned(self, call) -> bool:
+        return call.route == "/channels/{channel}/messages" and call.params["channel"] == int(
+            self.fake.warn_channel["id"]) and "severity level" in call.body.get("content", "")
+
+    def reset(self):
+        self.command("]reset", "]reset", lambda call: call.route.endswith("/reactions/{emoji}/@me"))
+
+    def until_warned(self, name: str, events: int, send):
+        """Run `send` at the configured rate until the bot warns of a raid, timing from the first event"""
+        mark = len(self.fake.calls)
+        first = None
+        for i in self.paced(events):
+            sent = send(i)
+            first = first or sent
+            if any(self.warned(call) for call in self.fake.calls[mark:]):
+                break
+        self.measure(name, first, self.fake.wait_for(self.warned, mark, timeout=5))
+
+    def spam(self, rounds: int, events: int, raiders: int):
+        regulars = list(self.fake.members.values())[2:]
+        for _ in range(rounds):
+            crew = [member["user"] for member in self.rng.sample(regulars, raiders)]
+            channel = self.rng.choice(self.fake.chatter)
+            self.until_warned("raid: spam to warning", events, lambda i: self.fake.message(
+                self.rng.choice(crew), channel, SPAM if i % 2 else "{0} {1}".format(SPAM, self.rng.random()))[1])
+            self.command("raid: ]masssilence", "]masssilence " + " ".join(user["id"] for user in crew),
+                         lambda call: call.method == "PATCH" and "finished" in call.body.get("content", ""), timeout=120)
+            self.reset()
+
+    def joins(self, rounds: int, events: int):
+        for _ in range(rounds):
+            created = time() - self.rng.uniform(2, 30) * DAY  # Accounts made together, like bench.raid's joins
+            self.until_warned("joins: joins to warning", events, lambda i: self.fake.join(self.fake.user(
+                "raider{0}".format(i % 10), created + self.rng.randint(0, 3600), avatar=False)))
+            self.reset()
+
+    def watch(self, events: int, every: int):
+        regulars = list(self.fake.members.values())[2:]
+        target = regulars.pop(self.rng.randrange(len(regulars)))["user"]
+        # The bot announces the watch once it's stored, so that's when it starts
+        call = self.command("watch: ]watch", "]watch " + target["id"], lambda call: call.method == "POST" and (
+            call.body or {}).get("content", "").startswith("Watching"))
+        if call is None:
+            return
+        channel_id = call.params["channel"]
+        sent = {}  # Message ID -> when it went out
+        mark = len(self.fake.calls)
+        for i in self.paced(events):
+            if i % every:
+                author = self.rng.choice(regulars)["user"]
+                content = " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(2, 15)))
+                self.fake.message(author, self.rng.choice(self.fake.chatter), content)
+            else:
+                content = "watched {0}".format(i)
+                if self.rng.random() < 0.3:  # Walls of text too, so batches have to mind Discord's limit on embeds
+                    content += " " + " ".join(self.rng.choice(WORDS) for _ in range(400))[:1980 - len(content)]
+                msg_id, at = self.fake.message(target, self.rng.choice(self.fake.chatter), content)
+                sent[msg_id] = at
+
+        relayed = {}  # Message ID -> when its embed was posted to the watch channel
+        patience = config.WATCH_RELAY_INTERVAL * 2 + self.fake.per  # Batched, then maybe rate limited
+        deadline = perf_counter() + patience
+        while len(relayed) < len(sent) and perf_counter() < deadline:
+            for call in self.fake.calls[mark:]:
+                if call.status < 400 and call.method == "POST" and call.params.get("channel") == channel_id:
+                    for embed in call.body.get("embeds", ()):
+                        relayed.setdefault(int(embed.get("url", "/0").rsplit("/", 1)[1]), call.at)
+            mark = len(self.fake.calls)
+            if relayed and max(relayed.values()) > deadline - patience:  # Still catching up
+                deadline = perf_counter() + patience
+            sleep(0.1)
+        for msg_id, at in sent.items():
+            if msg_id in relayed:
+                self.results["watch: message to relay"].append(relayed[msg_id] - at)
+            else:
+                self.misses["watch: message to relay"] += 1
+        self.command("watch: ]close", "]close", lambda call: call.method == "DELETE" and call.params.get(
+            "channel") == channel_id, channel=self.fake.channels.get(channel_id, self.fake.general))
+
+
+def plugin_calls(port: int) -> Counter:
+    """REST calls by plugin and route, from the bot's metrics endpoint"""
+    counts = Counter()
+    with urlopen("http://127.0.0.1:{0}/metrics".format(port), timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            match = METRIC.match(line)
+            if match:
+                counts[match.group(1), match.group(2)] += int(match.group(3))
+    return counts
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--scenario", choices=("raid", "joins", "watch"), action="append")
+    parser.add_argument("-r", "--rate", type=float, default=50, help="events per second")
+    parser.add_argument("--rounds", type=int, default=3, help="raids and mass joins to play")
+    parser.add_argument("--raiders", type=int, default=10)
+    parser.add_argument("-n", "--events", type=int, default=500, help="most events per raid, and the watch run length")
+    parser.add_argument("--every", type=int, default=5, help="watch run events per message from the watched user")
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=5, help="requests per route and channel or guild")
+    parser.add_argument("--per", type=float, default=5.0, help="seconds --limit applies to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log", help="where to keep the bot's log, it's thrown away by default")
+    args = parser.parse_args()
+
+    fake = FakeDiscord(args.members, args.limit, args.per)
+    fake.start()
+    with TemporaryDirectory(prefix="justice-e2e-") as path:
+        shutil.copy(os.path.join(ROOT, "config.json"), path)
+        env = dict(os.environ, token="fake", DISCORD_API_BASE=fake.api_base, NO_PROXY="127.0.0.1,localhost",
+                   no_proxy="127.0.0.1,localhost")
+        log = open(args.log or os.path.join(path, "bot.log"), "wb")
+        bot = Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=path, env=env, stdout=log, stderr=STDOUT)
+        driver = Driver(fake, args.rate, args.seed)
+        try:
+            # The bot is up once it answers a command
+            if not fake.identified.wait(60) or driver.command(
+                    "startup: ]help", "]help", lambda call: call.method == "POST", timeout=60) is None:
+                log.flush()
+                sys.exit("The bot didn't come up, its log:\n" + open(log.name, errors="replace").read()[-4000:])
+            scenarios = args.scenario or ("raid", "joins", "watch")
+            if "raid" in scenarios:
+                driver.spam(args.rounds, args.events, args.raiders)
+            if "joins" in scenarios:
+                driver.joins(args.rounds, args.events)
+            if "watch" in scenarios:
+                driver.watch(args.events, args.every)
+            plugins = plugin_calls(config.METRICS_PORT)
+        finally:
+            bot.terminate()
+            bot.wait()
+            log.close()
+            fake.stop()
+
+    print("{0:<28} {1:>6} {2:>7} {3:>10} {4:>10} {5:>10}".format("measure", "n", "missed", "p50 ms", "p99 ms", "max ms"))
+    for name, latencies in driver.results.items():
+        latencies.sort()
+        print("{0:<28} {1:>6} {2:>7} {3:>10.1f} {4:>10.1f} {5:>10.1f}".format(
+            name, len(latencies), driver.misses[name], percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+    for name in driver.misses.keys() - driver.results.keys():
+        print("{0:<28} {1:>6} {2:>7}".format(name, 0, driver.misses[name]))
+
+    print("\n{0:<66} {1:>7} {2:>7}".format("route", "calls", "429s"))
+    for name, count in fake.counts.most_common():
+        print("{0:<66} {1:>7} {2:>7}".format(name, count, fake.throttled[name]))
+
+    print("\n{0:<12} {1:<66} {2:>7}".format("plugin", "route", "calls"))
+    for (plugin, route), count in plugins.most_common():
+        print("{0:<12} {1:<66} {2:>7}".format(plugin, route, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""A local stand-in for Discord's gateway and REST API, for end to end load tests
+
+It serves one guild, the one in utils/config.py, over a plain WebSocket gateway and a REST API on /api/v7 with Discord's
+rate limit headers and 429s. Changes made through the API are sent back over the gateway like Discord does, and every
+REST call is recorded so a driver like `bench.e2e` can time how long the bot took to act.
+"""
+from base64 import b64encode
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from hashlib import sha1
+from math import ceil
+from time import perf_counter, time
+from urllib.parse import parse_qs, urlsplit
+import json
+import re
+import struct
+import zlib
+
+from gevent.event import AsyncResult, Event
+from gevent.lock import Semaphore
+from gevent.pywsgi import WSGIServer
+from gevent.server import StreamServer
+
+from bench.fakes import snowflake
+import utils.config as config
+
+API = "/api/v7"
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HEARTBEAT_INTERVAL = 41250
+EVERYONE = 0x6FFFFE41  # Everything but administration
+UNKNOWN_CHANNEL = 10003  # Error codes for what isn't there, anything else is just unknown
+EMBED_LIMIT = 6000  # Characters over all the embeds of a message
+
+# Method, route and the handler for it. The channel or guild is the major parameter Discord limits each route by
+ROUTES = [
+    ("GET", "/gateway", "gateway"),
+    ("GET", "/gateway/bot", "gateway"),
+    ("GET", "/users/@me", "get_me"),
+    ("GET", "/users/{user}", "get_user"),
+    ("GET", "/channels/{channel}", "get_channel"),
+    ("PATCH", "/channels/{channel}", "get_channel"),
+    ("DELETE", "/channels/{channel}", "delete_channel"),
+    ("POST", "/channels/{channel}/messages", "create_message"),
+    ("PATCH", "/channels/{channel}/messages/{message}", "edit_message"),
+    ("DELETE", "/channels/{channel}/messages/{message}", "no_content"),
+    ("PUT", "/channels/{channel}/messages/{message}/reactions/{emoji}/@me", "no_content"),
+    ("PUT", "/channels/{channel}/permissions/{overwrite}", "edit_overwrite"),
+    ("DELETE", "/channels/{channel}/permissions/{overwrite}", "no_content"),
+    ("GET", "/channels/{channel}/invites", "list_invites"),
+    ("POST", "/channels/{channel}/invites", "create_invite"),
+    ("DELETE", "/invites/{invite}", "delete_invite"),
+    ("GET", "/guilds/{guild}", "get_guild"),
+    ("GET", "/guilds/{guild}/channels", "list_channels"),
+    ("POST", "/guilds/{guild}/channels", "create_channel"),
+    ("GET", "/guilds/{guild}/invites", "list_invites"),
+    ("GET", "/guilds/{guild}/members/{user}", "get_member"),
+    ("DELETE", "/guilds/{guild}/members/{user}", "remove_member"),
+    ("PUT", "/guilds/{guild}/members/{user}/roles/{role}", "add_role"),
+    ("DELETE", "/guilds/{guild}/members/{user}/roles/{role}", "remove_role"),
+    ("PUT", "/guilds/{guild}/bans/{user}", "remove_member"),
+    ("PATCH", "/guilds/{guild}/roles/{role}", "edit_role"),
+]
+
+Call = namedtuple("Call", "at method route params status body")
+
+
+class NotFound(Exception):
+    """Answered with a 404 carrying Discord's error code, the first argument"""
+
+
+def _compile(route: str):
+    return re.compile("^{0}$".format(re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(route))))
+
+
+def _stamp(unix: float = None) -> str:
+    return datetime.fromtimestamp(time() if unix is None else unix, timezone.utc).isoformat()
+
+
+def _unmask(mask: bytes, data: bytes) -> bytes:
+    key = (mask * (len(data) // 4 + 1))[:len(data)]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(len(data), "big")
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    size = len(payload)
+    if size < 126:
+        header = struct.pack("!BB", 0x80 | opcode, size)
+    elif size < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, size)
+    return header + payload
+
+
+class Session:
+    """One gateway connection, identified as a shard"""
+
+    def __init__(self, sock, compress: bool):
+        self.sock = sock
+        self.shard = None  # (id, count) once identified
+        self.seq = 0
+        self._zlib = zlib.compressobj() if compress else None
+        self._lock = Semaphore()
+
+    def owns(self, guild_id: int) -> bool:
+        return self.shard is not None and (guild_id >> 22) % self.shard[1] == self.shard[0]
+
+    def send(self, op: int, data, name: str = None):
+        with self._lock:  # Sequence numbers and the compression stream both have to go out in order
+            if name is not None:
+                self.seq += 1
+            payload = json.dumps({"op": op, "d": data, "s": self.seq if name else None, "t": name}).encode()
+            if self._zlib is None:
+                self.sock.sendall(_frame(0x1, payload))
+            else:
+                self.sock.sendall(_frame(0x2, self._zlib.compress(payload) + self._zlib.flush(zlib.Z_SYNC_FLUSH)))
+
+
+class FakeDiscord:
+    """Gateway and REST API for one guild with an owner, the bot, `members` other members and a few channels.
+
+    `limit` requests per `per` seconds are allowed on each route and major parameter, and `global_limit` per second in
+    all, past which the request gets a 429 like it would from Discord.
+    """
+
+    def __init__(self, members: int = 200, limit: int = 5, per: float = 5.0, global_limit: int = 50):
+        self.limit, self.per, self.global_limit = limit, per, global_limit
+        self.routes = [(method, route, _compile(route), handler) for method, route, handler in ROUTES]
+        self.sessions = []
+        self.calls = []
+        self.counts = Counter()  # "METHOD /route" -> requests
+        self.throttled = Counter()  # "METHOD /route" -> 429s
+        self.buckets = {}  # (method, route, major) or None for the global limit -> [remaining, reset]
+        self._waiters = []
+        self.identified = Event()  # Set once a shard has been sent the guild
+        self.gateway_server = self.rest_server = None
+
+        self.guild_id = config.GUILD_ID
+        self.bot = self.user("Justice", bot=True, id=config.BOT_ID)
+        self.owner = self.user("owner")
+        self.users = {}
+        self.members = {}
+        self.roles = {
+            self.guild_id: self._role(self.guild_id, "@everyone", EVERYONE),
+            config.MUTE_ROLE_ID: self._role(config.MUTE_ROLE_ID, "Muted", 0),
+        }
+        self.channels = {}
+        self.channel(config.WATCH_CATEGORY, "watching", type=4)
+        self.warn_channel = self.channel(config.GUILDS.get(self.guild_id, {}).get("WARN_CHANNEL"), "mod-alerts")
+        self.general = self.channel(None, "general")
+        self.chatter = [self.general] + [self.channel(None, "help-{0}".format(i)) for i in range(5)]
+        self.messages = 0
+        for user in (self.bot, self.owner):
+            self.add_member(user)
+        for i in range(members):
+            self.add_member(self.user("member{0}".format(i)))
+
+    # Guild contents, as they'd appear in gateway payloads
+
+    def user(self, username: str, created: float = None, avatar: bool = True, bot: bool = False, id: int = None):
+        user_id = id or snowflake(created)
+        return {"id": str(user_id), "username": username, "discriminator": "{0:04}".format(user_id % 10000),
+                "avatar": "a1b2c3" if avatar else None, "bot": bot}
+
+    @staticmethod
+    def _role(role_id: int, name: str, permissions: int) -> dict:
+        return {"id": str(role_id), "name": name, "permissions": permissions, "position": 0, "color": 0,
+                "hoist": False, "managed": False, "mentionable": False}
+
+    def channel(self, channel_id: int, name: str, type: int = 0, parent_id: int = None) -> dict:
+        channel_id = channel_id or snowflake()
+        channel = self.channels[channel_id] = {
+            "id": str(channel_id), "guild_id": str(self.guild_id), "name": name, "type": type, "position": 0,
+            "parent_id": str(parent_id) if parent_id else None, "permission_overwrites": [], "nsfw": False}
+        return channel
+
+    def add_member(self, user: dict) -> dict:
+        user_id = int(user["id"])
+        self.users[user_id] = user
+        member = self.members[user_id] = {"user": user, "roles": [], "nick": None, "joined_at": _stamp(),
+                                          "deaf": False, "mute": False}
+        return member
+
+    def guild(self) -> dict:
+        return {"id": str(self.guild_id), "name": "Fake Guild", "owner_id": self.owner["id"], "region": "us-east",
+                "roles": list(self.roles.values()), "channels": list(self.channels.values()),
+                "members": list(self.members.values()), "member_count": len(self.members), "large": False,
+                "unavailable": False, "joined_at": _stamp(), "voice_states": [], "presences": [], "emojis": [],
+                "features": [], "verification_level": 0, "afk_timeout": 300}
+
+    # Gateway
+
+    def dispatch(self, name: str, data: dict) -> float:
+        """Send an event to the shard the guild is on, returning when it went out"""
+        sent = perf_counter()
+        for session in self.sessions:
+            if session.owns(self.guild_id):
+                session.send(0, data, name)
+        return sent
+
+    def join(self, user: dict) -> float:
+        member = self.add_member(user)
+        return self.dispatch("GUILD_MEMBER_ADD", dict(member, guild_id=str(self.guild_id)))
+
+    def message(self, author: dict, channel: dict, content: str) -> (int, float):
+        """Send a message from `author`, returning its ID and when it went out"""
+        msg = self._message(author, channel, content)
+        return int(msg["id"]), self.dispatch("MESSAGE_CREATE", msg)
+
+    def _message(self, author: dict, channel: dict, content: str = "", embeds: list = ()) -> dict:
+        self.messages += 1
+        return {"id": str(snowflake()), "channel_id": channel["id"], "guild_id": channel["guild_id"], "author": author,
+                "content": content, "timestamp": _stamp(), "edited_timestamp": None, "tts": False,
+                "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+                "embeds": list(embeds), "pinned": False, "type": 0}
+
+    def _handshake(self, reader, sock) -> bool:
+        request = []
+        for line in iter(reader.readline, b""):
+            if line in (b"\r\n", b"\n"):
+                break
+            request.append(line.decode("latin-1").strip())
+        else:
+            return None
+        headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in request[1:])}
+        accept = b64encode(sha1(headers["sec-websocket-key"].encode() + WS_GUID).digest()).decode()
+        sock.sendall("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     "Sec-WebSocket-Accept: {0}\r\n\r\n".format(accept).encode())
+        query = parse_qs(urlsplit(request[0].split()[1]).query)
+        return query.get("compress") == ["zlib-stream"]
+
+    @staticmethod
+    def _read_frame(reader) -> (int, bytes):
+        header = reader.read(2)
+        if len(header) < 2:
+            return None, None
+        opcode, size = header[0] & 0x0F, header[1] & 0x7F
+        if size == 126:
+            size, = struct.unpack("!H", reader.read(2))
+        elif size == 127:
+            size, = struct.unpack("!Q", reader.read(8))
+        mask = reader.read(4) if header[1] & 0x80 else None
+        payload = reader.read(size)
+        return opcode, _unmask(mask, payload) if mask else payload
+
+    def _serve_gateway(self, sock, address):
+        reader = sock.makefile("rb")
+        compress = self._handshake(reader, sock)
+        if compress is None:
+            return
+        session = Session(sock, compress)
+        self.sessions.append(session)
+        try:
+            session.send(10, {"heartbeat_interval": HEARTBEAT_INTERVAL, "_trace": ["fake-gateway"]})
+            while True:
+                opcode, payload = self._read_frame(reader)
+                if opcode is None or opcode == 0x8:
+                    break
+                elif opcode == 0x9:
+                    with session._lock:
+                        sock.sendall(_frame(0xA, payload))
+                elif opcode in (0x1, 0x2):
+                    self._on_packet(session, json.loads(payload))
+        except OSError:
+            pass
+        finally:
+            self.sessions.remove(session)
+            sock.close()
+
+    def _on_packet(self, session: Session, packet: dict):
+        op, data = packet["op"], packet["d"]
+        if op == 1:  # Heartbeat
+            session.send(11, None)
+        elif op == 2:  # Identify
+            session.shard = tuple(data.get("shard") or (0, 1))
+            owned = session.owns(self.guild_id)
+            session.send(0, {"v": 6, "session_id": "fake-{0}".format(id(session)), "user": self.bot,
+                             "guilds": [{"id": str(self.guild_id), "unavailable": True}] if owned else [],
+                             "private_channels": [], "_trace": ["fake-gateway"]}, "READY")
+            if owned:
+                session.send(0, self.guild(), "GUILD_CREATE")
+                self.identified.set()
+        elif op == 6:  # Resume, sessions aren't kept so start over
+            session.send(9, False)
+        elif op == 8:  # Request guild members
+            session.send(0, {"guild_id": str(self.guild_id), "members": list(self.members.values())},
+                         "GUILD_MEMBERS_CHUNK")
+
+    # REST
+
+    def _limit(self, key, limit: int, per: float, now: float) -> list:
+        bucket = self.buckets.get(key)
+        if bucket is None or now >= bucket[1]:
+            bucket = self.buckets[key] = [limit, ceil(now + per)]  # Discord resets on whole seconds
+        return bucket
+
+    def _rest(self, environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        for route_method, route, pattern, handler in self.routes:
+            match = pattern.match(path[len(API):]) if path.startswith(API) and route_method == method else None
+            if match:
+                break
+        else:
+            start_response("404 Not Found", [("Content-Type", "application/json")])
+            return [b'{"message": "404: Not Found", "code": 0}']
+
+        name = "{0} {1}".format(method, route)
+        params = {key: int(value) if value.isdigit() else value for key, value in match.groupdict().items()}
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = json.loads(environ["wsgi.input"].read(length)) if length else None
+        self.counts[name] += 1
+
+        now = time()
+        major = params.get("channel", params.get("guild"))
+        bucket = self._limit((method, route, major), self.limit, self.per, now)
+        world = self._limit(None, self.global_limit, 1.0, now)
+        if not bucket[0] or not world[0]:
+            is_global = not world[0]
+            retry_after = ceil(((world if is_global else bucket)[1] - now) * 1000)
+            self.throttled[name] += 1
+            self._record(Call(perf_counter(), method, route, params, 429, body))
+            headers = [("Content-Type", "application/json"), ("Retry-After", str(retry_after))]
+            if is_global:
+                headers.append(("X-RateLimit-Global", "true"))
+            start_response("429 Too Many Requests", headers)
+            return [json.dumps({"message": "You are being rate limited.", "retry_after": retry_after,
+                                "global": is_global}).encode()]
+        bucket[0] -= 1
+        world[0] -= 1
+
+        try:
+            status, result = getattr(self, handler)(body, **params)
+        except NotFound as e:
+            status, result = 404, {"message": "Unknown", "code": e.args[0] if e.args else 10000}
+        self._record(Call(perf_counter(), method, route, params, status, body))
+        headers = [("X-RateLimit-Limit", str(self.limit)), ("X-RateLimit-Remaining", str(bucket[0])),
+                   ("X-RateLimit-Reset", str(bucket[1]))]
+        if result is None:
+            start_response("{0} No Content".format(status), headers)
+            return [b""]
+        start_response("{0} {1}".format(status, "OK" if status < 400 else "Error"),
+                       headers + [("Content-Type", "application/json")])
+        return [json.dumps(result).encode()]
+
+    def _record(self, call: Call):
+        self.calls.append(call)
+        for waiter in list(self._waiters):
+            predicate, result = waiter
+            if predicate(call):
+                self._waiters.remove(waiter)
+                result.set(call)
+
+    def wait_for(self, predicate, since: int = 0, timeout: float = 30.0) -> Call:
+        """The first call from index `since` on that `predicate` accepts, waiting for it if need be. None on timeout"""
+        for call in self.calls[since:]:
+            if predicate(call):
+                return call
+        waiter = (predicate, AsyncResult())
+        self._waiters.append(waiter)
+        if waiter[1].wait(timeout) is None:
+            self._waiters.remove(waiter)
+        return waiter[1].value
+
+    def _find(self, table: dict, key: int) -> dict:
+        if key not in table:
+            raise NotFound(UNKNOWN_CHANNEL if table is self.channels else 10000)
+        return table[key]
+
+    @staticmethod
+    def no_content(body, **params):
+        return 204, None
+
+    def gateway(self, body):
+        return 200, {"url": "ws://127.0.0.1:{0}".format(self.gateway_server.server_port), "shards": 1}
+
+    def get_me(self, body):
+        return 200, self.bot
+
+    def get_user(self, body, user):
+        return 200, self._find(self.users, user)
+
+    def get_channel(self, body, channel):
+        return 200, self._find(self.channels, channel)
+
+    def delete_channel(self, body, channel):
+        deleted = self.channels.pop(channel, None) or self._find(self.channels, channel)
+        self.dispatch("CHANNEL_DELETE", deleted)
+        return 200, deleted
+
+    def create_message(self, body, channel):
+        embeds = body.get("embeds") or ([body["embed"]] if body.get("embed") else [])
+        size = sum(len(text or "") for embed in embeds for text in (
+            embed.get("title"), embed.get("description"), (embed.get("footer") or {}).get("text"),
+            (embed.get("author") or {}).get("name"),
+            *(part for field in embed.get("fields") or () for part in (field.get("name"), field.get("value")))))
+        if len(embeds) > 10 or size > EMBED_LIMIT:
+            return 400, {"message": "Invalid Form Body", "code": 50035,
+                         "errors": {"embeds": "{0} embeds of {1} characters".format(len(embeds), size)}}
+        msg = self._message(self.bot, self._find(self.channels, channel), body.get("content", ""), embeds)
+        self.dispatch("MESSAGE_CREATE", msg)
+        return 200, msg
+
+    def edit_message(self, body, channel, message):
+        msg = self._message(self.bot, self._find(self.channels, channel), body.get("content", ""))
+        msg.update(id=str(message), edited_timestamp=_stamp())
+        return 200, msg
+
+    def edit_overwrite(self, body, channel, overwrite):
+        target = self._find(self.channels, channel)
+        target["permission_overwrites"] = [item for item in target["permission_overwrites"]
+                                           if item["id"] != str(overwrite)]
+        target["permission_overwrites"].append(dict(body, id=str(overwrite)))
+        self.dispatch("CHANNEL_UPDATE", target)
+        return 204, None
+
+    @staticmethod
+    def list_invites(body, **params):
+        return 200, []
+
+    def create_invite(self, body, channel):
+        return 200, {"code": "fake{0}".format(len(self.calls)), "channel": self._find(self.channels, channel),
+                     "guild": {"id": str(self.guild_id)}, "max_age": body.get("max_age", 86400),
+                     "max_uses": body.get("max_uses", 0), "temporary": body.get("temporary", False), "uses": 0}
+
+    def delete_invite(self, body, invite):
+        return 200, {"code": invite, "channel": self.general, "guild": {"id": str(self.guild_id)}}
+
+    def get_guild(self, body, guild):
+        return 200, self.guild()
+
+    def list_channels(self, body, guild):
+        return 200, list(self.channels.values())
+
+    def create_channel(self, body, guild):
+        channel = self.channel(None, body["name"], body.get("type", 0), body.get("parent_id"))
+        self.dispatch("CHANNEL_CREATE", channel)
+        return 200, channel
+
+    def get_member(self, body, guild, user):
+        return 200, self._find(self.members, user)
+
+    def remove_member(self, body, guild, user):
+        member = self.members.pop(user, None) or self._find(self.members, user)
+        self.dispatch("GUILD_MEMBER_REMOVE", {"guild_id": str(guild), "user": member["user"]})
+        return 204, None
+
+    def _update_roles(self, guild: int, user: int, change):
+        member = self._find(self.members, user)
+        member["roles"] = change(member["roles"])
+        self.dispatch("GUILD_MEMBER_UPDATE", dict(member, guild_id=str(guild)))
+        return 204, None
+
+    def add_role(self, body, guild, user, role):
+        return self._update_roles(guild, user, lambda roles: roles + [str(role)] if str(role) not in roles else roles)
+
+    def remove_role(self, body, guild, user, role):
+        return self._update_roles(guild, user, lambda roles: [item for item in roles if item != str(role)])
+
+    def edit_role(self, body, guild, role):
+        target = self._find(self.roles, role)
+        target.update(body or {})
+        self.dispatch("GUILD_ROLE_UPDATE", {"guild_id": str(guild), "role": target})
+        return 200, target
+
+    def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Serve the gateway and REST API on free ports, REST's base URL is `api_base` once started"""
+        self.gateway_server = StreamServer((host, 0), self._serve_gateway)
+        self.gateway_server.start()
+        self.rest_server = WSGIServer((host, port), self._rest, log=None, error_log=None)
+        self.rest_server.start()
+
+    @property
+    def api_base(self) -> str:
+        return "http://127.0.0.1:{0}{1}".format(self.rest_server.server_port, API)
+
+    def stop(self):
+        for server in (self.rest_server, self.gateway_server):
+            if server is not None:
+                server.stop(timeout=1)
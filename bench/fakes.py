@@ -0,0 +1,126 @@
+from itertools import count
+import time
+
+DISCORD_EPOCH = 1420070400000
+
+_sequence = count()
+
+
+def snowflake(timestamp: float = None) -> int:
+    ms = int((time.time() if timestamp is None else timestamp) * 1000)
+    return ((ms - DISCORD_EPOCH) << 22) | (next(_sequence) & 0x3FFFFF)
+
+
+class FakePermissions:
+
+    def __init__(self, admin: bool = False):
+        self.admin = admin
+
+    def can(self, *perms):
+        return self.admin
+
+
+class FakeUser:
+
+    def __init__(self, id: int, username: str, avatar: str = None, bot: bool = False):
+        self.id = id
+        self.username = username
+        self.discriminator = "{0:04}".format(id % 10000)
+        self.avatar = avatar
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return "<@{0}>".format(self.id)
+
+
+class FakeGuild:
+
+    def __init__(self, id: int):
+        self.id = id
+        self.members = {}
+
+    def get_member(self, user_id: int):
+        return self.members.get(user_id)
+
+    def get_permissions(self, user_id: int):
+        member = self.members.get(user_id)
+        return member.permissions if member else FakePermissions()
+
+
+class FakeMember:
+
+    def __init__(self, user: FakeUser, guild: FakeGuild, admin: bool = False):
+        self.id = user.id
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.roles = []
+        self.permissions = FakePermissions(admin)
+
+
+class FakeChannel:
+
+    def __init__(self, id: int, guild: FakeGuild):
+        self.id = id
+        self.guild = guild
+        self.guild_id = guild.id
+
+    def get_permissions(self, user_id: int):
+        return self.guild.get_permissions(user_id)
+
+    def send_message(self, *args, **kwargs):
+        pass
+
+
+class FakeMessage:
+
+    def __init__(self, member: FakeMember, channel: FakeChannel, content: str):
+        self.id = snowflake()
+        self.author = member.user
+        self.member = member
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = channel.guild
+        self.content = content
+        self.edited_timestamp = None
+
+
+class FakeAPI:
+    """Swallows REST calls, counting them per method"""
+
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.calls = {}
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return FakeChannel(args[0] if args else 0, self.guild)
+        return call
+
+
+class FakeState:
+    """An empty gateway cache, so every lookup falls through to the API"""
+
+    def __init__(self):
+        self.guilds = {}
+        self.users = {}
+        self.channels = {}
+
+
+class FakeClient:
+
+    def __init__(self, guild: FakeGuild):
+        self.api = FakeAPI(guild)
+        self.state = FakeState()
+
+
+class FakePlugin:
+    """Enough of a disco plugin for pools to register their schedules with"""
+
+    def register_schedule(self, func, interval, repeat=True, init=True):
+        pass
+
+    def spawn(self, func, *args, **kwargs):
+        return func(*args, **kwargs)  # Right away, so runs stay deterministic
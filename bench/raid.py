@@ -0,0 +1,157 @@
+"""Offline raid detection benchmarks
+
+Run with `python -m bench.raid`, see `--help` for picking scenarios and targets.
+"""
+from argparse import ArgumentParser
+from random import Random
+from tempfile import TemporaryDirectory
+import os
+import time
+import tracemalloc
+
+from bench.fakes import (FakeChannel, FakeClient, FakeGuild, FakeMember, FakeMessage, FakePlugin, FakeUser,
+                         snowflake)
+from plugins.raid import RaidPlug
+import utils.config as config
+from utils.classify import classifier
+from utils.snapshot import snapshots
+from utils.trap import MemberPool, MessagePool, RaidSession, Raider
+from utils.warm import warm
+
+WORDS = "hey what is up python code help me error with my loop function class import print why does this".split()
+SPAM = "JOIN NOW discord.gg/free-nitro get your FREE nitro here!!!"
+DAY = 24 * 60 * 60
+SCRATCH = TemporaryDirectory(prefix="justice-bench-")  # Keeps the plugin's storage and snapshot out of the tree
+
+
+def _member(rng: Random, guild: FakeGuild, created: float = None, name: str = None, avatar: bool = True):
+    user = FakeUser(snowflake(created or time.time() - rng.randint(30, 2000) * DAY),
+                    name or "".join(rng.choice("abcdefghijklmnop") for _ in range(8)),
+                    avatar="a1b2c3" if avatar else None)
+    member = FakeMember(user, guild)
+    guild.members[member.id] = member
+    return member
+
+
+def quiet(rng: Random, guild: FakeGuild, events: int):
+    """Normal chatter from a stable set of users, with the odd legitimate join"""
+    members = [_member(rng, guild) for _ in range(100)]
+    channels = [FakeChannel(snowflake(), guild) for _ in range(20)]
+    for i in range(events):
+        if i % 50 == 49:
+            yield "join", _member(rng, guild)
+        else:
+            content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 15)))
+            yield "message", FakeMessage(rng.choice(members), rng.choice(channels), content)
+
+
+def spam(rng: Random, guild: FakeGuild, events: int):
+    """Copy-paste spam from a handful of raiders in one channel, half of it padded to dodge exact matching"""
+    raiders = [_member(rng, guild) for _ in range(30)]
+    channel = FakeChannel(snowflake(), guild)
+    for i in range(events):
+        content = SPAM if i % 2 else "{0} {1}".format(SPAM, rng.randint(0, 10 ** 6))
+        yield "message", FakeMessage(rng.choice(raiders), channel, content)
+
+
+def joins(rng: Random, guild: FakeGuild, events: int):
+    """Mass join of avatar-less accounts all created on the same day"""
+    created = time.time() - 2 * DAY
+    for i in range(events):
+        yield "join", _member(rng, guild, created + rng.randint(0, 3600), "raider{0}".format(i % 10), avatar=False)
+
+
+def mixed(rng: Random, guild: FakeGuild, events: int):
+    """Quiet traffic with spam and joins flooding in on top"""
+    sources = [quiet(rng, guild, events), spam(rng, guild, events), joins(rng, guild, events)]
+    for i in range(events):
+        yield next(sources[i % 3])
+
+
+SCENARIOS = {"quiet": quiet, "spam": spam, "joins": joins, "mixed": mixed}
+
+
+def pools_target(guild: FakeGuild):
+    session = RaidSession()
+    join_pool, msg_pool = MemberPool(session), MessagePool(session)
+    return {"join": join_pool.fill, "message": msg_pool.fill}
+
+
+def plugin_target(guild: FakeGuild):
+    config.GUILDS[guild.id] = {"WARN_CHANNEL": snowflake()}
+    config.STORAGE_PATH, config.LEGACY_STORAGE_PATH = os.path.join(SCRATCH.name, "storage.db"), None
+    warm.path = os.path.join(SCRATCH.name, "warm.snapshot")
+    plugin = RaidPlug.__new__(RaidPlug)  # Skip disco's binding, we only drive the handlers
+    plugin.client = FakeClient(guild)
+    snapshots.bind(plugin.client)
+    fake = FakePlugin()
+    plugin.register_schedule, plugin.spawn = fake.register_schedule, fake.spawn
+    plugin.load(None)
+    classifier.unsubscribe(plugin.on_message)  # Messages are classified and handed over directly below
+    return {"join": plugin.on_join, "message": lambda msg: plugin.on_message(classifier.classify(msg))}
+
+
+def attach_target(guild: FakeGuild):
+    session = RaidSession()
+    return {"join": lambda member: session.attach(member.id, Raider.set_join_raid, member),
+            "message": lambda msg: session.attach(msg.author.id, Raider.add_msg, msg)}
+
+
+TARGETS = {"pools": pools_target, "plugin": plugin_target, "attach": attach_target}
+
+
+def _events(scenario: str, count: int, seed: int):
+    guild = FakeGuild(snowflake())
+    return guild, list(SCENARIOS[scenario](Random(seed), guild, count))
+
+
+def run(scenario: str, target: str, count: int, seed: int = 0) -> dict:
+    guild, events = _events(scenario, count, seed)
+    handlers = TARGETS[target](guild)
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for kind, obj in events:
+        before = clock()
+        handlers[kind](obj)
+        latencies.append(clock() - before)
+    total = clock() - start
+
+    # Memory is measured on a separate pass, tracemalloc would skew the timings
+    guild, events = _events(scenario, count, seed)
+    handlers = TARGETS[target](guild)
+    tracemalloc.start()
+    for kind, obj in events:
+        handlers[kind](obj)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "target": target,
+        "rate": count / total,
+        "p50": latencies[len(latencies) // 2] * 1e6,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6,
+        "peak": peak / 1024,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=10000)
+    parser.add_argument("-s", "--scenario", choices=SCENARIOS, action="append")
+    parser.add_argument("-t", "--target", choices=TARGETS, action="append")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("{0:<8} {1:<8} {2:>12} {3:>10} {4:>10} {5:>11}".format(
+        "scenario", "target", "events/s", "p50 us", "p99 us", "peak KiB"))
+    for scenario in args.scenario or SCENARIOS:
+        for target in args.target or TARGETS:
+            result = run(scenario, target, args.events, args.seed)
+            print("{scenario:<8} {target:<8} {rate:>12,.0f} {p50:>10.1f} {p99:>10.1f} {peak:>11,.1f}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
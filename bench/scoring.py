@@ -0,0 +1,153 @@
+"""Check that the raid pools score the same from their running aggregates as from recounting the pool
+
+Run with `python -m bench.scoring`. Randomized joins and messages are fed to small pools on a fake clock, with time
+jumping past the window now and then and the pool overflowing, so objects leave through both expiry and eviction. After
+every event the pool's severity is compared with one worked out the slow way, by going over everything still pooled
+with today's rules. Any difference fails an assertion, naming the seed and event to replay it with.
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from random import Random
+import time
+
+from bench.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage, FakeUser, snowflake
+from utils.cohort import analyze
+import utils.trap as trap
+
+DAY = 24 * 60 * 60
+NAMES = ("raider", "raider", "spammer", "alice", "bob")
+TEXTS = ("JOIN NOW discord.gg/free-nitro get your FREE nitro here!!!", "hey what is up", "help me with my loop")
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def recount_members(pool: trap.MemberPool) -> int:
+    members = list(pool.pool)
+    assert Counter(member.user.username for member in members) == pool.usernames, "username counts drifted"
+    assert sum(member.user.avatar is None for member in members) == pool.avatarless, "avatar-less count drifted"
+
+    size = len(members)
+    severity = size // pool.max_members
+    if size > pool.max_members:
+        if all(member.user.avatar is None for member in members):
+            severity += 2
+        cohort = analyze((member.id for member in members), time.time())
+        if cohort.clustered >= size * pool.cohort_ratio:
+            severity += 4
+        if len({member.user.username for member in members}) == 1:
+            severity += 6
+    return severity
+
+
+def hottest(tracker, now: float) -> float:
+    return max((tracker.overdraft(key, now) for key in tracker._buckets), default=0.0)
+
+
+def recount_messages(pool: trap.MessagePool, now: float) -> int:
+    msgs = list(pool.pool)
+    assert Counter(hash(msg.content) for msg in msgs) == pool.contents, "content counts drifted"
+    assert Counter(msg.author.id for msg in msgs) == pool.authors, "author counts drifted"
+    assert set(pool.near_dups._entries) == {msg.id for msg in msgs}, "near-dup index out of step with the pool"
+    clusters = Counter(cluster for _, cluster in pool.near_dups._entries.values())
+    largest = max(clusters.values(), default=0)
+    assert largest == pool.near_dups.largest, "largest near-dup cluster drifted"
+    assert hottest(pool.channel_rates, now) == pool.channel_rates.hottest(now)[1], "hottest channel drifted"
+    assert hottest(pool.author_rates, now) == pool.author_rates.hottest(now)[1], "hottest author drifted"
+
+    overdraft = max(hottest(pool.guild_rates, now), hottest(pool.channel_rates, now) + hottest(pool.author_rates, now))
+    severity = int(overdraft) // pool.max_messages
+    if severity:
+        if len({msg.content for msg in msgs}) == 1:
+            severity += 3
+        else:
+            severity += min(3, largest // pool.max_messages)
+        if len({msg.author.id for msg in msgs}) == 1:
+            severity += 1
+    return severity
+
+
+def events(rng: Random, guild: FakeGuild, count: int):
+    """Joins and messages drawn from small sets, so every bonus gets both earned and lost along the way"""
+    now = time.time()
+    members = []
+    channels = [FakeChannel(snowflake(), guild) for _ in range(3)]
+    authors, texts, padded = 6, TEXTS, 0.5
+    for _ in range(count):
+        if rng.random() < 0.02:  # Switch between chatter and one account repeating itself
+            authors, texts, padded = (1, TEXTS[:1], 0.0) if rng.random() < 0.5 else (6, TEXTS, 0.5)
+        if not members or rng.random() < 0.3:
+            created = now - (2 * DAY + rng.randint(0, 3600) if rng.random() < 0.7 else rng.randint(30, 2000) * DAY)
+            user = FakeUser(snowflake(created), rng.choice(NAMES), avatar=None if rng.random() < 0.8 else "a1b2c3")
+            member = FakeMember(user, guild)
+            members.append(member)
+            yield "join", member
+        else:
+            text = rng.choice(texts)
+            if rng.random() < padded:
+                text = "{0} {1}".format(text, rng.randint(0, 99))
+            yield "message", FakeMessage(rng.choice(members[-authors:]), rng.choice(channels), text)
+
+
+def check(seed: int, count: int, capacity: int) -> Counter:
+    rng = Random(seed)
+    trap.monotonic = clock = Clock()
+    session = trap.RaidSession()
+    # Re-analyze the cohort on every change, the throttle would otherwise let it lag the recount on purpose
+    join_pool = trap.MemberPool(session, capacity=capacity, cohort_interval=0)
+    msg_pool = trap.MessagePool(session, capacity=capacity)
+    seen = Counter()
+    peak = 0  # Message severity only ever goes up until the pool is reset
+    for i, (kind, obj) in enumerate(events(rng, FakeGuild(snowflake()), count)):
+        clock.now += rng.expovariate(2.0) if rng.random() < 0.97 else rng.uniform(10, 40)
+        session.active_raid = rng.random() < 0.05
+        if kind == "join":
+            join_pool.fill(obj)
+        else:
+            msg_pool.fill(obj)
+        if rng.random() < 0.1:
+            join_pool.drain()
+            msg_pool.drain()
+        if rng.random() < 0.02:  # Like ]reset, but keeping what's pooled to score it afresh
+            msg_pool.past_severity = peak = 0
+            msg_pool.check_contents()
+
+        context = "seed {0}, event {1}".format(seed, i)
+        expected = recount_members(join_pool)
+        assert join_pool.past_severity == expected, "{0}: members scored {1}, recount {2}".format(
+            context, join_pool.past_severity, expected)
+        peak = max(peak, recount_messages(msg_pool, clock.now))
+        assert msg_pool.past_severity == peak, "{0}: messages scored {1}, recount {2}".format(
+            context, msg_pool.past_severity, peak)
+        seen["member severity {0}".format(expected)] += 1
+        seen["message severity {0}".format(peak)] += 1
+    return seen
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=2000, help="events per seed")
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--capacity", type=int, default=40, help="pool size, small so eviction happens too")
+    args = parser.parse_args()
+
+    monotonic = trap.monotonic
+    seen = Counter()
+    try:
+        for seed in range(args.seeds):
+            seen.update(check(seed, args.events, args.capacity))
+    finally:
+        trap.monotonic = monotonic
+    print("{0} events over {1} seeds scored the same both ways".format(args.events * args.seeds, args.seeds))
+    for name, count in sorted(seen.items()):
+        print("  {0:<24} {1:>8}".format(name, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Sharded raid detection load test
+
+Run with `python -m bench.shards`. The same guilds' traffic is split between 1, 2, 4... worker processes the way Discord
+splits guilds between shards, with every worker connected to a hub and sharing a store whose rows change as it goes.
+Events per second should grow with the number of shards, as long as there are cores for them.
+"""
+from argparse import SUPPRESS, ArgumentParser
+from random import Random
+from tempfile import TemporaryDirectory
+import json
+import os
+import sys
+import time
+
+from gevent import sleep
+from gevent.subprocess import PIPE, Popen
+
+from bench.fakes import FakeGuild, snowflake
+from bench.raid import SCENARIOS, plugin_target
+from utils.ipc import Hub, link
+from utils.store import storage
+
+
+def worker(args):
+    """One shard: raid detection for its guilds, plus a watch list change every `--churn` events"""
+    link.connect(args.socket)
+    storage.open(args.db, None, 0.05)
+    streams = []
+    for i in range(args.shard, args.guilds, args.count):
+        guild = FakeGuild(snowflake())
+        handlers = plugin_target(guild)
+        streams.append([(handlers[kind], obj) for kind, obj in SCENARIOS[args.scenario](Random(i), guild, args.events)])
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    handled = 0
+    start = time.perf_counter()
+    for batch in zip(*streams):  # Guilds take turns, like interleaved gateway traffic
+        for handler, obj in batch:
+            handler(obj)
+            handled += 1
+            if not handled % args.churn:
+                user_id = args.shard * 10 ** 9 + handled
+                storage.watching[user_id] = {"channel_id": handled}
+                storage.watching.pop(user_id - args.churn * 10, None)
+                sleep(0)  # Let the store commit and other shards' changes in, as between gateway events
+    elapsed = time.perf_counter() - start
+    storage.close()
+    link.close()
+    print(json.dumps({"handled": handled, "elapsed": elapsed}), flush=True)
+
+
+def run(count: int, guilds: int, events: int, scenario: str, churn: int) -> dict:
+    with TemporaryDirectory(prefix="justice-shards-") as path:
+        hub = Hub(os.path.join(path, "hub.sock"))
+        hub.start()
+        workers = [Popen([sys.executable, "-m", "bench.shards", "--worker", "--shard", str(shard), "--count", str(count),
+                          "--socket", hub.path, "--db", os.path.join(path, "storage.db"), "--guilds", str(guilds),
+                          "--events", str(events), "--scenario", scenario, "--churn", str(churn)],
+                         stdin=PIPE, stdout=PIPE, universal_newlines=True) for shard in range(count)]
+        for process in workers:
+            assert process.stdout.readline().strip() == "ready"
+        for process in workers:  # All at once, so the slowest shard decides the time
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        results = [json.loads(process.stdout.readline()) for process in workers]
+        for process in workers:
+            process.wait()
+        hub.stop()
+
+    handled = sum(result["handled"] for result in results)
+    return {
+        "shards": count,
+        "rate": handled / max(result["elapsed"] for result in results),
+        "relayed": hub.relayed,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--shards", type=int, action="append", help="default 1, 2, 4... up to the CPU count")
+    parser.add_argument("-g", "--guilds", type=int, default=16)
+    parser.add_argument("-n", "--events", type=int, default=2000, help="events per guild")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--churn", type=int, default=50, help="events between watch list changes")
+    parser.add_argument("--worker", action="store_true", help=SUPPRESS)
+    parser.add_argument("--shard", type=int, help=SUPPRESS)
+    parser.add_argument("--count", type=int, help=SUPPRESS)
+    parser.add_argument("--socket", help=SUPPRESS)
+    parser.add_argument("--db", help=SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    counts = args.shards or [1 << i for i in range((os.cpu_count() or 1).bit_length())]
+    if counts == [1]:
+        counts = [1, 2]
+    print("{0:<8} {1:>12} {2:>9} {3:>11} {4:>12}".format("shards", "events/s", "speedup", "efficiency", "hub msgs"))
+    base = None
+    for count in counts:
+        result = run(count, args.guilds, args.events, args.scenario, args.churn)
+        base = base or result["rate"] / result["shards"]
+        print("{0:<8} {1:>12,.0f} {2:>8.2f}x {3:>10.0%} {4:>12,}".format(
+            count, result["rate"], result["rate"] / base, result["rate"] / base / count, result["relayed"]))
+    print("({0} CPUs)".format(os.cpu_count()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Storage write throughput benchmarks
+
+Run with `python -m bench.storage`. Many greenlets mute, unmute and watch at once against disco's JSON storage and the
+SQLite store, starting from a number of existing rows. "durable" is the time until every write is on disk.
+"""
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+import os
+import time
+
+from disco.bot.storage import Storage
+from gevent import joinall, sleep, spawn
+
+from utils.store import Store
+
+
+class JsonTarget:
+
+    def __init__(self, path: str):
+        class Config:
+            serializer = "json"
+            fsync = True
+        Config.path = os.path.join(path, "storage.json")
+        self.storage = Storage(None, Config)
+
+    def mute(self, member_id: int, start: int, length: int):
+        self.storage["MUTES"].data[str(member_id)] = {"start": start, "length": length}
+
+    def unmute(self, member_id: int):
+        del self.storage["MUTES"].data[str(member_id)]
+
+    def watch(self, user_id: int, channel_id: int):
+        self.storage["WATCHING"].data[str(user_id)] = channel_id
+
+    def finish(self):
+        pass
+
+
+class SqliteTarget:
+
+    def __init__(self, path: str):
+        self.store = Store()
+        self.store.open(os.path.join(path, "storage.db"))
+
+    def mute(self, member_id: int, start: int, length: int):
+        self.store.mutes[member_id] = {"start": start, "length": length, "guild_id": 0}
+
+    def unmute(self, member_id: int):
+        del self.store.mutes[member_id]
+
+    def watch(self, user_id: int, channel_id: int):
+        self.store.watching[user_id] = {"channel_id": channel_id}
+
+    def finish(self):
+        self.store.close()
+
+
+TARGETS = {"json": JsonTarget, "sqlite": SqliteTarget}
+
+
+def run(target: str, workers: int, writes: int, existing: int) -> dict:
+    with TemporaryDirectory() as path:
+        store = TARGETS[target](path)
+        for i in range(existing):
+            store.mute(10 ** 9 + i, 0, 60)
+        if target == "sqlite":
+            store.store.commit()
+
+        latencies = []
+        clock = time.perf_counter
+
+        def worker(n: int):
+            for i in range(writes // 3):
+                member_id = n * writes + i
+                for write, args in ((store.mute, (member_id, 0, 60)), (store.watch, (member_id, n)),
+                                    (store.unmute, (member_id,))):
+                    before = clock()
+                    write(*args)
+                    latencies.append(clock() - before)
+                    sleep(0)  # Let the other handlers in, as between gateway events
+
+        start = clock()
+        joinall([spawn(worker, n) for n in range(workers)])
+        queued = clock() - start
+        store.finish()
+        durable = clock() - start
+
+    latencies.sort()
+    return {
+        "target": target,
+        "rate": len(latencies) / durable,
+        "p50": latencies[len(latencies) // 2] * 1e6,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6,
+        "queued": queued * 1e3,
+        "durable": durable * 1e3,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-w", "--workers", type=int, default=100)
+    parser.add_argument("-n", "--writes", type=int, default=30, help="writes per worker")
+    parser.add_argument("-e", "--existing", type=int, default=1000, help="rows stored before starting")
+    parser.add_argument("-t", "--target", choices=TARGETS, action="append")
+    args = parser.parse_args()
+
+    print("{0:<8} {1:>10} {2:>10} {3:>10} {4:>11} {5:>12}".format(
+        "target", "writes/s", "p50 us", "p99 us", "queued ms", "durable ms"))
+    for target in args.target or TARGETS:
+        result = run(target, args.workers, args.writes, args.existing)
+        print("{target:<8} {rate:>10,.0f} {p50:>10.1f} {p99:>10.1f} {queued:>11,.1f} {durable:>12,.1f}".format(
+            **result))
+
+
+if __name__ == "__main__":
+    main()
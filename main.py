@@ -1,19 +1,29 @@
 from gevent.monkey import patch_all; patch_all()
+from utils.startup import mark
 
 import logging
 from os import environ
 
+from disco.api.http import HTTPClient
 from disco.bot import Bot, BotConfig
 from disco.client import Client, ClientConfig
 from disco.util.logging import setup_logging
 
+import utils.config as settings
+from utils.ipc import link
+
 
 setup_logging(level=logging.INFO)
 config = ClientConfig.from_file("config.json")
 config.token = environ['token']
+HTTPClient.BASE_URL = environ.get('DISCORD_API_BASE', HTTPClient.BASE_URL)  # Pointed at bench.fakediscord for load tests
+config.shard_id, config.shard_count = settings.SHARD_ID, settings.SHARD_COUNT
+if settings.IPC_PATH:
+    link.connect(settings.IPC_PATH)  # Before the plugins load, so they start out in sync with the other shards
 client = Client(config)
 bot_config = BotConfig(config.bot)
 bot = Bot(client, bot_config)
+mark("plugins loaded")
 
 if __name__ == '__main__':
     bot.run_forever()
@@ -1,6 +1,7 @@
+from utils.helpindex import HelpIndex
 from utils.safe import JusticePlugin
 
-from disco.types.message import MessageEmbed
+from disco.api.http import Routes
 
 
 class HelpPlug(JusticePlugin):
@@ -8,6 +9,14 @@ class HelpPlug(JusticePlugin):
 
     __name__ = "HelpPlug"
 
+    def load(self, ctx):
+        self.index = HelpIndex("If you want to see how to use the help command, type `]help help`, otherwise, below "
+                               "are the available command categories.")
+        self.index.sync(self.bot.plugins)
+
+    def reply_embed(self, event, embed: dict):
+        self.client.api.http(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=event.msg.channel_id), json={"embed": embed})
+
     @JusticePlugin.command("help", "[name:str]")
     def show_help(self, event, name: str = None):
         """Explain commands or list them
@@ -22,43 +31,23 @@ class HelpPlug(JusticePlugin):
 
         Tip: commands will always be all lower case, command categories are Titled.
         """
-
+        self.index.sync(self.bot.plugins)
         if not name:
-            embed = MessageEmbed()
-            embed.color = 0x00FFFF
-            embed.title = "List Command Categories"
-            embed.description = "If you want to see how to use the help command, type `]help help`, otherwise, " \
-                                "below are the available command categories."
-            for plugin in self.bot.plugins.values():
-                name, desc = plugin.__doc__.split(' | ')
-                embed.add_field(name=name, value=desc, inline=False)
-            event.msg.reply(embed=embed)
-        elif name.title() == name:
-            for plugin in self.bot.plugins.values():
-                if name in plugin.__doc__:
-                    break
-            else:
+            return self.reply_embed(event, self.index.overview)
+        if name.title() == name:
+            embed = self.index.categories.get(name)
+            if embed is None:
                 return event.msg.reply("Sorry, but I could not find the category '{0}'".format(name))
-
-            embed = MessageEmbed()
-            embed.color = 0x00FFFF
-            embed.title = plugin.__doc__
-
-            for func in plugin.meta_funcs:
-                if hasattr(func, 'docs'):
-                    embed.add_field(name=func.docs[0], value=func.docs[1], inline=False)
-
-            event.msg.reply(embed=embed)
-        else:
-            for plugin in self.bot.plugins.values():
-                for func in plugin.meta_funcs:
-                    if hasattr(func, 'docs') and func.docs[0] == name:
-                        embed = MessageEmbed()
-                        embed.title = func.docs[1]
-                        embed.color = 0x00FFFF
-                        embed.description = func.docs[2]
-                        return event.msg.reply(embed=embed)
-            event.msg.reply("Sorry, but I could not find the command '{0}'".format(name))
+            return self.reply_embed(event, embed)
+
+        embed = self.index.commands.get(name)
+        if embed is not None:
+            return self.reply_embed(event, embed)
+        reply = "Sorry, but I could not find the command '{0}'".format(name)
+        suggestions = self.index.suggest(name)
+        if suggestions:
+            reply += ", did you mean {0}?".format(" or ".join("`{0}`".format(command) for command in suggestions))
+        event.msg.reply(reply)
 
 
 del JusticePlugin  # We don't want disco to load this plugin
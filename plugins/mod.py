@@ -2,24 +2,36 @@ import time as t
 
 import utils.config as config
 from utils.deco import require, parse_member
+from utils.metrics import metrics
 from utils.parser import time_parse, ParseError
+from utils.registry import guild_setting
 from utils.safe import JusticePlugin
+from utils.store import storage
+from utils.timer import Scheduler
 
 from disco.bot.command import CommandEvent
 from disco.types.guild import GuildMember
 from disco.types.permissions import Permissions
-from gevent import sleep, spawn
 
 
 class ModPlug(JusticePlugin):
     """Mod | Moderation actions"""
 
-    @JusticePlugin.listen("Ready")
-    def on_ready(self, event):
-        mute_records = self.bot.storage["MUTES"].data
-        for member_id, details in mute_records.items():
-            to_finish = (details["start"] + details["length"]) - int(t.time())
-            spawn(self.unmute, member_id, to_finish)
+    def load(self, ctx):
+        storage.open(config.STORAGE_PATH, config.LEGACY_STORAGE_PATH, config.STORAGE_COMMIT_INTERVAL)
+        self.unmutes = Scheduler(self.unmute)
+        if config.SHARD_ID == config.MUTE_SHARD:  # Other shards' mutes reach it through the store
+            storage.mutes.subscribers.append(self.on_mute_change)
+            for member_id, mute in storage.mutes.items():  # Overdue ones run right away, no need for the gateway
+                self.unmutes.schedule(member_id, mute["start"] + mute["length"])
+            self.unmutes.start()
+        metrics.gauge("mutes_scheduled", "Mutes waiting to be lifted", lambda: len(self.unmutes))
+
+    def unload(self, ctx):
+        self.unmutes.stop()
+        if self.on_mute_change in storage.mutes.subscribers:
+            storage.mutes.subscribers.remove(self.on_mute_change)
+        super().unload(ctx)
 
     @require(Permissions.KICK_MEMBERS)
     @parse_member
@@ -61,12 +73,20 @@ class ModPlug(JusticePlugin):
         member.ban(delete_message_days=days, reason=reason)
         event.msg.add_reaction("👍")
 
-    def unmute(self, member_id: int, sleep_delay: int):
-        sleep(sleep_delay)
-        if str(member_id) in self.bot.storage['MUTES'].data:
-            del self.bot.storage["MUTES"].data[str(member_id)]
-        member = self.client.api.guilds_members_get(config.GUILD_ID, member_id)
-        member.remove_role(config.MUTE_ROLE_ID)
+    def on_mute_change(self, member_id: int, mute: dict = None):
+        if mute is None:
+            self.unmutes.cancel(member_id)
+        else:
+            self.unmutes.schedule(member_id, mute["start"] + mute["length"])
+
+    def unmute(self, member_id: int, guild_id: int = None):
+        mute = storage.mutes.pop(member_id)
+        if guild_id is None:  # Timed, mutes from before guilds were recorded are all from the main one
+            if mute is None:  # Unsilenced already, here or on another shard
+                return
+            guild_id = mute["guild_id"] or config.GUILD_ID
+        # Straight to the role route, no need to know anything about the member first
+        self.client.api.guilds_members_roles_remove(guild_id, member_id, guild_setting(guild_id, "MUTE_ROLE_ID"))
 
     @require(Permissions.MANAGE_ROLES)
     @parse_member
@@ -91,14 +111,15 @@ class ModPlug(JusticePlugin):
                 if total_time < 30 or total_time > 31 * 24 * 60 * 60:
                     return event.msg.reply("Sorry, the time must be >30sec and <1 month.")
 
-                mute_record = self.bot.storage["MUTES"].data
-                mute_record[member.id] = {
+                mute = storage.mutes[member.id] = {
                     "start": int(t.time()),
-                    "length": total_time
+                    "length": total_time,
+                    "guild_id": event.guild.id
                 }
-                spawn(self.unmute, member.id, total_time)
+                if config.SHARD_ID == config.MUTE_SHARD:
+                    self.unmutes.schedule(member.id, mute["start"] + total_time)
 
-        member.add_role(config.MUTE_ROLE_ID)
+        member.add_role(guild_setting(event.guild.id, "MUTE_ROLE_ID"))
         event.msg.add_reaction("👍")
 
     @require(Permissions.MANAGE_ROLES)
@@ -115,7 +136,8 @@ class ModPlug(JusticePlugin):
         `]unmute @BadUser5456` (Mute user from mention)
         `]unmute BadUser5456#0001` (Mute user from name + discriminator)
         """
-        self.unmute(member.id, 0)
+        self.unmutes.cancel(member.id)
+        self.unmute(member.id, event.guild.id)
         event.msg.add_reaction("👍")
 
 
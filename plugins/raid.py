@@ -1,41 +1,70 @@
 import utils.config as config
+from utils.bulk import BulkJob
+from utils.classify import BOT, GUILD, PRIVILEGED, Classified, classifier, privileged
 from utils.deco import require
+from utils.metrics import metrics
+from utils.registry import GuildRaid, GuildRegistry, guild_setting
 from utils.safe import JusticePlugin
-from utils.trap import MemberPool, MessagePool, RaidSession
+from utils.snapshot import snapshots
+from utils.store import storage
+from utils.warm import warm
 
+from disco.api.http import APIException
 from disco.bot.command import CommandEvent
 from disco.types.message import MessageEmbed
 from disco.types.permissions import Permissions
+from gevent import joinall, sleep, spawn
+
+LOCKED_PERMISSIONS = Permissions.READ_MESSAGES.value | Permissions.READ_MESSAGE_HISTORY.value
+UNKNOWN_CHANNEL = 10003
+UNKNOWN_INVITE = 10006
 
 
 class RaidPlug(JusticePlugin):
     """Raid | Detect raids"""
 
     def load(self, ctx):
-        self.session = RaidSession()
-        self.join_pool = MemberPool(self.session, self)
-        self.msg_pool = MessagePool(self.session, self)
-
-    def check_severity(self):
-        if self.session.severity > config.SEVERITY_TOLERANCE and not self.session.active_raid:
-            channel = self.client.api.channels_get(config.WARN_CHANNEL)
-            channel.send_message("Attention @everyone, severity level has reached **{1}**\n\nTriggering!".format(
-                config.GUILD_ID,
-                self.session.severity
-            ))
-            self.session.active_raid = True
+        storage.open(config.STORAGE_PATH, config.LEGACY_STORAGE_PATH, config.STORAGE_COMMIT_INTERVAL)
+        self.guilds = GuildRegistry(config.MAX_RAID_GUILDS, config.RAID_GUILD_TTL)
+        warm.register("raid", self.guilds.dump, self.guilds.restore)
+        self.register_schedule(self.guilds.drain, 2)
+        metrics.gauge("raid_guilds", "Guilds with raid detection state", lambda: len(self.guilds))
+        metrics.gauge("raid_joins_pooled", "Recent joins held for raid detection",
+                      lambda: sum(len(raid.join_pool.pool) for raid in self.guilds))
+        metrics.gauge("raid_messages_pooled", "Recent messages held for raid detection",
+                      lambda: sum(len(raid.msg_pool.pool) for raid in self.guilds))
+        metrics.gauge("raid_raiders", "Raiders caught", lambda: sum(len(raid.session.raiders) for raid in self.guilds))
+        classifier.subscribe("MessageCreate", self.on_message, require=GUILD, exclude=BOT | PRIVILEGED)
+
+    def unload(self, ctx):
+        classifier.unsubscribe(self.on_message)
+        super().unload(ctx)
+
+    def check_severity(self, raid: GuildRaid):
+        if raid.session.severity > raid.tolerance and not raid.session.active_raid:
+            raid.session.active_raid = True  # Before sending, events handled meanwhile would warn again
+            if raid.warn_channel is None:
+                self.log.warning("Raid triggered in guild %s, which has no warn channel", raid.guild_id)
+            else:  # Messages reach us from the classifier, which mustn't wait on Discord
+                self.spawn(self.send_warning, raid)
+
+    @staticmethod
+    def send_warning(raid: GuildRaid):
+        channel = snapshots.channel(raid.warn_channel)
+        channel.send_message("Attention @everyone, severity level has reached **{0}**\n\nTriggering!".format(
+            raid.session.severity
+        ))
 
     @JusticePlugin.listen("GuildMemberAdd")
     def on_join(self, member):
-        self.join_pool.fill(member)
-        self.check_severity()
+        raid = self.guilds.get(member.guild_id)
+        raid.join_pool.fill(member)
+        self.check_severity(raid)
 
-    @JusticePlugin.listen("MessageCreate")
-    def on_message(self, msg):
-        if msg.author.bot or msg.member.permissions.can(Permissions.ADMINISTRATOR):
-            return
-        self.msg_pool.fill(msg)
-        self.check_severity()
+    def on_message(self, record: Classified):
+        raid = self.guilds.get(record.guild_id)
+        raid.msg_pool.fill(record.msg, record.content_hash)
+        self.check_severity(raid)
 
     @require(Permissions.ADMINISTRATOR)
     @JusticePlugin.command("raiders")
@@ -46,15 +75,16 @@ class RaidPlug(JusticePlugin):
         and will alert you if the server isn't actually being raided (so the people listed might not be doing anything
         wrong.
         """
+        session = self.guilds.get(event.guild.id).session
         embed = MessageEmbed()
-        embed.title = "Possible Raiders: (Anti-Raid not triggered)" if not self.session.active_raid else "Raiders:"
+        embed.title = "Possible Raiders: (Anti-Raid not triggered)" if not session.active_raid else "Raiders:"
         embed.color = 0x00FFFF
         embed.description = ""
-        for raider in self.session.raiders.values():
+        for raider in session.raiders.values():
             triggered = []
             if raider.join_raid:
                 triggered.append("Joined during raid")
-            elif raider.msg_raid:
+            elif raider.msg_count():
                 triggered.append("Sent messages during raid ({0})".format(raider.msg_count()))
             embed.description += "{0} - {1}\n".format(raider.mention, ". ".join(triggered))
         event.msg.reply(embed=embed)
@@ -67,11 +97,72 @@ class RaidPlug(JusticePlugin):
         This command will empty all pools, storing messages and people. In addition to clearing data, it will disable
         the raid alarm, and allow pools to start emptying again.
         """
-        self.session.active_raid = False
-        self.msg_pool.pool.clear()
-        self.join_pool.pool.clear()
+        self.guilds.get(event.guild.id).reset()
         event.msg.add_reaction("👍")
 
+    def mass_action(self, event: CommandEvent, verb: str, ids: str, action):
+        if ids:
+            targets = [int(part.strip("<@!>")) for part in ids.split() if part.strip("<@!>").isnumeric()]
+        else:  # Raiders are only suspects until a raid has been declared, don't act on them all unasked
+            raid = self.guilds.get(event.guild.id)
+            if not raid.session.active_raid:
+                return event.msg.reply("Sorry, but there is no raid going on. Give the IDs to act on instead.")
+            targets = raid.suspects()
+        targets = [user_id for user_id in targets
+                   if user_id != event.author.id and not privileged(event.guild, user_id)]
+        if not targets:
+            return event.msg.reply("Sorry, but there is nobody to act on.")
+
+        status = event.msg.reply("{0} 0/{1}...".format(verb, len(targets)))
+
+        def progress(job: BulkJob):
+            if job.finished < job.total:
+                status.edit("{0} {1}/{2}...".format(verb, job.finished, job.total))
+            else:
+                status.edit("{0} finished: {1} done, {2} failed ({3:.1f}s)".format(
+                    verb, len(job.done), len(job.failed), job.elapsed))
+
+        BulkJob(action, targets, progress=progress).run()
+
+    @require(Permissions.BAN_MEMBERS)
+    @JusticePlugin.command("massban", "<days:int> [ids:str...]")
+    def mass_ban(self, event: CommandEvent, days: int, ids: str = None):
+        """Ban all raiders
+
+        Bans the raiders who joined in a burst or spammed once a raid has been detected, or the user IDs / mentions
+        you give, deleting their messages from the past X days. Administrators are left alone. Progress is reported as
+        it goes, since Discord limits how fast bans can be made.
+
+        For example:
+        `]massban 1` (Ban all raiders, remove their messages from the past day)
+        `]massban 0 09832098349 @BadUser5456` (Ban just these users, don't remove any messages)
+        """
+        self.mass_action(event, "Banning", ids, lambda user_id: self.client.api.guilds_bans_create(
+            event.guild.id, user_id, delete_message_days=days, reason="Mass ban by {0}".format(event.author)))
+
+    @require(Permissions.KICK_MEMBERS)
+    @JusticePlugin.command("masskick", "[ids:str...]")
+    def mass_kick(self, event: CommandEvent, ids: str = None):
+        """Kick all raiders
+
+        Kicks the raiders who joined in a burst or spammed once a raid has been detected, or the user IDs / mentions
+        you give. Administrators are left alone. Progress is reported as it goes.
+        """
+        self.mass_action(event, "Kicking", ids, lambda user_id: self.client.api.guilds_members_kick(
+            event.guild.id, user_id, reason="Mass kick by {0}".format(event.author)))
+
+    @require(Permissions.MANAGE_ROLES)
+    @JusticePlugin.command("masssilence", "[ids:str...]")
+    def mass_silence(self, event: CommandEvent, ids: str = None):
+        """Silence all raiders
+
+        Silences the raiders who joined in a burst or spammed once a raid has been detected, or the user IDs / mentions
+        you give, until they are unsilenced. Administrators are left alone. Progress is reported as it goes.
+        """
+        mute_role = guild_setting(event.guild.id, "MUTE_ROLE_ID")
+        self.mass_action(event, "Silencing", ids, lambda user_id: self.client.api.guilds_members_roles_add(
+            event.guild.id, user_id, mute_role, reason="Mass silence by {0}".format(event.author)))
+
     @require(Permissions.ADMINISTRATOR)
     @JusticePlugin.command("raid")
     def raid_summary(self, event: CommandEvent):
@@ -80,18 +171,20 @@ class RaidPlug(JusticePlugin):
         This command will allow a moderator to view details about the raid. If there is not a raid it will still provide
         information. Information includes severity, pool sizes, and a sample of content in the pools.
         """
+        raid = self.guilds.get(event.guild.id)
         embed = MessageEmbed()
         embed.color = 0x00FFFF
-        embed.title = "Under Raid: " if self.session.active_raid else "Raid Not Triggered"
-        if self.session.active_raid and self.session.severity < config.SEVERITY_TOLERANCE * 1.5:
+        embed.title = "Under Raid: " if raid.session.active_raid else "Raid Not Triggered"
+        if raid.session.active_raid and raid.session.severity < raid.tolerance * 1.5:
             embed.title += "Small"
-        elif self.session.active_raid and self.session.severity < config.SEVERITY_TOLERANCE * 2:
+        elif raid.session.active_raid and raid.session.severity < raid.tolerance * 2:
             embed.title += "Medium"
-        elif self.session.active_raid:
+        elif raid.session.active_raid:
             embed.title += "Large"
 
         desc = """
         **Join Pool:** {joins}
+        **Join Cohort:** {clustered} / {joins} created together, median account age {age:.1f} days, {young} under a week
         **Message Pool:** {msgs}
         **Severity / Tolerance:** {severity} / {tolerance}
         **Joins Samples:**
@@ -100,17 +193,57 @@ class RaidPlug(JusticePlugin):
         \t{msg_samples}
         """.lstrip()
 
+        cohort = raid.join_pool.cohort()
         embed.description = desc.format(
-            joins=len(self.join_pool.pool),
-            msgs=len(self.msg_pool.pool),
-            severity=self.session.severity,
-            tolerance=config.SEVERITY_TOLERANCE,
-            join_samples="\n\t".join("<@{0}>".format(r.id) for _, r in zip(range(5), self.join_pool.pool)),
+            joins=len(raid.join_pool.pool),
+            clustered=cohort.clustered,
+            age=cohort.median_age / (24 * 60 * 60),
+            young=cohort.young,
+            msgs=len(raid.msg_pool.pool),
+            severity=raid.session.severity,
+            tolerance=raid.tolerance,
+            join_samples="\n\t".join("<@{0}>".format(r.id) for _, r in zip(range(5), raid.join_pool.pool)),
             msg_samples="\n\t".join("{0}: {1}".format(m.author.mention, m.content)
-                                    for _, m in zip(range(5), self.msg_pool.pool))
+                                    for _, m in zip(range(5), raid.msg_pool.pool))
         )
         event.msg.reply(embed=embed)
 
+    def snapshot_guild(self, guild) -> dict:
+        invites = self.client.api.guilds_invites_list(guild.id)
+        overwrites = {}
+        for channel in guild.channels.values():
+            overwrite = channel.overwrites.get(guild.id)
+            if overwrite and int(overwrite.allow) & ~LOCKED_PERMISSIONS:  # @everyone explicitly allowed more
+                overwrites[str(channel.id)] = [int(overwrite.allow), int(overwrite.deny)]
+        return {
+            "state": "locking",
+            "everyone": guild.roles[guild.id].permissions.value,
+            "everyone_locked": False,
+            "invites": {invite.code: [invite.channel.id, invite.max_age, invite.max_uses, invite.temporary]
+                        for invite in invites},
+            "overwrites": overwrites,
+            "deleted": [],  # Progress checkpoints, so an interrupted lockdown or release can pick up where it left off
+            "locked": [],
+            "recreated": [],
+            "restored": [],
+        }
+
+    @staticmethod
+    def run_jobs(status, verb: str, *jobs: BulkJob) -> int:
+        """Run `jobs` side by side, returning how many of their items weren't done, failed or not"""
+        def report():
+            while True:
+                sleep(2)
+                status.edit("{0} {1}/{2}...".format(
+                    verb, sum(job.finished for job in jobs), sum(job.total for job in jobs)))
+
+        reporter = spawn(report)
+        try:
+            joinall([spawn(job.run) for job in jobs])
+        finally:
+            reporter.kill()
+        return sum(job.total - len(job.done) for job in jobs)
+
     @require(Permissions.ADMINISTRATOR)
     @JusticePlugin.command("lockdown")
     def lockdown_guild(self, event: CommandEvent):
@@ -120,26 +253,117 @@ class RaidPlug(JusticePlugin):
         not effect mods, and others with admin privileges. It will also not stop helpers from posting in helper
         specific channels. Of course, this command should only be used when the server is being raided, or something
         serious like that. In addition, it will delete all invites, to prevent more raiders from joining.
+
+        Everything changed is recorded first, so if the lockdown gets interrupted, running it again will resume it, and
+        `]release` will roll it back.
         """
-        everyone_role = event.guild.roles[config.GUILD_ID]
-        lockdown_data = self.bot.storage["LOCKDOWN"].data
-        lockdown_data[config.GUILD_ID] = everyone_role.permissions.value
-        everyone_role.update(permissions=Permissions.READ_MESSAGES.value | Permissions.READ_MESSAGE_HISTORY.value)
-        invites = self.client.api.guilds_invites_list(config.GUILD_ID)
-        for invite in invites:
-            invite.delete()
+        guild = event.guild
+        record = storage.lockdown.get(guild.id)
+        if record and record["state"] == "locked":
+            return event.msg.reply("Sorry, but the guild is already locked down, use `]release` to undo it.")
+        elif record and record["state"] == "releasing":
+            return event.msg.reply("Sorry, but a release was interrupted, use `]release` to finish it first.")
+
+        status = event.msg.reply("Resuming lockdown..." if record else "Locking down...")
+        if record is None:
+            record = storage.lockdown[guild.id] = self.snapshot_guild(guild)
+        if not record["everyone_locked"]:
+            guild.roles[guild.id].update(permissions=LOCKED_PERMISSIONS)
+            record["everyone_locked"] = True
+            storage.lockdown.touch(guild.id)
+
+        def delete_invite(code: str):
+            try:
+                self.client.api.invites_delete(code, reason="Lockdown")
+            except APIException as e:
+                if e.code != UNKNOWN_INVITE:  # It's gone already
+                    raise
+            record["deleted"].append(code)
+            storage.lockdown.touch(guild.id)
+
+        def lock_channel(channel_id: str):
+            allow, deny = record["overwrites"][channel_id]
+            try:
+                self.client.api.channels_permissions_modify(
+                    int(channel_id), guild.id, allow & LOCKED_PERMISSIONS, deny, "role", reason="Lockdown")
+            except APIException as e:
+                if e.code != UNKNOWN_CHANNEL:  # Deleted since, nothing to lock
+                    raise
+            record["locked"].append(channel_id)
+            storage.lockdown.touch(guild.id)
+
+        deleted, locked = set(record["deleted"]), set(record["locked"])
+        incomplete = self.run_jobs(
+            status, "Locking down",
+            BulkJob(delete_invite, [code for code in record["invites"] if code not in deleted]),
+            BulkJob(lock_channel, [channel for channel in record["overwrites"] if channel not in locked]))
+
+        if incomplete:
+            status.edit("Lockdown incomplete, {0} changes didn't go through. Run `]lockdown` again to retry, or "
+                        "`]release` to roll back.".format(incomplete))
+        else:
+            record["state"] = "locked"
+            storage.lockdown.touch(guild.id)
+            status.edit("Locked down: deleted {0} invites and locked {1} channel overwrites.".format(
+                len(record["deleted"]), len(record["locked"])))
 
     @require(Permissions.ADMINISTRATOR)
     @JusticePlugin.command("release")
     def release_guild(self, event: CommandEvent):
         """Unlock the guild
 
-        This command is used to reverse the changes made by lockdown command. Keep in mind, it will not make an invite,
-        you'll need to do that yourself. Use this command once the raiders have been dealt with.
+        This command is used to reverse the changes made by lockdown command, including one that was interrupted. The
+        deleted invites are recreated with the same settings, but Discord will give them new codes. Use this command
+        once the raiders have been dealt with.
         """
-        everyone_role = event.guild.roles[config.GUILD_ID]
-        lockdown_data = self.bot.storage["LOCKDOWN"].data
-        everyone_role.update(permissions=lockdown_data[str(everyone_role.id)])
+        guild = event.guild
+        record = storage.lockdown.get(guild.id)
+        if record is None:
+            return event.msg.reply("Sorry, but the guild isn't locked down.")
+
+        record["state"] = "releasing"
+        storage.lockdown.touch(guild.id)
+        status = event.msg.reply("Releasing...")
+        if record["everyone_locked"]:
+            guild.roles[guild.id].update(permissions=record["everyone"])
+            record["everyone_locked"] = False
+            storage.lockdown.touch(guild.id)
+
+        def recreate_invite(code: str):
+            channel_id, max_age, max_uses, temporary = record["invites"][code]
+            try:
+                self.client.api.channels_invites_create(
+                    channel_id, max_age=max_age, max_uses=max_uses, temporary=temporary, reason="Lockdown released")
+            except APIException as e:
+                if e.code != UNKNOWN_CHANNEL:  # Its channel was deleted since, there's nowhere to recreate it
+                    raise
+            record["recreated"].append(code)
+            storage.lockdown.touch(guild.id)
+
+        def restore_channel(channel_id: str):
+            allow, deny = record["overwrites"][channel_id]
+            try:
+                self.client.api.channels_permissions_modify(
+                    int(channel_id), guild.id, allow, deny, "role", reason="Lockdown released")
+            except APIException as e:
+                if e.code != UNKNOWN_CHANNEL:  # Deleted since, nothing to restore
+                    raise
+            record["restored"].append(channel_id)
+            storage.lockdown.touch(guild.id)
+
+        recreated, restored = set(record["recreated"]), set(record["restored"])
+        incomplete = self.run_jobs(
+            status, "Releasing",
+            BulkJob(recreate_invite, [code for code in record["deleted"] if code not in recreated]),
+            BulkJob(restore_channel, [channel for channel in record["locked"] if channel not in restored]))
+
+        if incomplete:
+            status.edit("Release incomplete, {0} changes didn't go through. Run `]release` again to retry.".format(
+                incomplete))
+        else:
+            del storage.lockdown[guild.id]
+            status.edit("Released: recreated {0} invites and restored {1} channel overwrites.".format(
+                len(record["recreated"]), len(record["restored"])))
 
 
 del JusticePlugin
@@ -0,0 +1,238 @@
+from datetime import datetime, timezone
+
+import utils.config as config
+from utils.classify import classifier
+from utils.deco import require
+from utils.members import MemberIndex, index_for, indexes
+from utils.metrics import duration, metrics
+from utils.perms import perm_cache
+from utils.safe import JusticePlugin
+from utils.snapshot import snapshots
+from utils.store import storage
+from utils.startup import mark, marks
+from utils.warm import warm
+from utils.watchdog import watchdog
+
+from disco.bot.command import CommandEvent
+from disco.types.message import MessageEmbed
+from disco.types.permissions import Permissions
+
+
+class StatePlug(JusticePlugin):
+    """State | Keep track of guild members and permissions"""
+
+    def load(self, ctx):
+        snapshots.bind(self.client)
+        self.register_schedule(snapshots.expire, 60)
+        self.pending = None  # Guilds from Ready whose members haven't been (re)loaded yet
+        warm.register("members", self.dump_members, self.restore_members)
+        self.register_schedule(warm.save, config.WARM_START_INTERVAL, init=False)
+        metrics.gauge("member_indexes", "Guilds with a member name index", lambda: len(indexes))
+        metrics.gauge("permissions_cached", "Resolved member permissions cached", lambda: len(perm_cache))
+        metrics.gauge("storage_dirty_rows", "Rows waiting to be committed",
+                      lambda: sum(len(table.dirty) for table in storage.tables.values()))
+        metrics.gauge("hub_stalls", "Times the event loop was held up past the watchdog's threshold",
+                      lambda: watchdog.total)
+        if config.METRICS_PORT is not None:
+            metrics.serve(config.METRICS_PORT)
+        watchdog.start()
+
+    def unload(self, ctx):
+        watchdog.stop()
+        metrics.stop()
+        warm.save()
+        super().unload(ctx)
+
+    @staticmethod
+    def dump_members() -> dict:
+        return {guild_id: index.dump() for guild_id, index in indexes.items()}
+
+    @staticmethod
+    def restore_members(data: dict):
+        for guild_id, tags in data.items():
+            indexes[guild_id] = MemberIndex.restore(tags)
+
+    def guild_ready(self, guild_id: int):
+        if self.pending is None:
+            return
+        self.pending.discard(guild_id)
+        if not self.pending:
+            mark("detection ready")
+
+    def reconcile(self, guild, warm_index: bool = False):
+        """Drop members we didn't hear about once the gateway has sent the whole list"""
+        index = indexes.get(guild.id)
+        if index is None:
+            return
+        complete = len(guild.members) >= (guild.member_count or 0)
+        if complete:
+            index.prune()
+        if complete or warm_index:  # A restored index is good enough to act on while the rest streams in
+            self.guild_ready(guild.id)
+
+    @JusticePlugin.listen("Ready")
+    def on_ready(self, event):
+        mark("gateway ready")
+        self.pending = {guild.id for guild in event.guilds}
+
+    @JusticePlugin.listen("GuildCreate")
+    def on_guild_create(self, guild):
+        index = indexes.get(guild.id)
+        if index is None:
+            index_for(guild)
+        else:  # Restored, or from before a reconnect, everyone has to be confirmed again
+            index.refresh()
+            index.add_members(guild.members.values())
+        self.reconcile(guild, warm_index=index is not None and len(index) > 0)
+
+    @JusticePlugin.listen("GuildDelete")
+    def on_guild_delete(self, event):
+        indexes.pop(event.id, None)
+        perm_cache.invalidate_guild(event.id)
+
+    @JusticePlugin.listen("GuildUpdate")
+    def on_guild_update(self, guild):
+        perm_cache.invalidate_guild(guild.id)  # The owner may have changed
+
+    @JusticePlugin.listen("GuildMembersChunk")
+    def on_members_chunk(self, event):
+        index = indexes.get(event.guild_id)
+        guild = self.client.state.guilds.get(event.guild_id)
+        if index is not None:
+            index.add_members(event.members)
+            if guild is not None:
+                self.reconcile(guild)
+
+    @JusticePlugin.listen("GuildMemberAdd")
+    @JusticePlugin.listen("GuildMemberUpdate")
+    def on_member_update(self, member):
+        perm_cache.invalidate_member(member.guild_id, member.id)
+        snapshots.forget("member", (member.guild_id, member.id))
+        index = indexes.get(member.guild_id)
+        if index is not None:  # Otherwise it's built from the member cache on first use
+            index.add_member(member)
+
+    @JusticePlugin.listen("GuildMemberRemove")
+    def on_member_remove(self, event):
+        perm_cache.invalidate_member(event.guild_id, event.user.id)
+        snapshots.forget("member", (event.guild_id, event.user.id))
+        index = indexes.get(event.guild_id)
+        if index is not None:
+            index.remove(event.user.id)
+
+    @JusticePlugin.listen("GuildRoleUpdate")
+    def on_role_update(self, event):
+        perm_cache.invalidate_role(event.role.id)
+
+    @JusticePlugin.listen("GuildRoleDelete")
+    def on_role_delete(self, event):
+        perm_cache.invalidate_role(event.role_id)
+
+    @JusticePlugin.listen("ChannelUpdate")
+    @JusticePlugin.listen("ChannelDelete")
+    def on_channel_update(self, channel):
+        perm_cache.invalidate_channel(channel.id)
+        snapshots.forget("channel", channel.id)
+
+    # Messages are classified once here, and passed on to the plugins subscribed to what they turned out to be
+    @JusticePlugin.listen("MessageCreate")
+    def on_message(self, msg):
+        classifier.dispatch("MessageCreate", msg)
+
+    @JusticePlugin.listen("MessageUpdate")
+    def on_message_update(self, msg):
+        classifier.dispatch("MessageUpdate", msg)
+
+    @JusticePlugin.command("find", "<name:str...>")
+    def find_member(self, event: CommandEvent, name: str):
+        """Find members by name
+
+        Lists members whose name starts with, or looks like, what you typed. Handy for finding the `name#discrim` to
+        give other commands. For example, `]find badus` could find `BadUser5456#0001`.
+        """
+        index = index_for(event.guild)
+        found = index.suggest(name, 10)
+        if not found:
+            return event.msg.reply("Sorry, but I could not find anyone called '{0}'".format(name))
+        event.msg.reply("\n".join("`{1}` ({0})".format(member_id, index.describe(member_id)) for member_id in found))
+
+    @require(Permissions.ADMINISTRATOR)
+    @JusticePlugin.command("cache")
+    def cache_stats(self, event: CommandEvent):
+        """Show how well the shared caches are doing
+
+        Lists the hit rates and sizes of the caches plugins share, which is mostly useful when something looks slow.
+        """
+        lines = ["Permissions: {0} cached, {1} hits, {2} misses ({3:.1%} hit rate), {4} invalidated".format(
+            len(perm_cache), perm_cache.hits, perm_cache.misses, perm_cache.hit_rate, perm_cache.invalidated)]
+        lines.append("Snapshots: {0} REST round-trips saved, {1} made".format(
+            snapshots.saved, sum(snapshots.fetches.values())))
+        for kind in ("member", "user", "channel"):
+            lines.append("  {0}: {1} from state, {2} cached, {3} shared, {4} fetched".format(
+                kind, snapshots.state_hits[kind], snapshots.cache_hits[kind], snapshots.shared[kind],
+                snapshots.fetches[kind]))
+        event.msg.reply("\n".join(lines))
+
+    @require(Permissions.ADMINISTRATOR)
+    @JusticePlugin.command("startup")
+    def startup_times(self, event: CommandEvent):
+        """Show how long the bot took to start
+
+        Lists how many seconds after the process started each startup stage was reached. Detection is ready once every
+        guild's members are known, either from the warm start snapshot or streamed in from Discord.
+        """
+        lines = ["{0}: {1:.2f}s".format(stage.capitalize(), seconds) for stage, seconds in marks.items()]
+        if warm.saved_at:
+            lines.append("Last snapshot: {0:.1f} KiB, took {1:.0f}ms".format(warm.size / 1024, warm.save_seconds * 1000))
+        event.msg.reply("\n".join(lines))
+
+    @require(Permissions.ADMINISTRATOR)
+    @JusticePlugin.command("stats")
+    def show_stats(self, event: CommandEvent):
+        """Show how long event handling takes
+
+        Lists the listeners, commands and Discord API routes that took the most time overall, with how often they ran
+        and how long they usually (p50) and at worst (p99, max) take. Lag is how long events waited for a listener to
+        start after arriving from Discord. The same numbers are served to Prometheus on localhost.
+        """
+        embed = MessageEmbed()
+        embed.title = "Stats"
+        embed.color = 0x00FFFF
+        for kind, title in (("listener", "Listeners"), ("command", "Commands"), ("route", "API Routes"),
+                            ("lag", "Gateway Lag"), ("call", "Checks")):
+            busiest = metrics.busiest(kind)
+            if busiest:
+                embed.add_field(name=title, inline=False, value="\n".join(
+                    "`{0}` {1}x, p50 {2}, p99 {3}, max {4}".format(
+                        name, histogram.count, duration(histogram.percentile(0.5)),
+                        duration(histogram.percentile(0.99)), duration(histogram.max))
+                    for name, histogram in busiest)[:1024])
+        gauges = metrics.read_gauges()
+        if gauges:
+            embed.add_field(name="Sizes", inline=False, value="\n".join(
+                "{0}: {1:,}".format(name.replace("_", " ").capitalize(), value)
+                for name, value in sorted(gauges.items())))
+        event.msg.reply(embed=embed)
+
+    @require(Permissions.ADMINISTRATOR)
+    @JusticePlugin.command("stalls")
+    def show_stalls(self, event: CommandEvent):
+        """Show what held up the bot
+
+        While a handler runs without yielding, nothing else can, raid detection included. This lists which handlers did
+        that for longer than the watchdog allows (half a second by default), and where the latest one was stuck.
+        """
+        if not watchdog.total:
+            return event.msg.reply("No stalls since the bot started")
+        lines = ["{0} stalls since the bot started, of the last {1}:".format(watchdog.total, len(watchdog.stalls))]
+        lines.extend("`{0}`: {1}".format(handler, count) for handler, count in watchdog.handlers.most_common(10))
+        stall = list(watchdog.stalls)[-1]
+        lines.append("Latest, `{0:%Y-%m-%d %H:%M:%S}` for {1:.2f}s in `{2}`:".format(
+            datetime.fromtimestamp(stall.started, timezone.utc), stall.duration, stall.handler))
+        stack = "".join(stall.stack)
+        budget = 1990 - len("\n".join(lines))
+        lines.append("```{0}```".format(stack[-budget:] if len(stack) > budget else stack))
+        event.msg.reply("\n".join(lines))
+
+
+del JusticePlugin
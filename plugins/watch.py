@@ -1,20 +1,80 @@
+from datetime import datetime, timezone
+from time import time
+
 import utils.config as config
 from utils.deco import parse_member, require
+from utils.classify import WATCHED, Classified, classifier
+from utils.ipc import link
+from utils.journal import DELETE, EDIT, NEW, Journal, Record
+from utils.metrics import metrics
+from utils.msgcache import MessageCache
+from utils.parser import ParseError, time_parse
+from utils.relay import Relay
 from utils.safe import JusticePlugin
+from utils.snapshot import snapshots
+from utils.store import storage
 
+from disco.api.http import APIException, Routes
 from disco.bot.command import CommandEvent
 from disco.types.channel import ChannelType
-from disco.types.message import Message, MessageEmbed, MessageEmbedThumbnail
+from disco.types.message import MessageEmbed, MessageEmbedThumbnail
 from disco.types.permissions import Permissions
 from disco.types.guild import GuildMember
 from disco.types.user import User
 
+HISTORY_KINDS = {NEW: "Sent", EDIT: "Edited", DELETE: "Deleted"}
+DESCRIPTION_LIMIT = 2048  # Discord's, and 6000 characters over all the embeds of a message
+
 
 class WatchPlug(JusticePlugin):
     """Watch | Observe others"""
 
     def load(self, ctx):
-        self.msg_cache = {}
+        storage.open(config.STORAGE_PATH, config.LEGACY_STORAGE_PATH, config.STORAGE_COMMIT_INTERVAL)
+        self.msg_cache = MessageCache(config.WATCH_CACHE_ENTRIES, config.WATCH_CACHE_BYTES, config.WATCH_CACHE_TTL)
+        self.register_schedule(self.msg_cache.expire, 60)
+        self.relay = Relay(self.send_embeds, config.WATCH_RELAY_INTERVAL, size=self.embed_size)
+        self.journal = Journal(config.JOURNAL_PATH, config.JOURNAL_SEGMENT_BYTES, config.JOURNAL_MAX_SEGMENTS)
+        link.on("history", self.shard_history)
+        metrics.gauge("watched_users", "Users being watched", lambda: len(storage.watching))
+        metrics.gauge("watch_cache_messages", "Messages kept to report deletions", lambda: len(self.msg_cache))
+        metrics.gauge("watch_cache_bytes", "Approximate size of the messages kept", lambda: self.msg_cache.bytes)
+        metrics.gauge("watch_relay_queued", "Embeds waiting to be sent to watch channels", lambda: len(self.relay))
+        metrics.gauge("journal_bytes", "Size of the watched user journal on disk", lambda: self.journal.size)
+        classifier.subscribe("MessageCreate", self.on_message, require=WATCHED)
+        classifier.subscribe("MessageUpdate", self.on_message, require=WATCHED)
+
+    def unload(self, ctx):
+        classifier.unsubscribe(self.on_message)
+        self.relay.flush_all()
+        self.journal.close()
+        super().unload(ctx)
+
+    def send_embeds(self, channel_id: int, embeds: list):
+        try:
+            self.client.api.http(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=channel_id),
+                                 json={"embeds": [embed.to_dict() for embed in embeds]})
+        except APIException as e:
+            self.log.warning("Could not relay {0} embeds to {1}: {2}".format(len(embeds), channel_id, e))
+
+    def shard_history(self, query: tuple) -> list:
+        """This shard's part of another shard's `]history`"""
+        return [record.astuple() for record in self.journal.history(*query)]
+
+    def history(self, user_id: int, since: float, limit: int) -> list:
+        """A user's history from every shard's journal, as each one only has the guilds it's connected to"""
+        records = self.journal.history(user_id, since, limit)
+        for reply in link.request("history", (user_id, since, limit)):
+            records.extend(Record(*fields) for fields in reply or ())
+        records.sort(key=lambda record: record.stamp)
+        return records[-limit:]
+
+    @staticmethod
+    def embed_size(embed: MessageEmbed) -> int:
+        """Characters Discord counts towards the limit on a message's embeds"""
+        return sum(len(text or "") for text in (
+            embed.title, embed.description, embed.footer and embed.footer.text, embed.author and embed.author.name,
+            *(part for field in embed.fields or () for part in (field.name, field.value))))
 
     @staticmethod
     def create_embed(event_name: str,
@@ -28,7 +88,10 @@ class WatchPlug(JusticePlugin):
         embed.thumbnail = MessageEmbedThumbnail(url=user.avatar_url)
         args_desc = "\n\n".join(args)
         kwargs_desc = "\n\n".join("**{0}:\n{1}**".format(name, value) for name, value in kwargs.items())
-        embed.description = "\n\n".join((args_desc, kwargs_desc))
+        description = "\n\n".join((args_desc, kwargs_desc))
+        if len(description) > DESCRIPTION_LIMIT:
+            description = description[:DESCRIPTION_LIMIT - 1] + "…"
+        embed.description = description
         embed.color = 0x00FFFF
         return embed
 
@@ -41,9 +104,9 @@ class WatchPlug(JusticePlugin):
         This command will create a private channel, where actions such as sending a message, editing, deleting, adding
         reactions and removing reactions are recorded. Staff members can delete the channels when done, or do ]close
         """
-        watching_data = self.bot.storage["WATCHING"].data
-        if member.id in watching_data:
-            return event.msg.reply("Sorry, but I'm watching that user in <#{0}>".format(watching_data[member.id]))
+        watching = storage.watching.get(member.id)
+        if watching is not None:
+            return event.msg.reply("Sorry, but I'm watching that user in <#{0}>".format(watching["channel_id"]))
 
         new_channel = self.client.api.guilds_channels_create(
             config.GUILD_ID,
@@ -51,26 +114,20 @@ class WatchPlug(JusticePlugin):
             member.user.username,
             parent_id=config.WATCH_CATEGORY)
 
-        watching_data[str(member.id)] = new_channel.id  # Gah, JSON, accept int keys!
+        storage.watching[member.id] = {"channel_id": new_channel.id}
         event.msg.add_reaction("👍")
         new_channel.send_message("Watching {0} | Requested by {1}".format(member.mention, event.author.mention))
 
     def unwatch(self, select_channel_id: int, delete: bool = True):
-        watching_data = self.bot.storage["WATCHING"].data
-        for user_id, channel_id in watching_data.items():
-            if channel_id == select_channel_id:
-                del watching_data[user_id]
-                marked = []
-                for msg_id, data in self.msg_cache.items():
-                    if data['user'] == int(user_id):
-                        marked.append(msg_id)
-                for m_id in marked:
-                    del self.msg_cache[m_id]
-                if delete:
-                    self.client.api.channels_delete(channel_id, reason="Watcher removed")
-                return True
-        else:
+        user_id = storage.watching.find("channel_id", select_channel_id)
+        if user_id is None:
             return False
+        del storage.watching[user_id]
+        self.msg_cache.remove_user(user_id)
+        self.relay.drop(select_channel_id)
+        if delete:
+            self.client.api.channels_delete(select_channel_id, reason="Watcher removed")
+        return True
 
     @require(Permissions.ADMINISTRATOR)
     @JusticePlugin.command("close")
@@ -88,28 +145,70 @@ class WatchPlug(JusticePlugin):
     def on_channel_del(self, channel):
         self.unwatch(channel.id, delete=False)
 
-    @JusticePlugin.listen("MessageCreate")
-    @JusticePlugin.listen("MessageUpdate")
-    def on_message(self, msg: Message):
-        watching_data = self.bot.storage["WATCHING"].data
-        if str(msg.author.id) in watching_data:
-            self.msg_cache[msg.id] = {"content": msg.content, "user": msg.author.id}
-            link = "https://discordapp.com/channels/{0}/{1}/{2}".format(msg.channel.guild_id, msg.channel_id, msg.id)
-            new_msg_embed = self.create_embed("Edited Message" if msg.edited_timestamp else "New Message",
-                                              link, msg.author, msg.content)
-            self.client.api.channels_messages_create(watching_data[str(msg.author.id)], embed=new_msg_embed)
+    def on_message(self, record: Classified):
+        msg = record.msg
+        self.msg_cache.put(msg.id, msg.author.id, record.guild_id, msg.channel_id, msg.content)
+        self.journal.append(EDIT if msg.edited_timestamp else NEW, msg.author.id, record.guild_id,
+                            msg.channel_id, msg.id, msg.content)
+        link = "https://discordapp.com/channels/{0}/{1}/{2}".format(record.guild_id, msg.channel_id, msg.id)
+        new_msg_embed = self.create_embed("Edited Message" if msg.edited_timestamp else "New Message",
+                                          link, msg.author, msg.content)
+        # Queued edits of one message collapse into the latest, the original stays its own entry
+        key = ("edit" if msg.edited_timestamp else "new", msg.id)
+        self.relay.push(record.watched["channel_id"], key, new_msg_embed)
 
     @JusticePlugin.listen("MessageDelete")
     def on_message_edit(self, msg_data):
-        watching_data = self.bot.storage["WATCHING"].data
-        if msg_data.id in self.msg_cache:
+        cached = self.msg_cache.pop(msg_data.id)
+        watching = storage.watching.get(cached.user_id) if cached is not None else None
+        if watching is not None:
+            self.journal.append(DELETE, cached.user_id, cached.guild_id, cached.channel_id, msg_data.id, cached.content)
             link = "https://discordapp.com/channels/{0}/{1}/{2}".format(
-                msg_data.guild.id, msg_data.channel_id, msg_data.id)
-            member = self.client.api.guilds_members_get(config.GUILD_ID, self.msg_cache[msg_data.id]["user"])
-            del_msg_embed = self.create_embed("Deleted Message", link,
-                                              member.user, self.msg_cache[msg_data.id]["content"])
-            self.client.api.channels_messages_create(watching_data[str(self.msg_cache[msg_data.id]["user"])],
-                                                     embed=del_msg_embed)
+                cached.guild_id, cached.channel_id, msg_data.id)
+            del_msg_embed = self.create_embed("Deleted Message", link, snapshots.user(cached.user_id), cached.content)
+            self.relay.push(watching["channel_id"], ("delete", msg_data.id), del_msg_embed)
+
+    @require(Permissions.ADMINISTRATOR)
+    @parse_member
+    @JusticePlugin.command("history", "<member:str> [since:str...]")
+    def member_history(self, event: CommandEvent, member: GuildMember, since: str = None):
+        """Show what a watched user has been up to
+
+        Lists the latest messages, edits and deletions recorded while the user was being watched, including ones from
+        before the bot restarted. You can also only look at the last stretch of time, for example:
+        `]history @BadUser5456 2h 30m` (Everything from the past 2 and a half hours)
+        """
+        cutoff = 0
+        if since:
+            try:
+                cutoff = time() - time_parse(since)
+            except ParseError:
+                return event.msg.reply("Sorry, I don't recognize '{0}' as a valid time.".format(since))
+
+        records = self.history(member.id, cutoff, 15)
+        if not records:
+            return event.msg.reply("Sorry, but I have no history for {0}".format(member.user.username))
+        lines = ["`{0:%Y-%m-%d %H:%M}` **{1}** in <#{2}>: {3}".format(
+            datetime.fromtimestamp(record.stamp, timezone.utc), HISTORY_KINDS[record.kind], record.channel_id,
+            record.content if len(record.content) <= 100 else record.content[:99] + "…") for record in records]
+        while len("\n".join(lines)) > 2000:
+            lines.pop(0)  # Drop the oldest until it fits in one message
+        event.msg.reply("\n".join(lines))
+
+    @require(Permissions.ADMINISTRATOR)
+    @JusticePlugin.command("watchcache")
+    def cache_stats(self, event: CommandEvent):
+        """Show how the watched message cache is doing
+
+        Deleted messages can only be reported while their contents are cached. This lists how full the cache is, how
+        many deletions were reported or missed because the message had already been dropped to save space, and how many
+        API messages the batched activity took.
+        """
+        cache, relay = self.msg_cache, self.relay
+        event.msg.reply("{0} messages ({1:.1f} KiB), {2} deletions reported, {3} missed after eviction, "
+                        "{4} evicted, {5} expired\n{6} entries relayed in {7} messages, {8} edits merged".format(
+                            len(cache), cache.bytes / 1024, cache.hits, cache.evicted_misses, cache.evictions,
+                            cache.expirations, relay.queued, relay.requests, relay.merged))
 
 
 del JusticePlugin
@@ -0,0 +1,91 @@
+"""Run the bot as several gateway shards, each in its own process
+
+Run with `python shard.py -n 4`, the default is a shard per CPU. Discord sends everything from a guild to one shard, so
+each guild's raid detection stays within one process. The store, watched user history and timed mutes are shared
+between shards through a hub on a Unix socket, which this process runs.
+"""
+from gevent.monkey import patch_all; patch_all()
+
+from argparse import ArgumentParser
+from time import monotonic
+import logging
+import os
+import signal
+import sys
+
+from disco.util.logging import setup_logging
+from gevent import killall, signal_handler, sleep, spawn
+from gevent.event import Event
+from gevent.subprocess import Popen
+
+import utils.config as config
+from utils.ipc import Hub
+from utils.store import storage
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+log = logging.getLogger("shard")
+
+
+class Launcher:
+
+    def __init__(self, count: int, path: str):
+        self.count = count
+        self.hub = Hub(path)
+        self.processes = {}  # Shard ID -> Popen
+        self.runners = []
+        self.stopped = Event()
+
+    def run_shard(self, shard_id: int):
+        """Keep a shard running, starting it again whenever it exits"""
+        env = dict(os.environ, SHARD_ID=str(shard_id), SHARD_COUNT=str(self.count), IPC_PATH=self.hub.path)
+        while True:
+            started = monotonic()
+            process = self.processes[shard_id] = Popen([sys.executable, MAIN], env=env)
+            code = process.wait()
+            log.warning("Shard %s exited with %s, restarting", shard_id, code)
+            sleep(max(0.0, config.SHARD_START_DELAY - (monotonic() - started)))
+
+    def start(self):
+        # Import disco's JSON storage here, so the shards don't race to do it
+        storage.open(config.STORAGE_PATH, config.LEGACY_STORAGE_PATH, config.STORAGE_COMMIT_INTERVAL)
+        storage.close()
+        self.hub.start()
+        for shard_id in range(self.count):
+            if shard_id:
+                sleep(config.SHARD_START_DELAY)
+            if self.stopped.is_set():
+                return
+            self.runners.append(spawn(self.run_shard, shard_id))
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        killall(self.runners)
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            process.wait()
+        self.hub.stop()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--socket", default="justice.sock", help="path of the hub's Unix socket")
+    args = parser.parse_args()
+
+    setup_logging(level=logging.INFO)
+    launcher = Launcher(args.shards, os.path.abspath(args.socket))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal_handler(signum, lambda: spawn(launcher.stop))
+    launcher.start()
+    launcher.stopped.wait()
+    while launcher.hub.server is not None:  # Until the shards have exited
+        sleep(0.1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+
+class RateTracker:
+    """Token buckets keyed by anything (channels, authors...), tracking who is going over their rate.
+
+    Each bucket refills `rate` tokens per second up to `burst`, and every hit takes one. Hits on an empty bucket push
+    it into debt, the size of that debt is its overdraft. Buckets all refill at the same rate, so the hottest one can
+    only change when another bucket gets hit, which lets it be tracked in O(1). Buckets left idle and full for `idle`
+    seconds are dropped, least recently hit first.
+    """
+
+    def __init__(self, rate: float, burst: float, idle: float = 60):
+        self.rate = rate
+        self.burst = burst
+        self.idle = idle
+        self._buckets = OrderedDict()  # key -> [tokens, last hit], least recently hit first
+        self._hottest = None
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, bucket: list, now: float) -> float:
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def overdraft(self, key, now: float) -> float:
+        bucket = self._buckets.get(key)
+        return max(0.0, -self._tokens(bucket, now)) if bucket else 0.0
+
+    def hit(self, key, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+        bucket[0] = self._tokens(bucket, now) - 1
+        bucket[1] = now
+
+        overdraft = max(0.0, -bucket[0])
+        if overdraft > self.overdraft(self._hottest, now):
+            self._hottest = key
+        self.expire(now)
+        return overdraft
+
+    def hottest(self, now: float):
+        """Return the hottest key and its overdraft"""
+        return self._hottest, self.overdraft(self._hottest, now)
+
+    def expire(self, now: float):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket[1] < self.idle or self._tokens(bucket, now) < self.burst:
+                break
+            del self._buckets[key]
+            if key == self._hottest:
+                self._hottest = None
+
+    def clear(self):
+        self._buckets.clear()
+        self._hottest = None
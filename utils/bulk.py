@@ -0,0 +1,80 @@
+from time import monotonic
+import logging
+
+from disco.api.http import APIException
+from gevent import spawn, sleep
+from gevent.pool import Pool as GreenPool
+
+log = logging.getLogger(__name__)
+
+
+class BulkJob:
+    """Run `action(item)` over many items with bounded parallelism, reporting progress along the way.
+
+    disco's HTTP client waits out a route's rate limit bucket once it has seen that route's headers, so the first item
+    runs alone to prime the bucket before the rest fan out over `concurrency` greenlets. `progress(job)` is called at
+    most every `every` seconds while running, and once more at the end.
+
+    Errors other than Discord's own are retried up to `attempts` times. disco's route cooldown is racy, several
+    greenlets cooling one bucket at once crash it before their requests are sent, and those items would go through
+    on another try.
+    """
+
+    def __init__(self, action, items, concurrency: int = 5, progress=None, every: float = 2.0, attempts: int = 3):
+        self.action = action
+        self.items = list(items)
+        self.concurrency = concurrency
+        self.progress = progress
+        self.every = every
+        self.attempts = attempts
+        self.done = []
+        self.failed = []
+        self.elapsed = 0.0
+
+    @property
+    def total(self):
+        return len(self.items)
+
+    @property
+    def finished(self):
+        return len(self.done) + len(self.failed)
+
+    def _run_one(self, item):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.action(item)
+            except APIException:
+                break
+            except Exception:  # Anything else still only costs this item, the rest of the job carries on
+                if attempt == self.attempts:
+                    log.exception("Bulk action failed on %s", item)
+                    break
+                log.warning("Bulk action failed on %s, retrying", item, exc_info=True)
+                sleep(attempt)
+            else:
+                self.done.append(item)
+                return
+        self.failed.append(item)
+
+    def _report(self):
+        while True:
+            sleep(self.every)
+            self.progress(self)
+
+    def run(self) -> "BulkJob":
+        reporter = spawn(self._report) if self.progress else None
+        started = monotonic()
+        try:
+            if self.items:
+                self._run_one(self.items[0])
+            workers = GreenPool(self.concurrency)
+            for item in self.items[1:]:
+                workers.spawn(self._run_one, item)
+            workers.join()
+        finally:
+            if reporter is not None:
+                reporter.kill()
+        self.elapsed = monotonic() - started
+        if self.progress:
+            self.progress(self)
+        return self
@@ -0,0 +1,82 @@
+from collections import namedtuple
+import logging
+
+from disco.types.permissions import Permissions
+
+from utils.metrics import metrics, perf_counter_ns
+from utils.perms import perm_cache
+from utils.store import storage
+
+# Categories a message can fall in, subscribers pick theirs as masks of these
+BOT = 1
+PRIVILEGED = 2  # Administrators, never treated as raiders
+WATCHED = 4
+GUILD = 8
+
+# What plugins get instead of the message, `watched` is the author's watch row or None
+Classified = namedtuple("Classified", "msg flags bot privileged watched guild_id channel_id content_hash")
+
+log = logging.getLogger(__name__)
+
+
+def privileged(guild, user_id: int) -> bool:
+    """Whether `user_id` is an administrator of `guild`, anyone not in its member cache (left, usually) never is"""
+    # Not guild.get_member, that fetches members it doesn't have one REST call at a time
+    return user_id in guild.members and perm_cache.for_guild(guild, user_id).can(Permissions.ADMINISTRATOR)
+
+
+class Classifier:
+    """Works out once per message what every plugin used to check for itself, then hands it to the ones that care.
+
+    Each subscriber gives the flags a message needs (`require`) and the ones that rule it out (`exclude`). The handlers
+    for each combination of flags are looked up once and cached, so a message costs one classification and one dict
+    lookup however many plugins are loaded. Handlers run one after another in the event's greenlet, anything that can
+    block, like a REST call, should be spawned.
+    """
+
+    def __init__(self):
+        self.subscribers = {}  # Event -> [(handler, require, exclude, histogram)]
+        self._routes = {}  # (event, flags) -> handlers to call
+
+    def subscribe(self, event: str, handler, require: int = 0, exclude: int = 0):
+        self.subscribers.setdefault(event, []).append(
+            (handler, require, exclude, metrics.histogram("listener", handler.__qualname__)))
+        self._routes.clear()
+
+    def unsubscribe(self, handler):
+        for event, subscribers in self.subscribers.items():
+            subscribers[:] = [subscriber for subscriber in subscribers if subscriber[0] != handler]
+        self._routes.clear()
+
+    def _route(self, event: str, flags: int) -> tuple:
+        route = self._routes[event, flags] = tuple(
+            (handler, histogram) for handler, require, exclude, histogram in self.subscribers.get(event, ())
+            if flags & require == require and not flags & exclude)
+        return route
+
+    @staticmethod
+    def classify(msg) -> Classified:
+        author, channel = msg.author, msg.channel
+        bot, guild_id = author.bot, channel.guild_id
+        admin = bool(guild_id) and not bot and privileged(channel.guild, author.id)
+        watched = storage.watching.get(author.id)
+        flags = BOT * bot | PRIVILEGED * admin | WATCHED * (watched is not None) | GUILD * bool(guild_id)
+        return Classified(msg, flags, bot, admin, watched, guild_id, msg.channel_id, hash(msg.content))
+
+    def dispatch(self, event: str, msg):
+        if msg.author is None:  # Updates that only add embeds don't say who sent the message
+            return
+        record = self.classify(msg)
+        route = self._routes.get((event, record.flags))
+        if route is None:
+            route = self._route(event, record.flags)
+        for handler, histogram in route:
+            start = perf_counter_ns()
+            try:
+                handler(record)
+            except Exception:  # One plugin failing shouldn't keep the message from the rest
+                log.exception("%s failed on message %s", handler.__qualname__, msg.id)
+            histogram.record(perf_counter_ns() - start)
+
+
+classifier = Classifier()
@@ -0,0 +1,40 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:  # Pure Python fallback, slower but fine for everyday pool sizes
+    numpy = None
+
+DISCORD_EPOCH = 1420070400000  # Milliseconds
+
+Cohort = namedtuple("Cohort", "size clustered median_age young")
+Cohort.__doc__ = """Creation time breakdown of a join window.
+
+`clustered` is the most accounts created within `spread` of each other, `median_age` is in seconds and `young` counts
+accounts younger than `young_age`.
+"""
+
+
+def analyze(ids, now: float, spread: int = 6 * 60 * 60, young_age: int = 7 * 24 * 60 * 60) -> Cohort:
+    """Decode member snowflakes in bulk and find how tightly their accounts were created"""
+    ids = list(ids)
+    size = len(ids)
+    if not size:
+        return Cohort(0, 0, 0.0, 0)
+    now_ms = now * 1000
+
+    if numpy is not None:
+        created = (numpy.array(ids, dtype=numpy.uint64) >> numpy.uint64(22)).astype(numpy.int64) + DISCORD_EPOCH
+        created.sort()
+        ends = numpy.searchsorted(created, created + spread * 1000, side="right")
+        clustered = int((ends - numpy.arange(size)).max())
+        ages = now_ms - created
+        return Cohort(size, clustered, float(numpy.median(ages)) / 1000, int((ages < young_age * 1000).sum()))
+
+    created = sorted((snowflake >> 22) + DISCORD_EPOCH for snowflake in ids)
+    clustered = max(bisect_right(created, start + spread * 1000, i) - i for i, start in enumerate(created))
+    middle = size // 2
+    median = created[middle] if size % 2 else (created[middle - 1] + created[middle]) / 2
+    young = size - bisect_right(created, now_ms - young_age * 1000)
+    return Cohort(size, clustered, (now_ms - median) / 1000, young)
@@ -1,9 +1,51 @@
+from os import environ
+
 # Guild Settings
 GUILD_ID = 437048931827056642
 BOT_ID = 547968517295570946
 MUTE_ROLE_ID = 439823181046611970
 WATCH_CATEGORY = 550873938746408960
 
-# Raid Settings
+# Shard Settings, shard.py sets these for each process it runs
+SHARD_ID = int(environ.get("SHARD_ID", 0))
+SHARD_COUNT = int(environ.get("SHARD_COUNT", 1))
+IPC_PATH = environ.get("IPC_PATH")  # Unix socket of the shard hub, None when running as a single process
+SHARD_START_DELAY = 5  # Seconds between shards starting, Discord allows one to identify every 5 seconds
+MUTE_SHARD = 0  # The shard that lifts timed mutes
+
+# Watch Settings, bounds on the contents kept to report deleted messages
+WATCH_CACHE_ENTRIES = 10000
+WATCH_CACHE_BYTES = 16 * 1024 * 1024
+WATCH_CACHE_TTL = 24 * 60 * 60
+JOURNAL_PATH = "journal" if SHARD_COUNT == 1 else "journal/shard-{0}".format(SHARD_ID)  # History of watched users
+JOURNAL_SEGMENT_BYTES = 16 * 1024 * 1024
+JOURNAL_MAX_SEGMENTS = 64
+WATCH_RELAY_INTERVAL = 2  # Seconds activity is held for, to be sent in batches of up to 10
+
+# Storage Settings
+STORAGE_PATH = "storage.db"
+LEGACY_STORAGE_PATH = "storage.json"  # disco's JSON storage, imported once and renamed
+STORAGE_COMMIT_INTERVAL = 0.05  # Seconds of writes grouped into each commit
+
+# Warm start snapshot of member indexes and raid state, so detection is ready soon after a restart
+WARM_START_PATH = "warm.snapshot" if SHARD_COUNT == 1 else "warm.snapshot.{0}".format(SHARD_ID)
+WARM_START_INTERVAL = 5 * 60
+WARM_START_MAX_AGE = 24 * 60 * 60
+
+# Event loop watchdog, anything holding up every other handler for longer than STALL_THRESHOLD seconds is reported
+STALL_THRESHOLD = 0.5
+STALL_HISTORY = 50  # Stalls kept for ]stalls
+
+# Prometheus metrics at http://127.0.0.1:METRICS_PORT/metrics, None to turn the endpoint off
+METRICS_PORT = 9464 + SHARD_ID
+
+# Raid Settings, the defaults for guilds without overrides in GUILDS
 SEVERITY_TOLERANCE = 4
-WARN_CHANNEL = 492814822073696257
+WARN_CHANNEL = None
+
+# Per guild overrides of the settings above
+GUILDS = {
+    GUILD_ID: {"WARN_CHANNEL": 492814822073696257},
+}
+MAX_RAID_GUILDS = 1000
+RAID_GUILD_TTL = 60 * 60
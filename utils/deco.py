@@ -1,5 +1,8 @@
 from functools import wraps
 
+from utils.members import index_for
+from utils.perms import perm_cache
+
 from disco.bot.command import CommandEvent
 
 
@@ -7,7 +10,7 @@ def require(*perms):
     def func_wrap(func):
         @wraps(func)
         def wrapper(self, event: CommandEvent, *args, **kwargs):
-            perm_code = event.channel.get_permissions(event.author.id)
+            perm_code = perm_cache.for_channel(event.channel, event.author.id)
             if perm_code.can(*perms):
                 func(self, event, *args, **kwargs)
             else:
@@ -19,21 +22,23 @@ def require(*perms):
 def parse_member(func):
     @wraps(func)
     def wrapper(self, event: CommandEvent, member: str, *args, **kwargs):
+        index = None
         if member.isnumeric():
             real_member = event.guild.members.get(int(member))
         elif len(event.msg.mentions) == 1:
             real_member = event.guild.members.get(next(iter(event.msg.mentions)))  # Epic Hacks lmao
         else:
-            for guild_member in event.guild.members.values():
-
-                if "#".join([guild_member.user.username, guild_member.user.discriminator]) == member:
-                    real_member = guild_member
-                    break
-                else:
-                    real_member = None
+            index = index_for(event.guild)
+            member_id = index.exact(member)
+            real_member = None if member_id is None else event.guild.members.get(member_id)
 
         if real_member is None:
-            event.msg.reply("Sorry, but we could not find the user ({user})".format(user=member))
+            reply = "Sorry, but we could not find the user ({user})".format(user=member)
+            suggestions = index.suggest(member) if index else []
+            if suggestions:
+                reply += ", did you mean {0}?".format(" or ".join(
+                    "`{0}`".format(index.describe(member_id)) for member_id in suggestions))
+            event.msg.reply(reply)
         else:
             func(self, event, real_member, *args, **kwargs)
     return wrapper
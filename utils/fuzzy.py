@@ -0,0 +1,56 @@
+from collections import Counter
+from heapq import nlargest
+
+
+def trigrams(text: str) -> frozenset:
+    padded = "  {0} ".format(text.lower())
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex:
+    """Fuzzy lookup of keys by the text they were added with, ranked by trigram overlap (Jaccard similarity).
+
+    Trigrams shared by more than `common` keys are skipped when rarer ones are available, so short generic fragments
+    don't turn a lookup into a scan of the whole index.
+    """
+
+    def __init__(self, common: int = 5000):
+        self.common = common
+        self._postings = {}  # trigram -> set of keys
+        self._grams = {}  # key -> trigrams it was added with
+
+    def __len__(self):
+        return len(self._grams)
+
+    def __contains__(self, key):
+        return key in self._grams
+
+    def add(self, key, text: str):
+        if key in self._grams:
+            self.remove(key)
+        grams = self._grams[key] = trigrams(text)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        for gram in self._grams.pop(key, ()):
+            postings = self._postings[gram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, text: str, limit: int = 5, cutoff: float = 0.1) -> list:
+        """Return up to `limit` (score, key) pairs scoring at least `cutoff`, best first"""
+        query = trigrams(text)
+        postings = [self._postings[gram] for gram in query if gram in self._postings]
+        rare = [keys for keys in postings if len(keys) <= self.common]
+        shared = Counter()
+        for keys in rare or postings:
+            shared.update(keys)
+
+        scored = []
+        for key, count in shared.items():
+            score = count / (len(query) + len(self._grams[key]) - count)
+            if score >= cutoff:
+                scored.append((score, key))
+        return nlargest(limit, scored, key=lambda pair: pair[0])
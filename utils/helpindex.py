@@ -0,0 +1,64 @@
+from disco.types.message import MessageEmbed
+
+from utils.fuzzy import TrigramIndex
+
+COLOR = 0x00FFFF
+
+
+def _embed(title: str, description: str = None, fields=()) -> dict:
+    embed = MessageEmbed()
+    embed.color = COLOR
+    embed.title = title
+    embed.description = description
+    for name, value in fields:
+        embed.add_field(name=name, value=value, inline=False)
+    return embed.to_dict()
+
+
+class HelpIndex:
+    """Command and category docs, parsed once per plugin with their embeds ready to send.
+
+    `sync` compares the bot's plugins against the ones indexed, so only plugins that were added, reloaded or removed
+    since the last call get (re)parsed.
+    """
+
+    def __init__(self, overview_text: str):
+        self.overview_text = overview_text
+        self.overview = None
+        self.categories = {}  # Category name -> embed
+        self.commands = {}  # Command name -> embed
+        self._plugins = {}  # Plugin name -> (plugin, category name, command names)
+        self._fuzzy = TrigramIndex()
+
+    def sync(self, plugins: dict):
+        changed = False
+        for name in list(self._plugins):
+            if plugins.get(name) is not self._plugins[name][0]:
+                self.remove(name)
+                changed = True
+        for name, plugin in plugins.items():
+            if name not in self._plugins:
+                self.add(name, plugin)
+                changed = True
+        if changed or self.overview is None:
+            self.overview = _embed("List Command Categories", self.overview_text, (
+                plugin.__doc__.split(" | ") for plugin, _, _ in self._plugins.values()))
+
+    def add(self, name: str, plugin):
+        category = plugin.__doc__.split(" | ")[0]
+        docs = plugin.get_docs()
+        self.categories[category] = _embed(plugin.__doc__, fields=((command, title) for command, title, _ in docs))
+        for command, title, desc in docs:
+            self.commands[command] = _embed(title, desc)
+            self._fuzzy.add(command, command)
+        self._plugins[name] = plugin, category, [command for command, _, _ in docs]
+
+    def remove(self, name: str):
+        _, category, commands = self._plugins.pop(name)
+        self.categories.pop(category, None)
+        for command in commands:
+            self.commands.pop(command, None)
+            self._fuzzy.remove(command)
+
+    def suggest(self, text: str, limit: int = 3) -> list:
+        return [command for _, command in self._fuzzy.search(text.lower(), limit)]
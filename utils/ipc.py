@@ -0,0 +1,253 @@
+from itertools import count
+from struct import Struct
+import logging
+import marshal
+import os
+
+from gevent import Timeout, getcurrent, sleep, socket, spawn, spawn_later
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from gevent.server import StreamServer
+
+FRAME = Struct("<I")  # Length of the marshal'd (op, topic, request id, payload) that follows
+PUB, SUB, REQ, REP = range(4)
+
+log = logging.getLogger(__name__)
+
+
+class Peer:
+    """One end of a hub connection, sending and reading whole messages"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._file = sock.makefile("rb")
+        self._lock = Semaphore()  # sendall can yield part way, messages mustn't interleave
+
+    def send(self, op: int, topic: str, request_id: int = 0, payload=None):
+        body = marshal.dumps((op, topic, request_id, payload))
+        with self._lock:
+            self.sock.sendall(FRAME.pack(len(body)) + body)
+
+    def __iter__(self):
+        while True:
+            head = self._file.read(FRAME.size)
+            if len(head) < FRAME.size:
+                return
+            body = self._file.read(FRAME.unpack(head)[0])
+            yield marshal.loads(body)
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+class Hub:
+    """Relays messages between the shard processes connected to a Unix socket.
+
+    Published messages go to every other process subscribed to the topic. Requests go to every other process subscribed
+    to it too, and the requester gets back the list of their replies, or the ones that came within `timeout` seconds.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self.peers = {}  # Peer -> topics it subscribed to
+        self.relayed = 0
+        self.server = None
+        self._pending = {}  # Hub request id -> [requester, its request id, replies still due, replies, timer]
+        self._ids = count(1)
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o600)  # Only processes running as us, marshal isn't safe to read from anyone else
+        listener.listen(64)
+        self.server = StreamServer(listener, self._handle)
+        self.server.start()
+
+    def stop(self):
+        for peer in list(self.peers):
+            peer.sock.shutdown(socket.SHUT_RDWR)
+        server, self.server = self.server, None
+        if server is not None:
+            server.stop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _handle(self, sock, address):
+        peer = Peer(sock)
+        topics = self.peers[peer] = set()
+        try:
+            for op, topic, request_id, payload in peer:
+                if op == SUB:
+                    topics.add(topic)
+                elif op == PUB:
+                    for other in self._subscribers(peer, topic):
+                        self._send(other, PUB, topic, 0, payload)
+                elif op == REQ:
+                    self._request(peer, topic, request_id, payload)
+                elif op == REP:
+                    self._reply(request_id, payload)
+        except (OSError, ValueError, EOFError) as e:
+            if self.server is not None:
+                log.warning("Dropping shard connection: %s", e)
+        finally:
+            del self.peers[peer]
+            peer.close()
+
+    def _subscribers(self, peer: Peer, topic: str) -> list:
+        return [other for other, topics in self.peers.items() if other is not peer and topic in topics]
+
+    def _send(self, peer: Peer, op: int, topic: str, request_id: int, payload) -> bool:
+        try:
+            peer.send(op, topic, request_id, payload)
+        except OSError:  # It's going away, its own handler cleans up
+            return False
+        self.relayed += 1
+        return True
+
+    def _request(self, peer: Peer, topic: str, request_id: int, payload):
+        targets = self._subscribers(peer, topic)
+        if not targets:
+            self._send(peer, REP, topic, request_id, [])
+            return
+        hub_id = next(self._ids)
+        pending = self._pending[hub_id] = [peer, request_id, 0, [], spawn_later(self.timeout, self._finish, hub_id)]
+        for target in targets:
+            if self._send(target, REQ, topic, hub_id, payload):
+                pending[2] += 1
+        if not pending[2]:
+            self._finish(hub_id)
+
+    def _reply(self, hub_id: int, payload):
+        pending = self._pending.get(hub_id)
+        if pending is None:  # Too late
+            return
+        pending[3].append(payload)
+        pending[2] -= 1
+        if not pending[2]:
+            self._finish(hub_id)
+
+    def _finish(self, hub_id: int):
+        pending = self._pending.pop(hub_id, None)
+        if pending is None:
+            return
+        requester, request_id, _, replies, timer = pending
+        if timer is not getcurrent():
+            timer.kill(block=False)
+        self._send(requester, REP, "", request_id, replies)
+
+
+class Link:
+    """This process' connection to the shard hub.
+
+    Handlers registered with `on` get what other shards publish on a topic, and answer their requests with what they
+    return. Without a connection, publishing does nothing and requests get no replies, so a bot running as a single
+    process goes through the same code.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.handlers = {}  # Topic -> function
+        self.peer = None
+        self._waiting = {}  # Request id -> AsyncResult
+        self._ids = count(1)
+
+    @property
+    def connected(self) -> bool:
+        return self.peer is not None
+
+    def on(self, topic: str, handler):
+        self.handlers[topic] = handler
+        if self.peer is not None:
+            self.peer.send(SUB, topic)
+
+    def connect(self, path: str):
+        self.path = path
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        peer = Peer(sock)
+        for topic in self.handlers:
+            peer.send(SUB, topic)
+        self.peer = peer
+        spawn(self._read, peer)
+
+    def close(self):
+        self.path = None  # So it stays closed
+        if self.peer is not None:
+            self.peer.sock.shutdown(socket.SHUT_RDWR)
+
+    def _reconnect(self):
+        while True:
+            sleep(1)
+            if self.peer is not None or self.path is None:
+                return
+            try:
+                self.connect(self.path)
+            except OSError:
+                continue
+            log.info("Reconnected to the shard hub")
+
+    def _read(self, peer: Peer):
+        try:
+            for op, topic, request_id, payload in peer:
+                if op == PUB:  # Handled in order, a later update mustn't overtake an earlier one
+                    self._call(topic, payload)
+                elif op == REQ:
+                    spawn(self._serve, peer, topic, request_id, payload)
+                elif op == REP:
+                    waiting = self._waiting.pop(request_id, None)
+                    if waiting is not None:
+                        waiting.set(payload)
+        except (OSError, ValueError, EOFError) as e:
+            if self.path is not None:
+                log.warning("Lost the shard hub: %s", e)
+        finally:
+            self.peer = None
+            peer.close()
+            for waiting in self._waiting.values():
+                waiting.set([])
+            self._waiting.clear()
+            if self.path is not None:
+                log.warning("Disconnected from the shard hub, retrying")
+                spawn(self._reconnect)
+
+    def _call(self, topic: str, payload):
+        try:
+            return self.handlers[topic](payload)
+        except Exception:
+            log.exception("Shard hub handler for %s failed", topic)
+
+    def _serve(self, peer: Peer, topic: str, request_id: int, payload):
+        reply = self._call(topic, payload)
+        try:
+            peer.send(REP, topic, request_id, reply)
+        except OSError:
+            pass
+
+    def publish(self, topic: str, payload):
+        if self.peer is None:
+            return
+        try:
+            self.peer.send(PUB, topic, 0, payload)
+        except OSError as e:
+            log.warning("Could not publish %s: %s", topic, e)
+
+    def request(self, topic: str, payload, timeout: float = 10.0) -> list:
+        """Replies from every other shard handling `topic`"""
+        if self.peer is None:
+            return []
+        request_id = next(self._ids)
+        waiting = self._waiting[request_id] = AsyncResult()
+        try:
+            self.peer.send(REQ, topic, request_id, payload)
+            return waiting.get(timeout=timeout)
+        except (OSError, Timeout):
+            return []
+        finally:
+            self._waiting.pop(request_id, None)
+
+
+link = Link()
@@ -0,0 +1,246 @@
+from array import array
+from mmap import ACCESS_READ, mmap
+from time import time
+from zlib import crc32
+import os
+import struct
+
+NEW, EDIT, DELETE = range(3)
+
+HEADER = struct.Struct("<IIBQQQQd")  # length, crc32 of the rest, kind, user, guild, channel, message, timestamp
+INDEX_HEADER = struct.Struct("<dd")  # first and last timestamp in the segment
+INDEX_ENTRY = struct.Struct("<QdQ")  # user, timestamp, offset
+
+
+class Record:
+    __slots__ = ("kind", "user_id", "guild_id", "channel_id", "msg_id", "stamp", "content")
+
+    def __init__(self, kind: int, user_id: int, guild_id: int, channel_id: int, msg_id: int, stamp: float,
+                 content: str):
+        self.kind = kind
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.msg_id = msg_id
+        self.stamp = stamp
+        self.content = content
+
+    def astuple(self) -> tuple:
+        return (self.kind, self.user_id, self.guild_id, self.channel_id, self.msg_id, self.stamp, self.content)
+
+    def pack(self) -> bytes:
+        body = HEADER.pack(0, 0, self.kind, self.user_id, self.guild_id, self.channel_id, self.msg_id,
+                           self.stamp)[8:] + self.content.encode()
+        return struct.pack("<II", len(body) + 8, crc32(body)) + body
+
+    @classmethod
+    def unpack(cls, buf, offset: int = 0):
+        """Read the record at `offset`, returning None if it's cut short or corrupt"""
+        if offset + HEADER.size > len(buf):
+            return None
+        length, crc, kind, user_id, guild_id, channel_id, msg_id, stamp = HEADER.unpack_from(buf, offset)
+        if length < HEADER.size or offset + length > len(buf) or crc32(buf[offset + 8:offset + length]) != crc:
+            return None
+        content = bytes(buf[offset + HEADER.size:offset + length]).decode(errors="replace")
+        return cls(kind, user_id, guild_id, channel_id, msg_id, stamp, content), length
+
+
+class Segment:
+    """One journal file, plus its index of (user, timestamp, offset) entries sorted by user then time.
+
+    The newest segment is written to and keeps its index in memory, as compact arrays per user. Once sealed, the index is
+    written next to it and both are only read through mmap, so old segments cost file handles rather than memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path[:-4] + ".idx"
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.first = self.last = None  # Timestamp range
+        self.users = None  # Unsealed: user -> (timestamps, offsets) arrays in write order
+        self._file = None
+        self._data = self._index = None
+
+    @property
+    def sealed(self) -> bool:
+        return self.users is None
+
+    def open(self):
+        """Scan the file to rebuild the index, dropping anything after a torn write"""
+        self.users = {}
+        with open(self.path, "ab+") as f:
+            f.seek(0)
+            data = f.read()
+            offset = 0
+            while True:
+                unpacked = Record.unpack(data, offset)
+                if unpacked is None:
+                    break
+                record, length = unpacked
+                self._note(record, offset)
+                offset += length
+            if offset != len(data):
+                f.truncate(offset)
+        self.size = offset
+        self._file = open(self.path, "ab")
+
+    def _note(self, record: Record, offset: int):
+        stamps, offsets = self.users.get(record.user_id) or self.users.setdefault(record.user_id,
+                                                                                  (array("d"), array("Q")))
+        stamps.append(record.stamp)
+        offsets.append(offset)
+        if self.first is None:
+            self.first = record.stamp
+        self.last = record.stamp
+
+    def append(self, record: Record):
+        offset = self.size
+        packed = record.pack()
+        self._file.write(packed)
+        self._file.flush()
+        self.size += len(packed)
+        self._note(record, offset)
+
+    def seal(self):
+        self._file.close()
+        self._file = None
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(self.first or 0, self.last or 0))
+            for user_id in sorted(self.users):
+                for stamp, offset in sorted(zip(*self.users[user_id])):
+                    f.write(INDEX_ENTRY.pack(user_id, stamp, offset))
+        os.replace(tmp_path, self.index_path)
+        self.users = None
+
+    def load(self) -> bool:
+        """Pick up a sealed segment's index, returning False if it has none"""
+        if not os.path.exists(self.index_path) or not self.size:
+            return False
+        with open(self.index_path, "rb") as f:
+            self.first, self.last = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        return True
+
+    @staticmethod
+    def _map(path: str):
+        with open(path, "rb") as f:
+            return mmap(f.fileno(), 0, access=ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def _entry(self, i: int):
+        return INDEX_ENTRY.unpack_from(self._index, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+
+    def offsets(self, user_id: int, since: float) -> list:
+        """Offsets of a user's records from `since` on, oldest first"""
+        if not self.sealed:
+            stamps, offsets = self.users.get(user_id, ((), ()))
+            return [offset for stamp, offset in sorted(zip(stamps, offsets)) if stamp >= since]
+
+        if self._index is None:
+            self._index = self._map(self.index_path)
+        count = (len(self._index) - INDEX_HEADER.size) // INDEX_ENTRY.size
+        lo, hi = 0, count
+        while lo < hi:  # First entry at or past (user_id, since)
+            mid = (lo + hi) // 2
+            if self._entry(mid)[:2] < (user_id, since):
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        for i in range(lo, count):
+            user, stamp, offset = self._entry(i)
+            if user != user_id:
+                break
+            found.append(offset)
+        return found
+
+    def read(self, offsets: list) -> list:
+        if not offsets:
+            return []
+        if self.sealed:
+            if self._data is None:
+                self._data = self._map(self.path)
+            data = self._data
+        else:
+            data = self._map(self.path)
+        return [Record.unpack(data, offset)[0] for offset in offsets]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap):
+                mapped.close()
+        self._data = self._index = None
+
+
+class Journal:
+    """Append-only log of messages, edits and deletions, split into segments of about `segment_size` bytes.
+
+    Only the newest `max_segments` segments are kept. Lookups by user skip segments outside the requested time range and
+    binary search the rest, reading records straight from the mapped files.
+    """
+
+    def __init__(self, path: str, segment_size: int = 16 * 1024 * 1024, max_segments: int = 64):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.segments = []
+        os.makedirs(path, exist_ok=True)
+
+        names = sorted(name for name in os.listdir(path) if name.endswith(".log"))
+        for name in names:
+            segment = Segment(os.path.join(path, name))
+            if not segment.load():  # The newest one, or a segment whose index was never written
+                segment.open()
+                if name != names[-1]:
+                    segment.seal()
+            self.segments.append(segment)
+        if not self.segments or self.active.sealed:
+            self._roll()
+
+    @property
+    def active(self) -> Segment:
+        return self.segments[-1]
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    def _roll(self):
+        number = int(os.path.basename(self.segments[-1].path)[:-4]) + 1 if self.segments else 1
+        segment = Segment(os.path.join(self.path, "{0:08}.log".format(number)))
+        segment.open()
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            oldest = self.segments.pop(0)
+            oldest.close()
+            for path in (oldest.path, oldest.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def append(self, kind: int, user_id: int, guild_id: int, channel_id: int, msg_id: int, content: str,
+               stamp: float = None):
+        self.active.append(Record(kind, user_id, guild_id, channel_id, msg_id, time() if stamp is None else stamp,
+                                  content))
+        if self.active.size >= self.segment_size:
+            self.active.seal()
+            self._roll()
+
+    def history(self, user_id: int, since: float = 0, limit: int = 20) -> list:
+        """The newest `limit` records of a user from `since` on, oldest first"""
+        found = []
+        for segment in reversed(self.segments):
+            if segment.last is None:
+                continue
+            if segment.last < since:
+                break
+            offsets = segment.offsets(user_id, since)[-(limit - len(found)):]
+            found[:0] = segment.read(offsets)
+            if len(found) >= limit:
+                break
+        return found
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
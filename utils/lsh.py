@@ -0,0 +1,120 @@
+from collections import Counter, OrderedDict
+
+_MASK = (1 << 64) - 1
+
+
+def shingles(text: str, size: int = 4, limit: int = 200) -> set:
+    text = " ".join(text.lower().split())[:limit]
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class NearDupIndex:
+    """Streaming MinHash LSH index grouping near-identical texts into clusters.
+
+    Signatures use one-permutation hashing (each shingle is hashed once and binned), so building one is linear in the
+    text length. They're split into bands, texts sharing a band bucket are candidates, and a candidate agreeing on at
+    least `threshold` of the slots pulls the new text into its cluster. Only the newest entry of each bucket is
+    verified, which keeps insertion cost independent of how many texts are indexed.
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 2, threshold: float = 0.5):
+        self.bands = bands
+        self.rows = rows
+        self.slots = bands * rows
+        self.threshold = threshold
+        self.largest = 0
+        self._buckets = {}  # (band, values) -> OrderedDict of entry keys, newest last
+        self._entries = {}  # entry key -> (signature, cluster)
+        self._clusters = Counter()  # cluster -> size
+        self._sizes = Counter()  # cluster size -> number of clusters that size
+        self._next_cluster = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def signature(self, text: str) -> tuple:
+        slots = self.slots
+        mins = [_MASK] * slots
+        for shingle in shingles(text):
+            h = hash(shingle) & _MASK
+            slot = h % slots
+            if h < mins[slot]:
+                mins[slot] = h
+        # Densify: empty slots borrow from the next filled slot so short texts still get full signatures
+        empty = [v == _MASK for v in mins]
+        if any(empty):
+            nearest = None
+            for i in range(2 * slots - 1, -1, -1):  # Walk around twice so the last slots can wrap to the first
+                if not empty[i % slots]:
+                    nearest = i
+                elif i < slots:
+                    mins[i] = mins[nearest % slots] + nearest - i
+        return tuple(mins)
+
+    def _band_keys(self, signature: tuple):
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def similarity(self, first: tuple, second: tuple) -> float:
+        return sum(a == b for a, b in zip(first, second)) / self.slots
+
+    def _resize(self, cluster: int, change: int):
+        old = self._clusters[cluster]
+        new = old + change
+        if old:
+            self._sizes[old] -= 1
+            if not self._sizes[old]:
+                del self._sizes[old]
+        if new:
+            self._clusters[cluster] = new
+            self._sizes[new] += 1
+        else:
+            del self._clusters[cluster]
+        if new > self.largest:
+            self.largest = new
+        elif old == self.largest and old not in self._sizes:
+            self.largest = old - 1  # Sizes only ever move by one, so the next largest is right below
+
+    def add(self, key, signature: tuple) -> int:
+        """Index `signature` under `key` and return the size of the cluster it joined"""
+        band_keys = self._band_keys(signature)
+        candidates = {next(reversed(self._buckets[band_key])) for band_key in band_keys if band_key in self._buckets}
+
+        cluster, best = None, self.threshold
+        for candidate in candidates:
+            other, other_cluster = self._entries[candidate]
+            score = self.similarity(signature, other)
+            if score >= best:
+                cluster, best = other_cluster, score
+        if cluster is None:
+            cluster = self._next_cluster
+            self._next_cluster += 1
+
+        self._entries[key] = signature, cluster
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, OrderedDict())[key] = None
+        self._resize(cluster, 1)
+        return self._clusters[cluster]
+
+    def cluster_size(self, key) -> int:
+        """Size of the cluster `key` is in, 0 if it isn't indexed"""
+        entry = self._entries.get(key)
+        return self._clusters[entry[1]] if entry else 0
+
+    def remove(self, key):
+        signature, cluster = self._entries.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets[band_key]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[band_key]
+        self._resize(cluster, -1)
+
+    def clear(self):
+        self._buckets.clear()
+        self._entries.clear()
+        self._clusters.clear()
+        self._sizes.clear()
+        self.largest = 0
@@ -0,0 +1,143 @@
+from bisect import bisect_left, insort
+
+from gevent import sleep
+
+from utils.fuzzy import TrigramIndex
+
+
+def tag(username: str, discriminator: str) -> str:
+    return "{0}#{1}".format(username, discriminator)
+
+
+class MemberIndex:
+    """Name lookups for one guild's members: exact `name#discrim`, case-insensitive prefix, and fuzzy suggestions"""
+
+    def __init__(self):
+        self._tags = {}  # member id -> (username, discriminator) it's indexed under
+        self._exact = {}  # name#discrim -> member id
+        self._folded = {}  # lowercase name#discrim -> member id
+        self._names = []  # Sorted (lowercase username, member id)
+        self._fuzzy = None  # Built on the first fuzzy lookup, most guilds never need one
+        self.stale = None  # Restored from a snapshot: IDs the gateway hasn't confirmed yet
+
+    def __len__(self):
+        return len(self._tags)
+
+    def add(self, member_id: int, username: str, discriminator: str, ordered: bool = True):
+        if self.stale:
+            self.stale.discard(member_id)
+        if self._tags.get(member_id) == (username, discriminator):
+            return
+        self.remove(member_id)
+        self._tags[member_id] = username, discriminator
+        self._exact[tag(username, discriminator)] = member_id
+        self._folded[tag(username, discriminator).lower()] = member_id
+        if ordered:
+            insort(self._names, (username.lower(), member_id))
+        else:
+            self._names.append((username.lower(), member_id))
+        if self._fuzzy is not None:
+            self._fuzzy.add(member_id, username)
+
+    def add_members(self, members):
+        """Add many members, yielding to other greenlets as it goes so a big guild doesn't stall the hub"""
+        self.add_tags((member.id, member.user.username, member.user.discriminator) for member in members)
+
+    def add_tags(self, tags):
+        ordered = bool(self._tags)  # Filling an empty index, so sort the prefix list once at the end instead
+        for i, (member_id, username, discriminator) in enumerate(tags):
+            self.add(member_id, username, discriminator, ordered)
+            if i % 1000 == 999:
+                sleep(0)
+        if not ordered:
+            self._names.sort()
+
+    def refresh(self):
+        """Treat every member as unconfirmed until the gateway mentions them again, see `prune`"""
+        self.stale = set(self._tags)
+
+    def dump(self) -> list:
+        return [(member_id, username, discriminator) for member_id, (username, discriminator) in self._tags.items()]
+
+    @classmethod
+    def restore(cls, tags: list) -> "MemberIndex":
+        index = cls()
+        index.add_tags(tags)
+        index.refresh()
+        return index
+
+    def prune(self):
+        """Once the gateway has sent every member, drop restored ones it didn't mention"""
+        for member_id in self.stale or ():
+            self.remove(member_id)
+        self.stale = None
+
+    def add_member(self, member):
+        self.add(member.id, member.user.username, member.user.discriminator)
+
+    def remove(self, member_id: int):
+        names = self._tags.pop(member_id, None)
+        if names is None:
+            return
+        username, discriminator = names
+        self._exact.pop(tag(username, discriminator), None)
+        self._folded.pop(tag(username, discriminator).lower(), None)
+        entry = username.lower(), member_id
+        i = bisect_left(self._names, entry)
+        if i < len(self._names) and self._names[i] == entry:
+            del self._names[i]
+        elif entry in self._names:  # Only while a bulk build hasn't sorted the list yet
+            self._names.remove(entry)
+        if self._fuzzy is not None:
+            self._fuzzy.remove(member_id)
+
+    def exact(self, name: str):
+        """Find a member ID by `name#discrim`, preferring an exact match over a case-insensitive one"""
+        member_id = self._exact.get(name)
+        return member_id if member_id is not None else self._folded.get(name.lower())
+
+    def prefix(self, text: str, limit: int = 5) -> list:
+        text = text.lower()
+        found = []
+        for i in range(bisect_left(self._names, (text,)), len(self._names)):
+            name, member_id = self._names[i]
+            if not name.startswith(text) or len(found) == limit:
+                break
+            found.append(member_id)
+        return found
+
+    def fuzzy(self, text: str, limit: int = 5) -> list:
+        if self._fuzzy is None:
+            self._fuzzy = TrigramIndex()
+            for i, member_id in enumerate(list(self._tags)):
+                names = self._tags.get(member_id)  # Read as we go, members can change while this yields
+                if names is not None:
+                    self._fuzzy.add(member_id, names[0])
+                if i % 1000 == 999:
+                    sleep(0)
+        return [member_id for _, member_id in self._fuzzy.search(text.split("#")[0], limit)]
+
+    def suggest(self, text: str, limit: int = 3) -> list:
+        """Member IDs that `text` might have meant, prefix matches first"""
+        found = self.prefix(text.split("#")[0], limit)
+        for member_id in self.fuzzy(text, limit):
+            if len(found) == limit:
+                break
+            if member_id not in found:
+                found.append(member_id)
+        return found
+
+    def describe(self, member_id: int) -> str:
+        return tag(*self._tags[member_id])
+
+
+indexes = {}  # guild id -> MemberIndex, kept up to date by the State plugin
+
+
+def index_for(guild) -> MemberIndex:
+    """Get the member index of a guild, building it from the cached members the first time"""
+    index = indexes.get(guild.id)
+    if index is None:
+        index = indexes[guild.id] = MemberIndex()
+        index.add_members(guild.members.values())
+    return index
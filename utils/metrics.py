@@ -0,0 +1,237 @@
+from collections import Counter
+from functools import wraps
+import logging
+import sys
+
+try:
+    from time import perf_counter_ns
+except ImportError:  # Python 3.6, a float clock is close enough for these histograms
+    from time import perf_counter
+
+    def perf_counter_ns() -> int:
+        return int(perf_counter() * 1e9)
+
+from gevent import get_hub
+from gevent.pywsgi import WSGIServer
+
+from utils.watchdog import blame
+
+SUB_BITS = 5  # 32 linear sub-buckets per power of two, so any recorded value is within about 3%
+MAX_VALUE = 1 << 40  # Nanoseconds, about 18 minutes
+MAX_SHIFT = (MAX_VALUE - 1).bit_length() - SUB_BITS - 1
+BUCKETS = (MAX_SHIFT << SUB_BITS) + (2 << SUB_BITS)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+log = logging.getLogger(__name__)
+
+
+def duration(ns: int) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if ns >= scale:
+            return "{0:.3g}{1}".format(ns / scale, unit)
+    return "{0}ns".format(ns)
+
+
+def _bucket_range(index: int) -> tuple:
+    """The lowest and highest value counted in bucket `index`"""
+    if index < 2 << SUB_BITS:
+        return index, index
+    shift = (index >> SUB_BITS) - 1
+    mantissa = index - (shift << SUB_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram:
+    """Log-linear latency histogram in nanoseconds, HDR style: fixed memory, constant time to record.
+
+    Values below 64ns get a bucket each, above that every power of two is split into 32 buckets. Recording only bumps a
+    bucket and the total, everything else is worked out from the buckets when read.
+    """
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0
+
+    def record(self, value: int):
+        shift = value.bit_length() - SUB_BITS - 1
+        if shift > 0:
+            if shift > MAX_SHIFT:
+                value, shift = MAX_VALUE - 1, MAX_SHIFT
+            self.counts[(shift << SUB_BITS) + (value >> shift)] += 1
+        else:
+            self.counts[value] += 1
+        self.total += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def max(self) -> int:
+        for index in range(BUCKETS - 1, -1, -1):
+            if self.counts[index]:
+                return _bucket_range(index)[1]
+        return 0
+
+    def percentile(self, q: float) -> int:
+        """The middle of the bucket holding the `q` quantile"""
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                low, high = _bucket_range(index)
+                return (low + high) // 2
+        return 0
+
+    @property
+    def mean(self) -> float:
+        count = self.count
+        return self.total / count if count else 0.0
+
+
+class Metrics:
+    """Latency histograms by kind ("listener", "command", "route", "lag" or "call") and name, plus gauges.
+
+    Gauges are functions called when metrics are read, so tracking them costs nothing in between.
+    """
+
+    KINDS = {
+        "listener": "Time spent in event listeners",
+        "command": "Time spent running commands",
+        "route": "Time spent on REST calls, including rate limit waits and retries",
+        "lag": "Time from receiving a gateway event to its listeners starting, sampled",
+        "call": "Time spent in instrumented functions",
+    }
+
+    def __init__(self):
+        self.histograms = {kind: {} for kind in self.KINDS}
+        self.gauges = {}  # Name -> (help, function)
+        self.requests = Counter()  # (plugin, route) -> REST calls
+        self.lag_sample = 16  # Probe the lag of every this many events
+        self._emitted = 0
+        self.client = None
+        self.server = None
+
+    def histogram(self, kind: str, name: str) -> Histogram:
+        histograms = self.histograms[kind]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        return histogram
+
+    def gauge(self, name: str, help_text: str, func):
+        self.gauges[name] = help_text, func
+
+    def timed(self, func):
+        """Decorator recording how long each call to `func` takes, under its qualified name"""
+        histogram = self.histogram("call", func.__qualname__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.record(perf_counter_ns() - start)
+        return wrapper
+
+    def bind(self, client):
+        """Time gateway events and REST calls made through `client`, once"""
+        if self.client is client:
+            return
+        self.client = client
+
+        emit = client.events.emit
+        loop = get_hub().loop
+
+        def probe(name: str, stamp: int):
+            self.histogram("lag", name).record(perf_counter_ns() - stamp)
+
+        def timed_emit(name, *args, **kwargs):
+            # Callbacks run in the order they're queued, so this one runs just before the event's listeners start
+            self._emitted += 1
+            if not self._emitted % self.lag_sample:
+                loop.run_callback(probe, name, perf_counter_ns())
+            return emit(name, *args, **kwargs)
+        client.events.emit = timed_emit
+
+        call = client.api.http.call
+
+        def timed_call(route, args=None, **kwargs):
+            if "retry_number" in kwargs:  # A retry from within the first call, which is timed already
+                return call(route, args, **kwargs)
+            name = "{0} {1}".format(route[0].value, route[1])
+            self.requests[blame(sys._getframe(1)).split(".")[0], name] += 1  # Next to the request, walking is cheap
+            start = perf_counter_ns()
+            try:
+                return call(route, args, **kwargs)
+            finally:
+                self.histogram("route", name).record(perf_counter_ns() - start)
+        client.api.http.call = timed_call
+
+    def busiest(self, kind: str, limit: int = 8) -> list:
+        """(name, histogram) pairs of a kind that took the most time in total"""
+        return sorted(self.histograms[kind].items(), key=lambda item: item[1].total, reverse=True)[:limit]
+
+    def read_gauges(self) -> dict:
+        values = {}
+        for name, (_, func) in self.gauges.items():
+            try:
+                values[name] = func()
+            except Exception:
+                log.exception("Could not read gauge %s", name)
+        return values
+
+    def prometheus(self) -> str:
+        """Everything in Prometheus' text format, histograms as summaries in seconds"""
+        lines = []
+        for kind, histograms in self.histograms.items():
+            metric = "justice_{0}_seconds".format(kind)
+            lines.append("# HELP {0} {1}".format(metric, self.KINDS[kind]))
+            lines.append("# TYPE {0} summary".format(metric))
+            for name, histogram in sorted(histograms.items()):
+                label = 'name="{0}"'.format(name.replace("\\", "\\\\").replace('"', '\\"'))
+                for q in QUANTILES:
+                    lines.append('{0}{{{1},quantile="{2}"}} {3:.9f}'.format(
+                        metric, label, q, histogram.percentile(q) / 1e9))
+                lines.append("{0}_sum{{{1}}} {2:.9f}".format(metric, label, histogram.total / 1e9))
+                lines.append("{0}_count{{{1}}} {2}".format(metric, label, histogram.count))
+        lines.append("# HELP justice_rest_requests_total REST calls by the plugin that made them")
+        lines.append("# TYPE justice_rest_requests_total counter")
+        for (plugin, route), count in sorted(self.requests.items()):
+            lines.append('justice_rest_requests_total{{plugin="{0}",route="{1}"}} {2}'.format(plugin, route, count))
+        values = self.read_gauges()
+        for name, (help_text, _) in sorted(self.gauges.items()):
+            if name in values:
+                lines.append("# HELP justice_{0} {1}".format(name, help_text))
+                lines.append("# TYPE justice_{0} gauge".format(name))
+                lines.append("justice_{0} {1}".format(name, values[name]))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        """Serve `prometheus()` over HTTP on localhost, once"""
+        if self.server is not None:
+            return
+
+        def app(environ, start_response):
+            if environ["PATH_INFO"] != "/metrics":
+                start_response("404 Not Found", [("Content-Type", "text/plain")])
+                return [b"Not found\n"]
+            body = self.prometheus().encode()
+            start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4"),
+                                      ("Content-Length", str(len(body)))])
+            return [body]
+
+        self.server = WSGIServer(("127.0.0.1", port), app, log=None)
+        self.server.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+
+metrics = Metrics()
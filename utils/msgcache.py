@@ -0,0 +1,102 @@
+from collections import OrderedDict, deque
+from sys import getsizeof
+from time import time
+
+ENTRY_OVERHEAD = 200  # Rough bytes per entry besides the content: the record, its dict slot and index set slot
+
+
+class CachedMessage:
+    __slots__ = ("user_id", "guild_id", "channel_id", "content", "size", "stamp")
+
+    def __init__(self, user_id: int, guild_id: int, channel_id: int, content: str, stamp: float):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.content = content
+        self.size = getsizeof(content) + ENTRY_OVERHEAD
+        self.stamp = stamp
+
+
+class MessageCache:
+    """Message contents by ID, bounded by entry count, bytes and age, with an index of each user's messages.
+
+    Entries are kept in order of their last write, so the oldest entry is both the least recently used and the first
+    to pass its TTL. IDs of evicted entries are remembered for a while, which lets a lookup tell a message that was
+    never cached apart from one that was dropped for space.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()  # message id -> CachedMessage, oldest write first
+        self._by_user = {}  # user id -> message ids
+        self._evicted = set()
+        self._evicted_order = deque()
+        self.hits = 0
+        self.evicted_misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, msg_id):
+        return msg_id in self._entries
+
+    def put(self, msg_id: int, user_id: int, guild_id: int, channel_id: int, content: str, now: float = None):
+        now = time() if now is None else now
+        self._remove(msg_id)
+        entry = self._entries[msg_id] = CachedMessage(user_id, guild_id, channel_id, content, now)
+        self._by_user.setdefault(user_id, set()).add(msg_id)
+        self.bytes += entry.size
+        self.expire(now)
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+            self.evictions += 1
+
+    def pop(self, msg_id: int):
+        """Take a message out of the cache, returning None if it isn't there"""
+        entry = self._remove(msg_id)
+        if entry is not None:
+            self.hits += 1
+        elif msg_id in self._evicted:
+            self.evicted_misses += 1
+        return entry
+
+    def remove_user(self, user_id: int) -> int:
+        msg_ids = list(self._by_user.get(user_id, ()))
+        for msg_id in msg_ids:
+            self._remove(msg_id)
+        return len(msg_ids)
+
+    def expire(self, now: float = None) -> int:
+        cutoff = (time() if now is None else now) - self.ttl
+        expired = 0
+        while self._entries:
+            msg_id, entry = next(iter(self._entries.items()))
+            if entry.stamp >= cutoff:
+                break
+            self._remove(msg_id)
+            expired += 1
+        self.expirations += expired
+        return expired
+
+    def _evict(self, msg_id: int):
+        self._remove(msg_id)
+        self._evicted.add(msg_id)
+        self._evicted_order.append(msg_id)
+        if len(self._evicted_order) > self.max_entries:
+            self._evicted.discard(self._evicted_order.popleft())
+
+    def _remove(self, msg_id: int):
+        entry = self._entries.pop(msg_id, None)
+        if entry is None:
+            return None
+        self.bytes -= entry.size
+        msg_ids = self._by_user[entry.user_id]
+        msg_ids.discard(msg_id)
+        if not msg_ids:
+            del self._by_user[entry.user_id]
+        return entry
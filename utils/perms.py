@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+
+class PermissionCache:
+    """Computed permissions per (guild, channel, member), shared by every plugin.
+
+    Each entry is indexed by the member, the channel and the roles it was computed from, so an update only drops the
+    entries it could have changed. The @everyone role shares the guild's ID, which makes invalidating it clear the whole
+    guild. The State plugin feeds the invalidation events in.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (guild id, channel id or None, member id) -> (value, role ids), oldest first
+        self._by_member = {}  # (guild id, member id) -> keys
+        self._by_channel = {}  # channel id -> keys
+        self._by_role = {}  # role id -> keys
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def for_channel(self, channel, member_id: int):
+        if not channel.guild_id:  # DMs, nothing to compute
+            return channel.get_permissions(member_id)
+        return self._resolve(channel.guild, channel, member_id)
+
+    def for_guild(self, guild, member_id: int):
+        return self._resolve(guild, None, member_id)
+
+    def _resolve(self, guild, channel, member_id: int):
+        key = guild.id, channel.id if channel else None, member_id
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = channel.get_permissions(member_id) if channel else guild.get_permissions(member_id)
+        roles = (guild.id, *guild.get_member(member_id).roles)
+        self._entries[key] = value, roles
+        self._by_member.setdefault(key[::2], set()).add(key)
+        if channel:
+            self._by_channel.setdefault(channel.id, set()).add(key)
+        for role_id in roles:
+            self._by_role.setdefault(role_id, set()).add(key)
+        if len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+        return value
+
+    def _discard(self, key):
+        _, roles = self._entries.pop(key)
+        self._unindex(self._by_member, key[::2], key)
+        if key[1] is not None:
+            self._unindex(self._by_channel, key[1], key)
+        for role_id in roles:
+            self._unindex(self._by_role, role_id, key)
+
+    @staticmethod
+    def _unindex(index: dict, ident, key):
+        keys = index.get(ident)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[ident]
+
+    def _drop(self, index: dict, ident):
+        for key in list(index.get(ident, ())):
+            self._discard(key)
+            self.invalidated += 1
+
+    def invalidate_member(self, guild_id: int, member_id: int):
+        self._drop(self._by_member, (guild_id, member_id))
+
+    def invalidate_channel(self, channel_id: int):
+        self._drop(self._by_channel, channel_id)
+
+    def invalidate_role(self, role_id: int):
+        self._drop(self._by_role, role_id)
+
+    def invalidate_guild(self, guild_id: int):
+        self.invalidate_role(guild_id)  # Every entry depends on @everyone
+
+    def clear(self):
+        self._entries.clear()
+        self._by_member.clear()
+        self._by_channel.clear()
+        self._by_role.clear()
+
+
+perm_cache = PermissionCache()
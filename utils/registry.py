@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from time import monotonic, time
+
+import utils.config as config
+from utils.trap import MemberPool, MessagePool, RaidSession
+
+
+def guild_setting(guild_id: int, name: str):
+    """Look up a setting for a guild, falling back to the defaults in utils.config"""
+    return config.GUILDS.get(guild_id, {}).get(name, getattr(config, name))
+
+
+class GuildRaid:
+    """Raid detection state and thresholds for a single guild"""
+
+    __slots__ = ("guild_id", "session", "join_pool", "msg_pool", "tolerance", "warn_channel", "last_event")
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.session = RaidSession()
+        self.join_pool = MemberPool(self.session)
+        self.msg_pool = MessagePool(self.session)
+        self.tolerance = guild_setting(guild_id, "SEVERITY_TOLERANCE")
+        self.warn_channel = guild_setting(guild_id, "WARN_CHANNEL")
+        self.last_event = monotonic()
+
+    def drain(self):
+        self.join_pool.drain()
+        self.msg_pool.drain()
+
+    def suspects(self) -> list:
+        """IDs of the raiders who joined in a burst or sent spam, not everyone who happened to chat during a raid"""
+        return [raider.id for raider in self.session.raiders.values()
+                if raider.join_raid or self.msg_pool.spammed(raider)]
+
+    def reset(self):
+        """Empty the pools and forget the raid, including the severity it reached"""
+        self.session.active_raid = False
+        self.session.raiders.clear()
+        for pool in (self.join_pool, self.msg_pool):
+            pool.pool.clear()
+            pool.past_severity = 0
+            pool.change_severity(0)
+
+
+class GuildRegistry:
+    """Lazily created GuildRaid per guild, evicting the least recently active ones.
+
+    Guilds are dropped once idle for `ttl` seconds, or when more than `max_guilds` are tracked. A guild under an active
+    raid is never evicted, so its evidence survives until a moderator resets it.
+    """
+
+    def __init__(self, max_guilds: int, ttl: int):
+        self.max_guilds = max_guilds
+        self.ttl = ttl
+        self._guilds = OrderedDict()  # Least recently active first
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def __iter__(self):
+        return iter(list(self._guilds.values()))
+
+    def get(self, guild_id: int) -> GuildRaid:
+        raid = self._guilds.get(guild_id)
+        if raid is None:
+            raid = self._guilds[guild_id] = GuildRaid(guild_id)
+            if len(self._guilds) > self.max_guilds:
+                self._evict_one()
+        else:
+            raid.last_event = monotonic()
+            self._guilds.move_to_end(guild_id)
+        return raid
+
+    def _evict_one(self):
+        for guild_id, raid in self._guilds.items():
+            if not raid.session.active_raid:
+                del self._guilds[guild_id]
+                return
+
+    def dump(self) -> list:
+        """Raid state worth keeping over a restart, as plain data for the warm start snapshot"""
+        offset = time() - monotonic()
+        return [(raid.guild_id, raid.session.dump(offset), raid.join_pool.dump(offset)) for raid in self]
+
+    def restore(self, data: list):
+        offset = time() - monotonic()
+        for guild_id, session, joins in data:
+            raid = self.get(guild_id)
+            raid.session.restore(session, offset)
+            raid.join_pool.restore_all(joins, offset)
+
+    def drain(self):
+        now = monotonic()
+        for raid in self:
+            raid.drain()
+        for guild_id, raid in list(self._guilds.items()):
+            if now - raid.last_event < self.ttl:
+                break
+            if not raid.session.active_raid:
+                del self._guilds[guild_id]
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+from gevent import getcurrent, spawn, spawn_later
+from gevent.lock import Semaphore
+
+
+class Relay:
+    """Queues embeds per channel and sends them `batch` at a time through `send(channel_id, embeds)`.
+
+    A channel's queue is flushed `interval` seconds after its first embed, or right away once it holds a full batch, in
+    a greenlet of its own either way, so pushing never waits on Discord. Pushing a key that's still queued replaces its
+    embed in place, so a burst of updates to one thing goes out as one entry. Batches are also cut short before the
+    `size` of their embeds adds up to more than `budget`, Discord's limit on the characters in one message's embeds.
+    """
+
+    def __init__(self, send, interval: float = 2.0, batch: int = 10, budget: int = 6000, size=None):
+        self.send = send
+        self.interval = interval
+        self.batch = batch
+        self.budget = budget
+        self.size = size or (lambda embed: 0)
+        self._queues = {}  # channel id -> OrderedDict of key -> embed
+        self._timers = {}  # channel id -> pending flush greenlet
+        self._due = set()  # Channels whose pending flush is the immediate one for a full batch
+        self._locks = {}  # channel id -> Semaphore, so batches for one channel go out in order
+        self.queued = 0
+        self.merged = 0
+        self.requests = 0
+
+    def __len__(self):
+        return sum(map(len, self._queues.values()))
+
+    def push(self, channel_id: int, key, embed):
+        queue = self._queues.setdefault(channel_id, OrderedDict())
+        if key in queue:
+            self.merged += 1
+        else:
+            self.queued += 1
+        queue[key] = embed
+        if len(queue) >= self.batch:
+            if channel_id not in self._due:
+                timer = self._timers.pop(channel_id, None)
+                if timer is not None:
+                    timer.kill(block=False)
+                self._due.add(channel_id)
+                self._timers[channel_id] = spawn(self.flush, channel_id)
+        elif channel_id not in self._timers:
+            self._timers[channel_id] = spawn_later(self.interval, self.flush, channel_id)
+
+    def flush(self, channel_id: int):
+        self._due.discard(channel_id)
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None and timer is not getcurrent():
+            timer.kill(block=False)
+        queue = self._queues.pop(channel_id, None)
+        if not queue:
+            return
+        with self._locks.setdefault(channel_id, Semaphore()):
+            for embeds in self.batches(queue.values()):
+                self.requests += 1
+                self.send(channel_id, embeds)
+
+    def batches(self, embeds):
+        batch, used = [], 0
+        for embed in embeds:
+            size = self.size(embed)
+            if batch and (len(batch) == self.batch or used + size > self.budget):
+                yield batch
+                batch, used = [], 0
+            batch.append(embed)
+            used += size
+        if batch:
+            yield batch
+
+    def drop(self, channel_id: int):
+        self._due.discard(channel_id)
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None:
+            timer.kill(block=False)
+        self._queues.pop(channel_id, None)
+        self._locks.pop(channel_id, None)
+
+    def flush_all(self):
+        for channel_id in list(self._queues):
+            self.flush(channel_id)
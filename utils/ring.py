@@ -0,0 +1,72 @@
+class RingBuffer:
+    """Bounded FIFO of timestamped items, oldest first.
+
+    Appending to a full buffer overwrites the oldest item, and `expire` drops items older than a cutoff, both in O(1)
+    per item removed. Every removed item is handed to `on_evict`, so owners can keep running aggregates in step.
+    """
+
+    __slots__ = ("capacity", "on_evict", "_items", "_stamps", "_head", "_size")
+
+    def __init__(self, capacity: int, on_evict=None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self._items = [None] * capacity
+        self._stamps = [0.0] * capacity
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._items[(self._head + i) % self.capacity]
+
+    def stamped(self):
+        """Iterate over (item, stamp) pairs, oldest first"""
+        for i in range(self._size):
+            slot = (self._head + i) % self.capacity
+            yield self._items[slot], self._stamps[slot]
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("ring buffer index out of range")
+        return self._items[(self._head + index) % self.capacity]
+
+    def append(self, item, stamp: float):
+        if self._size == self.capacity:
+            self.popleft()
+        tail = (self._head + self._size) % self.capacity
+        self._items[tail] = item
+        self._stamps[tail] = stamp
+        self._size += 1
+
+    def popleft(self):
+        if not self._size:
+            raise IndexError("pop from an empty ring buffer")
+        item = self._items[self._head]
+        self._items[self._head] = None  # Don't keep evicted objects alive
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        if self.on_evict is not None:
+            self.on_evict(item)
+        return item
+
+    def expire(self, cutoff: float) -> int:
+        """Drop every item stamped before `cutoff`, returning how many were dropped"""
+        dropped = 0
+        while self._size and self._stamps[self._head] < cutoff:
+            self.popleft()
+            dropped += 1
+        return dropped
+
+    def clear(self):
+        while self._size:
+            self.popleft()
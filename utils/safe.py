@@ -1,18 +1,36 @@
 from disco.bot import Plugin
 from disco.api.http import APIException
 
+from utils.metrics import metrics, perf_counter_ns
+
 
 class JusticePlugin(Plugin):
 
+    def __init__(self, bot, config):
+        self._histograms = {}  # Listener or command -> its latency histogram
+        metrics.bind(bot.client)
+        super().__init__(bot, config)
+
+    def dispatch(self, typ, func, event, *args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return super().dispatch(typ, func, event, *args, **kwargs)
+        finally:
+            histogram = self._histograms.get(func)
+            if histogram is None:
+                histogram = self._histograms[func] = metrics.histogram(
+                    typ, func.name if typ == "command" else func.__qualname__)
+            histogram.record(perf_counter_ns() - start)
+
     @classmethod
     def get_docs(cls, name: str = None):
         funcs = []
         for attr in cls.__dict__.values():
             if hasattr(attr, 'docs'):
                 if name and name == attr.docs[0]:
-                    return name.docs
+                    return attr.docs
                 if not name:
-                    funcs.append(name.docs)
+                    funcs.append(attr.docs)
         return funcs
 
     def handle_exception(self, greenlet, event):
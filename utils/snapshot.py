@@ -0,0 +1,90 @@
+from collections import Counter
+from time import monotonic
+
+from disco.api.http import Routes
+from disco.types.user import User
+from gevent.event import AsyncResult
+
+
+class SnapshotStore:
+    """Members, users and channels, looked up from the gateway state before asking the REST API.
+
+    disco's state is kept up to date by gateway events, so most lookups never leave the process. Misses are fetched
+    over REST and cached for `ttl` seconds, and concurrent misses for the same object share a single request. The State
+    plugin binds the store to the client and drops cached objects the gateway says are gone.
+    """
+
+    def __init__(self, ttl: float = 5 * 60):
+        self.ttl = ttl
+        self.client = None
+        self._cache = {}  # (kind, key) -> (expires, value)
+        self._inflight = {}  # (kind, key) -> AsyncResult of the request being made
+        self.state_hits = Counter()
+        self.cache_hits = Counter()
+        self.shared = Counter()
+        self.fetches = Counter()
+
+    def bind(self, client):
+        self.client = client
+
+    @property
+    def saved(self) -> int:
+        """REST round-trips that lookups would otherwise have made"""
+        return sum(self.state_hits.values()) + sum(self.cache_hits.values()) + sum(self.shared.values())
+
+    def member(self, guild_id: int, user_id: int):
+        guild = self.client.state.guilds.get(guild_id)
+        return self._lookup("member", (guild_id, user_id), guild.members.get(user_id) if guild is not None else None,
+                            self.client.api.guilds_members_get, guild_id, user_id)
+
+    def user(self, user_id: int):
+        return self._lookup("user", user_id, self.client.state.users.get(user_id), self._fetch_user, user_id)
+
+    def channel(self, channel_id: int):
+        return self._lookup("channel", channel_id, self.client.state.channels.get(channel_id),
+                            self.client.api.channels_get, channel_id)
+
+    def _fetch_user(self, user_id: int):
+        return User.create(self.client, self.client.api.http(Routes.USERS_GET, dict(user=user_id)).json())
+
+    def _lookup(self, kind: str, key, local, fetch, *args):
+        if local is not None:
+            self.state_hits[kind] += 1
+            return local
+
+        cached = self._cache.get((kind, key))
+        if cached is not None:
+            if cached[0] > monotonic():
+                self.cache_hits[kind] += 1
+                return cached[1]
+            del self._cache[kind, key]
+
+        pending = self._inflight.get((kind, key))
+        if pending is not None:
+            self.shared[kind] += 1
+            return pending.get()  # Raises if the request it's waiting on failed
+
+        pending = self._inflight[kind, key] = AsyncResult()
+        self.fetches[kind] += 1
+        try:
+            value = fetch(*args)
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self._cache[kind, key] = monotonic() + self.ttl, value
+            pending.set(value)
+            return value
+        finally:
+            del self._inflight[kind, key]
+
+    def forget(self, kind: str, key):
+        self._cache.pop((kind, key), None)
+
+    def expire(self):
+        now = monotonic()
+        for cache_key in [cache_key for cache_key, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[cache_key]
+
+
+snapshots = SnapshotStore()
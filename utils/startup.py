@@ -0,0 +1,15 @@
+from collections import OrderedDict
+from time import monotonic
+import logging
+
+STARTED = monotonic()  # main.py imports this first thing, so it's as close to process start as we get
+
+log = logging.getLogger(__name__)
+marks = OrderedDict()  # Stage -> seconds since start
+
+
+def mark(stage: str):
+    """Record the first time a startup stage is reached"""
+    if stage not in marks:
+        marks[stage] = monotonic() - STARTED
+        log.info("%s %.2fs after start", stage.capitalize(), marks[stage])
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import sqlite3
+
+from gevent import sleep, spawn
+from gevent.event import Event
+
+from utils.ipc import link
+
+# Column types: (SQLite type, value -> column, column -> value)
+TYPES = {
+    int: ("INTEGER", int, int),
+    bool: ("INTEGER", int, bool),
+    str: ("TEXT", str, str),
+    dict: ("TEXT", json.dumps, json.loads),
+    list: ("TEXT", json.dumps, json.loads),
+}
+
+# Table name -> columns, every table is keyed by an integer ID
+SCHEMA = {
+    "mutes": (("start", int), ("length", int), ("guild_id", int)),
+    "watching": (("channel_id", int),),
+    "lockdown": (("state", str), ("everyone", int), ("everyone_locked", bool), ("invites", dict),
+                 ("overwrites", dict), ("deleted", list), ("locked", list), ("recreated", list), ("restored", list)),
+}
+INDEXES = {"watching": ("channel_id",)}
+
+log = logging.getLogger(__name__)
+
+
+class Table:
+    """One namespace of rows by integer key, read from memory and written back to SQLite by the store.
+
+    Rows are dicts of the table's columns. Writes only mark the key dirty, and the store commits the row as it is at
+    commit time, so rows changed in place must be `touch`ed to be saved. When running as several shards, `subscribers`
+    are called with (key, row) for rows other shards changed, row being None once deleted.
+    """
+
+    def __init__(self, store: "Store", name: str, columns: tuple, indexed: tuple = ()):
+        self.store = store
+        self.name = name
+        self.columns = columns
+        self.rows = {}
+        self._indexes = {column: {} for column in indexed}  # column -> value -> keys
+        self.dirty = set()
+        self.subscribers = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key: int):
+        return key in self.rows
+
+    def __getitem__(self, key: int) -> dict:
+        return self.rows[key]
+
+    def __setitem__(self, key: int, row: dict):
+        self._set(key, row)
+        self.touch(key)
+
+    def __delitem__(self, key: int):
+        self._unindex(key)
+        del self.rows[key]
+        self.touch(key)
+
+    def _set(self, key: int, row: dict):
+        self._unindex(key)
+        self.rows[key] = row
+        for column, index in self._indexes.items():
+            index.setdefault(row[column], set()).add(key)
+
+    def apply(self, key: int, row: dict = None):
+        """Take a change another shard committed already, without writing it again"""
+        if row is None:
+            self._unindex(key)
+            self.rows.pop(key, None)
+        else:
+            self._set(key, row)
+        for subscriber in self.subscribers:
+            subscriber(key, row)
+
+    def get(self, key: int, default=None):
+        return self.rows.get(key, default)
+
+    def pop(self, key: int, default=None):
+        if key not in self.rows:
+            return default
+        row = self.rows[key]
+        del self[key]
+        return row
+
+    def items(self):
+        return self.rows.items()
+
+    def find(self, column: str, value):
+        """Any key whose row has `value` in an indexed column, or None"""
+        keys = self._indexes[column].get(value)
+        return next(iter(keys)) if keys else None
+
+    def touch(self, key: int):
+        self.dirty.add(key)
+        self.store.changed()
+
+    def _unindex(self, key: int):
+        row = self.rows.get(key)
+        if row is None:
+            return
+        for column, index in self._indexes.items():
+            keys = index.get(row[column])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[row[column]]
+
+    def create(self, db: sqlite3.Connection):
+        columns = ", ".join("{0} {1} NOT NULL".format(name, TYPES[typ][0]) for name, typ in self.columns)
+        db.execute("CREATE TABLE IF NOT EXISTS {0} (id INTEGER PRIMARY KEY, {1})".format(self.name, columns))
+        # Columns added since the table was made, older rows get the type's empty value (0, '' or false)
+        existing = {row[1] for row in db.execute("PRAGMA table_info({0})".format(self.name))}
+        for name, typ in self.columns:
+            if name not in existing:
+                db.execute("ALTER TABLE {0} ADD COLUMN {1} {2} NOT NULL DEFAULT {3!r}".format(
+                    self.name, name, TYPES[typ][0], TYPES[typ][1](typ())))
+        for column in self._indexes:
+            db.execute("CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})".format(self.name, column))
+
+    def load(self, db: sqlite3.Connection):
+        names = [name for name, _ in self.columns]
+        for key, *values in db.execute("SELECT id, {0} FROM {1}".format(", ".join(names), self.name)):
+            self[key] = {name: TYPES[typ][2](value) for (name, typ), value in zip(self.columns, values)}
+        self.dirty.clear()
+
+    def write(self, db: sqlite3.Connection) -> int:
+        """Write the dirty rows as part of the store's open transaction, they stay dirty until it commits"""
+        dirty = self.dirty
+        upserts = [(key, *(TYPES[typ][1](self.rows[key][name]) for name, typ in self.columns))
+                   for key in dirty if key in self.rows]
+        deletes = [(key,) for key in dirty if key not in self.rows]
+        if upserts:
+            db.executemany("INSERT OR REPLACE INTO {0} VALUES ({1})".format(
+                self.name, ", ".join("?" * (len(self.columns) + 1))), upserts)
+        if deletes:
+            db.executemany("DELETE FROM {0} WHERE id = ?".format(self.name), deletes)
+        return len(dirty)
+
+
+class Store:
+    """Bot state in SQLite, one table per namespace.
+
+    Reads are served from memory. Changes are committed by one greenlet in a single WAL transaction per `interval`
+    seconds, so a burst of writes costs one sync to disk and a crash loses at most the last window, never half of it.
+    Shards share the database, and send each other the rows of every commit through the hub to keep up to date.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.interval = 0.05
+        self.tables = {name: Table(self, name, columns, INDEXES.get(name, ())) for name, columns in SCHEMA.items()}
+        self.mutes = self.tables["mutes"]
+        self.watching = self.tables["watching"]
+        self.lockdown = self.tables["lockdown"]
+        self.commits = 0
+        self.rows_written = 0
+        self._changed = Event()
+        self._writer = None
+
+    def open(self, path: str, legacy_path: str = None, interval: float = 0.05):
+        """Open the database and start committing, once. `legacy_path` is a disco JSON storage file to import"""
+        if self.db is not None:
+            return
+        self.interval = interval
+        link.on("store", self.apply)  # Before loading, so nothing committed in between is missed
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        with self.db:
+            for table in self.tables.values():
+                table.create(self.db)
+        for table in self.tables.values():
+            table.load(self.db)
+        if legacy_path and os.path.exists(legacy_path):
+            if not any(self.tables.values()):  # Otherwise it was imported already, and only the rename didn't happen
+                self.migrate(legacy_path)
+            os.replace(legacy_path, legacy_path + ".migrated")
+        self._writer = spawn(self._write_loop)
+
+    def migrate(self, path: str):
+        """Import MUTES, WATCHING and LOCKDOWN from disco's JSON storage"""
+        with open(path) as f:
+            data = json.load(f) or {}
+        for member_id, mute in data.get("MUTES", {}).items():
+            self.mutes[int(member_id)] = {"start": int(mute["start"]), "length": int(mute["length"]),
+                                          "guild_id": 0}  # From before guilds were recorded, see ModPlug.unmute
+        for user_id, channel_id in data.get("WATCHING", {}).items():
+            self.watching[int(user_id)] = {"channel_id": int(channel_id)}
+        for guild_id, record in data.get("LOCKDOWN", {}).items():
+            if isinstance(record, int):  # Before lockdowns were resumable only @everyone's permissions were kept
+                log.warning("Guild %s has a lockdown from before they were recorded in full, treating it as locked "
+                            "down so `]release` restores @everyone's permissions", guild_id)
+                record = {"state": "locked", "everyone": record, "everyone_locked": True, "invites": {},
+                          "overwrites": {}, "deleted": [], "locked": [], "recreated": [], "restored": []}
+            self.lockdown[int(guild_id)] = record
+        self.commit()
+
+    def changed(self):
+        self._changed.set()
+
+    def commit(self) -> int:
+        written = 0
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for table in self.tables.values():
+                written += table.write(self.db)
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        changes = []
+        for table in self.tables.values():
+            changes.extend((table.name, key, table.rows.get(key)) for key in table.dirty)
+            table.dirty.clear()
+        if changes:
+            link.publish("store", changes)
+        self.commits += 1
+        self.rows_written += written
+        return written
+
+    def apply(self, changes: list):
+        for name, key, row in changes:
+            self.tables[name].apply(key, row)
+
+    def _write_loop(self):
+        while True:
+            self._changed.wait()
+            sleep(self.interval)  # Let the rest of the burst pile up
+            self._changed.clear()
+            try:
+                self.commit()
+            except Exception:  # Whatever it was, this greenlet is the only one saving anything, it can't die
+                log.exception("Could not commit, retrying")  # The rows stay dirty for the next try
+                self._changed.set()
+                sleep(1)
+
+    def close(self):
+        if self.db is None:
+            return
+        if self._writer is not None:
+            self._writer.kill()
+            self._writer = None
+        self.commit()
+        self.db.close()
+        self.db = None
+
+
+storage = Store()
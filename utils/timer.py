@@ -0,0 +1,125 @@
+from time import time
+
+from gevent import spawn
+from gevent.event import Event
+from gevent.pool import Pool as GreenPool
+
+
+class TimerHeap:
+    """Min-heap of (due, key) entries that tracks where each key sits, so any key can be moved or removed in O(log n)"""
+
+    def __init__(self):
+        self._heap = []  # [due, key] pairs
+        self._index = {}  # key -> position in the heap
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def peek(self):
+        return self._heap[0] if self._heap else None
+
+    def push(self, key, due: float):
+        if key in self._index:
+            i = self._index[key]
+            self._heap[i][0] = due
+            self._sift_down(self._sift_up(i))
+        else:
+            self._heap.append([due, key])
+            self._index[key] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+
+    def pop(self):
+        due, key = self._heap[0]
+        self.remove(key)
+        return key
+
+    def remove(self, key) -> bool:
+        i = self._index.pop(key, None)
+        if i is None:
+            return False
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._index[last[1]] = i
+            self._sift_down(self._sift_up(i))
+        return True
+
+    def _swap(self, i: int, j: int):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._index[heap[i][1]] = i
+        self._index[heap[j][1]] = j
+
+    def _sift_up(self, i: int) -> int:
+        while i:
+            parent = (i - 1) // 2
+            if self._heap[parent][0] <= self._heap[i][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+        return i
+
+    def _sift_down(self, i: int):
+        size = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self._heap[child][0] < self._heap[smallest][0]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
+class Scheduler:
+    """Calls `callback(key)` once each key's deadline passes, all from one greenlet.
+
+    The greenlet only wakes for the earliest deadline (or when an earlier one is scheduled). Overdue keys, like those
+    piled up over a restart, are handed to a pool of at most `concurrency` greenlets rather than all at once.
+    """
+
+    def __init__(self, callback, concurrency: int = 5):
+        self.callback = callback
+        self.timers = TimerHeap()
+        self._wake = Event()
+        self._workers = GreenPool(concurrency)
+        self._runner = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def start(self):
+        if self._runner is None:
+            self._runner = spawn(self._run)
+
+    def stop(self):
+        if self._runner is not None:
+            self._runner.kill()
+            self._runner = None
+        self._workers.kill()
+
+    def schedule(self, key, due: float):
+        self.timers.push(key, due)
+        if self.timers.peek()[1] == key:  # New earliest deadline, the runner may be sleeping past it
+            self._wake.set()
+
+    def cancel(self, key) -> bool:
+        return self.timers.remove(key)
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            head = self.timers.peek()
+            if head is None:
+                self._wake.wait()
+            elif head[0] > time():
+                self._wake.wait(head[0] - time())
+            else:
+                self._workers.spawn(self.callback, self.timers.pop())  # Blocks while the pool is full
@@ -1,19 +1,26 @@
-from datetime import datetime
-import weakref
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from time import monotonic, time
 
-from disco.bot import Plugin
+from utils.bucket import RateTracker
+from utils.cohort import DISCORD_EPOCH, Cohort, analyze
+from utils.lsh import NearDupIndex
+from utils.metrics import metrics
+from utils.ring import RingBuffer
 
-
-def creation_date(snowflake: int) -> datetime:
-    return datetime.fromtimestamp((snowflake >> 22) + 1420070400000)
+# Stand-ins for members restored from a warm start snapshot, with just what the member pool looks at
+PooledUser = namedtuple("PooledUser", "username avatar")
+PooledMember = namedtuple("PooledMember", "id user")
 
 
 class RaidSession:
 
-    def __init__(self):
+    def __init__(self, retention: int = 300, max_raiders: int = 5000):
         self.active_raid = False
         self._severity = {}
-        self.raiders = weakref.WeakValueDictionary()
+        self.retention = retention
+        self.max_raiders = max_raiders
+        self.raiders = OrderedDict()  # Least recently seen first
 
     @property
     def severity(self):
@@ -22,71 +29,176 @@ class RaidSession:
     def change_severity(self, value: int, pool: str):
         self._severity[pool] = value
 
-    def attach(self, rid: int, func, *args, **kwargs):  # I want to use weakref, so this is a work around.
+    def attach(self, rid: int, func, *args, **kwargs):
         r = self.raiders.get(rid)
         if r is None:
             r = Raider(rid)
             self.raiders[rid] = r
+            if len(self.raiders) > self.max_raiders:
+                self.raiders.popitem(last=False)
+        else:
+            r.seen = monotonic()
+            self.raiders.move_to_end(rid)
         func(r, *args, **kwargs)
 
+    def dump(self, offset: float) -> tuple:
+        """The raid flag and raiders as plain data, `offset` turns monotonic times into wall clock ones"""
+        return self.active_raid, [(r.id, r.joined, r.seen + offset, r.total, r.msg_ids.tolist(), r.channel_ids.tolist())
+                                  for r in self.raiders.values()]
+
+    def restore(self, data: tuple, offset: float):
+        self.active_raid, raiders = data
+        for rid, joined, seen, total, msg_ids, channel_ids in raiders:
+            r = self.raiders[rid] = Raider(rid)
+            r.joined, r.seen, r.total = joined, seen - offset, total
+            r.msg_ids.extend(msg_ids)
+            r.channel_ids.extend(channel_ids)
+            r.content_hashes.extend([0] * len(msg_ids))  # hash() is salted per process, so these can't carry over
+
+    def prune(self, now: float):
+        """Forget raiders that haven't been seen for `retention` seconds, unless a raid is being handled"""
+        if self.active_raid:
+            return
+        while self.raiders:
+            raider = next(iter(self.raiders.values()))
+            if now - raider.seen < self.retention:
+                break
+            del self.raiders[raider.id]
+
 
 class Pool:
 
-    def __init__(self, session: RaidSession, plugin: Plugin, interval: int):
+    def __init__(self, session: RaidSession, window: int, capacity: int):
         self.session = session
-        self.plugin = plugin
-        self.interval = interval
-        self.pool = []
+        self.window = window
+        self.pool = RingBuffer(capacity, on_evict=self._evicted)
+        self._tracked = deque()  # Aggregate keys for each pooled object, captured on insert
         self.past_severity = 0
-        self.plugin.register_schedule(self.drain, interval)
 
     def change_severity(self, value: int):
         self.session.change_severity(value, self.__class__.__name__)
 
+    def expire(self, now: float) -> int:
+        if self.session.active_raid:  # Keep the evidence while a raid is being handled
+            return 0
+        return self.pool.expire(now - self.window)
+
     def drain(self):
-        if self.pool and not self.session.active_raid:
-            self.pool.pop(0)
+        now = monotonic()
+        self.session.prune(now)
+        if self.expire(now):
+            self.check_contents()
+
+    def _evicted(self, obj):
+        self.discard(self._tracked.popleft())
+
+    def keys(self, obj) -> tuple:
+        """Extract what the running aggregates need from `obj`, so later changes to it can't skew them"""
+        return ()
+
+    def track(self, keys: tuple):
+        pass
+
+    def discard(self, keys: tuple):
+        pass
 
     def check_contents(self):
         raise NotImplementedError
 
-    def fill(self, obj):
-        self.pool.append(obj)
+    def restore(self, obj, stamp: float):
+        """Put back an object pooled at monotonic time `stamp`, without scoring it"""
+        keys = self.keys(obj)
+        self.pool.append(obj, stamp)
+        self._tracked.append(keys)
+        self.track(keys)
+
+    def fill(self, obj, keys: tuple = None):
+        now = monotonic()
+        self.expire(now)
+        if keys is None:
+            keys = self.keys(obj)
+        self.pool.append(obj, now)
+        self._tracked.append(keys)
+        self.track(keys)
         self.check_contents()
 
 
+def _decrement(counter: Counter, key):
+    if counter[key] <= 1:
+        del counter[key]
+    else:
+        counter[key] -= 1
+
+
 class MemberPool(Pool):
 
-    def __init__(self, session: RaidSession, plugin: Plugin, inveral: int = 10, max_members: int = 3):
+    def __init__(self, session: RaidSession, max_members: int = 3, window: int = 30, capacity: int = 1000,
+                 cohort_ratio: float = 0.75, cohort_interval: float = 0.5):
         self.max_members = max_members
-        super().__init__(session, plugin, inveral)
+        self.usernames = Counter()
+        self.avatarless = 0
+        self.cohort_ratio = cohort_ratio
+        self.cohort_interval = cohort_interval
+        self._cohort = Cohort(0, 0, 0.0, 0)
+        self._cohort_at = 0.0
+        self._cohort_stale = False
+        super().__init__(session, window, capacity)
 
     def fill(self, member):
         self.session.attach(member.id, Raider.set_join_raid, member)
         super().fill(member)
 
+    def keys(self, member) -> tuple:
+        return member.user.username, member.user.avatar is None
+
+    def track(self, keys: tuple):
+        username, avatarless = keys
+        self.usernames[username] += 1
+        self.avatarless += avatarless
+        self._cohort_stale = True
+
+    def discard(self, keys: tuple):
+        username, avatarless = keys
+        _decrement(self.usernames, username)
+        self.avatarless -= avatarless
+        self._cohort_stale = True
+
+    def dump(self, offset: float) -> list:
+        return [(stamp + offset, member.id, member.user.username, member.user.avatar is None)
+                for member, stamp in self.pool.stamped()]
+
+    def restore_all(self, data: list, offset: float):
+        for stamp, member_id, username, avatarless in data:
+            self.restore(PooledMember(member_id, PooledUser(username, None if avatarless else "")), stamp - offset)
+        self.check_contents()
+
+    def cohort(self) -> Cohort:
+        """Creation time breakdown of the pool, re-analyzed at most every `cohort_interval` unless it doubled in size"""
+        now = monotonic()
+        size = len(self.pool)
+        if self._cohort_stale and (now - self._cohort_at >= self.cohort_interval or size >= 2 * self._cohort.size):
+            self._cohort = analyze((member.id for member in self.pool), time())
+            self._cohort_at = now
+            self._cohort_stale = False
+        return self._cohort
+
+    def drain(self):
+        super().drain()
+        if self._cohort_stale:  # Catch up on joins that arrived while the analysis was throttled
+            self.check_contents()
+
+    @metrics.timed
     def check_contents(self):
-        severity = len(self.pool) // self.max_members
-        if len(self.pool) > self.max_members:
+        size = len(self.pool)
+        severity = size // self.max_members
+        if size > self.max_members:
 
-            if all(member.user.avatar is None for member in self.pool):
+            if self.avatarless == size:
                 severity += 2
-
-            init_creation = creation_date(self.pool[0].id)
-            for member in self.pool[1:]:
-                member_creation = creation_date(member.id)
-                works = False
-                for time_type in ('year', 'month', 'day'):
-                    if getattr(init_creation, time_type) != getattr(member_creation, time_type):
-                        break
-                else:
-                    works = True
-                if not works:
-                    break
-            else:
+            cohort = self.cohort()
+            if cohort.clustered >= cohort.size * self.cohort_ratio:  # Most accounts made together, not just all
                 severity += 4
-            init_name = self.pool[0].user.username
-            if all(member.user.username == init_name for member in self.pool):
+            if len(self.usernames) == 1:
                 severity += 6
 
         if severity != self.past_severity:
@@ -96,23 +208,73 @@ class MemberPool(Pool):
 
 class MessagePool(Pool):
 
-    def __init__(self, session: RaidSession, plugin: Plugin, inveral: int = 2, max_messages: int = 6):
+    def __init__(self, session: RaidSession, max_messages: int = 6, window: int = 12, capacity: int = 1000,
+                 channel_limit: tuple = (1.0, 10), author_limit: tuple = (0.5, 5), guild_limit: tuple = (6.0, 40)):
         self.max_messages = max_messages
-        super().__init__(session, plugin, inveral)
-
-    def fill(self, msg):
-        self.session.attach(msg.author.id, Raider.add_msg, msg)
-        super().fill(msg)
+        self.contents = Counter()
+        self.authors = Counter()
+        self.near_dups = NearDupIndex()
+        self.channel_rates = RateTracker(*channel_limit)  # (messages per second, burst)
+        self.author_rates = RateTracker(*author_limit)
+        self.guild_rates = RateTracker(*guild_limit)  # One bucket, for busier than a busy guild gets
+        super().__init__(session, window, capacity)
+
+    def fill(self, msg, content_hash: int = None):
+        """Pool `msg`, `content_hash` saves hashing its content again when the classifier has done it already"""
+        if content_hash is None:
+            content_hash = hash(msg.content)
+        self.session.attach(msg.author.id, Raider.add_msg, msg, content_hash)
+        now = monotonic()
+        self.channel_rates.hit(msg.channel_id, now)
+        self.author_rates.hit(msg.author.id, now)
+        self.guild_rates.hit(0, now)
+        super().fill(msg, self.keys(msg, content_hash))
 
+    def drain(self):
+        now = monotonic()
+        self.channel_rates.expire(now)
+        self.author_rates.expire(now)
+        self.guild_rates.expire(now)
+        super().drain()
+
+    def keys(self, msg, content_hash: int = None) -> tuple:
+        if content_hash is None:
+            content_hash = hash(msg.content)
+        return content_hash, msg.author.id, msg.id, self.near_dups.signature(msg.content)
+
+    def track(self, keys: tuple):
+        content, author, msg_id, signature = keys
+        self.contents[content] += 1
+        self.authors[author] += 1
+        self.near_dups.add(msg_id, signature)
+
+    def discard(self, keys: tuple):
+        content, author, msg_id, _ = keys
+        _decrement(self.contents, content)
+        _decrement(self.authors, author)
+        self.near_dups.remove(msg_id)
+
+    def spammed(self, raider) -> bool:
+        """Whether any of `raider`'s pooled messages was posted, word for word or nearly, `max_messages` times or more"""
+        return any(self.contents[content] >= self.max_messages for content in raider.content_hashes) or any(
+            self.near_dups.cluster_size(msg_id) >= self.max_messages for msg_id in raider.msg_ids)
+
+    @metrics.timed
     def check_contents(self):
-        severity = len(self.pool) // self.max_messages
+        # The guild as a whole, or a single channel or author, going well past its own rate, whichever is worse.
+        # Either is enough for the content bonuses, so a raid spread over many channels and accounts still scores
+        now = monotonic()
+        _, channel_overdraft = self.channel_rates.hottest(now)
+        _, author_overdraft = self.author_rates.hottest(now)
+        _, guild_overdraft = self.guild_rates.hottest(now)
+        severity = int(max(guild_overdraft, channel_overdraft + author_overdraft)) // self.max_messages
         if severity:
 
-            init_message = self.pool[0].content
-            if all(m.content == init_message for m in self.pool):
+            if len(self.contents) == 1:
                 severity += 3
-            init_author = self.pool[0].author.id
-            if all(m.author.id == init_author for m in self.pool):
+            else:  # Copy-paste spam with random padding, scaled by how much of it there is
+                severity += min(3, self.near_dups.largest // self.max_messages)
+            if len(self.authors) == 1:
                 severity += 1
             if severity > self.past_severity:
                 self.past_severity = severity
@@ -120,11 +282,20 @@ class MessagePool(Pool):
 
 
 class Raider:
+    """What we remember about a possible raider, without holding on to their members or messages"""
+
+    __slots__ = ("id", "joined", "seen", "total", "msg_ids", "channel_ids", "content_hashes")
+
+    retain = 50  # Messages kept per raider, older ones are only counted
 
     def __init__(self, id: int):
         self.id = id
-        self._join_raid = lambda: None
-        self.msg_raid = weakref.WeakSet()
+        self.joined = 0.0
+        self.seen = monotonic()
+        self.total = 0
+        self.msg_ids = array("Q")
+        self.channel_ids = array("Q")
+        self.content_hashes = array("q")
 
     @property
     def mention(self):
@@ -132,15 +303,22 @@ class Raider:
 
     @property
     def join_raid(self):
-        return self._join_raid()
+        return bool(self.joined)
 
-    def set_join_raid(self, value):
-        value._link = self
-        self._join_raid = weakref.ref(value)
+    def set_join_raid(self, member):
+        self.joined = time()
 
     def msg_count(self):
-        return len(self.msg_raid)
-
-    def add_msg(self, message):
-        message._link = self
-        self.msg_raid.add(message)
+        return self.total
+
+    def timestamps(self):
+        return [((msg_id >> 22) + DISCORD_EPOCH) / 1000 for msg_id in self.msg_ids]
+
+    def add_msg(self, message, content_hash: int = None):
+        self.total += 1
+        self.msg_ids.append(message.id)
+        self.channel_ids.append(message.channel_id)
+        self.content_hashes.append(hash(message.content) if content_hash is None else content_hash)
+        if len(self.msg_ids) >= 2 * self.retain:  # Trim in batches so appends stay amortized O(1)
+            for records in (self.msg_ids, self.channel_ids, self.content_hashes):
+                del records[:-self.retain]
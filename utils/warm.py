@@ -0,0 +1,72 @@
+from time import monotonic, time
+import logging
+import marshal
+import os
+import zlib
+
+import utils.config as config
+from utils.startup import mark
+
+MAGIC = b"JWS1"
+
+log = logging.getLogger(__name__)
+
+
+class WarmStart:
+    """A snapshot of the state that's slow to rebuild after a restart, saved every so often and read back at load.
+
+    Plugins `register` a section with a `dump()` that returns plain data (numbers, strings, tuples, lists and dicts),
+    and a `restore(data)` that's called right away with that section of the last snapshot, if there's a recent enough
+    one. That happens while plugins load, before the gateway connects. The file is marshal'd and zlib compressed.
+    """
+
+    def __init__(self, path: str, max_age: float):
+        self.path = path
+        self.max_age = max_age
+        self.sections = {}  # Name -> dump function
+        self._loaded = None
+        self.saved_at = None
+        self.save_seconds = 0.0
+        self.size = 0
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return {}
+        try:
+            if not blob.startswith(MAGIC):
+                raise ValueError("not a snapshot")
+            version, saved_at, sections = marshal.loads(zlib.decompress(blob[len(MAGIC):]))
+        except (ValueError, EOFError, TypeError, zlib.error) as e:
+            log.warning("Ignoring unreadable warm start snapshot %s: %s", self.path, e)
+            return {}
+        if version != marshal.version or time() - saved_at > self.max_age:
+            log.info("Ignoring warm start snapshot from %.0fs ago", time() - saved_at)
+            return {}
+        mark("snapshot loaded")
+        return sections
+
+    def register(self, name: str, dump, restore):
+        if self._loaded is None:
+            self._loaded = self._load()
+        self.sections[name] = dump
+        data = self._loaded.pop(name, None)
+        if data is not None:
+            restore(data)
+
+    def save(self):
+        started = monotonic()
+        blob = MAGIC + zlib.compress(marshal.dumps(
+            (marshal.version, time(), {name: dump() for name, dump in self.sections.items()})), 1)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, self.path)
+        self.saved_at = time()
+        self.save_seconds = monotonic() - started
+        self.size = len(blob)
+
+
+warm = WarmStart(config.WARM_START_PATH, config.WARM_START_MAX_AGE)
@@ -0,0 +1,114 @@
+from collections import Counter
+from time import monotonic, time
+import logging
+import os
+import sys
+import traceback
+
+from gevent import get_hub
+from gevent.monkey import get_original
+
+import utils.config as config
+from utils.ring import RingBuffer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS = os.path.join(ROOT, "plugins")
+
+log = logging.getLogger(__name__)
+
+
+class Stall:
+    __slots__ = ("started", "duration", "handler", "stack")
+
+    def __init__(self, started: float, handler: str, stack: list):
+        self.started = started  # Wall clock
+        self.duration = 0.0
+        self.handler = handler
+        self.stack = stack
+
+
+def _name(frame) -> str:
+    return getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+
+
+def blame(frame) -> str:
+    """The listener or command a frame was running for: the outermost plugin frame, else the innermost of ours"""
+    handler = ours = None
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(PLUGINS):
+            handler = _name(frame)
+        elif ours is None and filename.startswith(ROOT):
+            ours = _name(frame)
+        frame = frame.f_back
+    return handler or ours or "gevent"
+
+
+class Watchdog:
+    """Spots the event loop being held up for more than `threshold` seconds, and who held it.
+
+    A timer on the loop stamps the time every `threshold / 4` seconds. A native thread checks the stamp as often, and
+    once it's older than `threshold` samples the stack running on the loop's thread, so nothing is traced in between.
+    The last `capacity` stalls are kept, with how many of them each handler caused.
+    """
+
+    def __init__(self, threshold: float = 0.5, capacity: int = 50):
+        self.threshold = threshold
+        self.stalls = RingBuffer(capacity, on_evict=self._evicted)
+        self.handlers = Counter()  # Handler -> stalls of it still in `stalls`
+        self.total = 0
+        self._beat = monotonic()
+        self._timer = None
+        self._thread_id = None
+        self._running = False
+
+    def _evicted(self, stall: Stall):
+        self.handlers[stall.handler] -= 1
+        if not self.handlers[stall.handler]:
+            del self.handlers[stall.handler]
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread_id = get_original("_thread", "get_ident")()
+        loop = get_hub().loop
+        self._timer = loop.timer(0, self.threshold / 4)
+        self._timer.start(self._tick)
+        get_original("_thread", "start_new_thread")(self._watch, (loop,))
+
+    def stop(self):
+        self._running = False
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def _tick(self):
+        self._beat = monotonic()
+
+    def _watch(self, loop):
+        """Runs in its own native thread, gevent's patched sleep would need a loop of its own"""
+        sleep = get_original("time", "sleep")
+        reported = None
+        while self._running:
+            sleep(self.threshold / 4)
+            beat = self._beat
+            if beat == reported or monotonic() - beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            reported = beat
+            stall = Stall(time() - (monotonic() - beat), blame(frame), traceback.format_stack(frame)[-15:])
+            del frame
+            loop.run_callback_threadsafe(self._record, stall, beat)  # Runs once the loop is free again
+
+    def _record(self, stall: Stall, beat: float):
+        stall.duration = monotonic() - beat
+        self.total += 1
+        self.handlers[stall.handler] += 1
+        self.stalls.append(stall, stall.started)
+        log.warning("Event loop blocked for %.2fs by %s:\n%s", stall.duration, stall.handler, "".join(stall.stack))
+
+
+watchdog = Watchdog(config.STALL_THRESHOLD, config.STALL_HISTORY)